@@ -3,26 +3,63 @@ import matplotlib.pyplot as plt
 import nibabel as nib
 import numpy as np
 from matplotlib.widgets import Button
+from nibabel.fileslice import fileslice
+import argparse
+import csv
 import glob
+import gzip
 import os
+import shutil
+
+import nifti_slices
+
+# Interactive mode (default): one window per scan, "Apply" (rotate 90° clockwise) or "Continue".
+# With --record, every decision is appended to a CSV (file,rotate).
+#
+# Batch mode (--decisions CSV): no UI. The identity quaternion / qform fix and the in-plane
+# rotation are applied to the header only (the rotation becomes part of the affine), and the
+# voxel bytes of scan and mask are copied unchanged, streamed. With --rewrite-voxels the
+# rotation is instead applied to the voxel data, slice by slice in the stored dtype, giving
+# the same voxel layout as the interactive mode.
+#
+#   python 3-1__reorient_and_apply_identity.py --record 3-1__orientation_decisions.csv
+#   python 3-1__reorient_and_apply_identity.py --decisions 3-1__orientation_decisions.csv
+
+def oriented_path(path):
+    # Check if file already ends with "_oriented" to avoid duplicating it
+    if path.endswith(".nii.gz") and not path.endswith("_oriented.nii.gz"):
+        return path.replace(".nii.gz", "_oriented.nii.gz")
+    elif path.endswith(".nii") and not path.endswith("_oriented.nii"):
+        return path.replace(".nii", "_oriented.nii")
+    return path
+
+def record_decision(decisions_file, file_path, rotate):
+    new_file = not os.path.exists(decisions_file)
+    with open(decisions_file, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(['file', 'rotate'])
+        writer.writerow([file_path, int(rotate)])
 
 # Function to display the middle slice with an interactive correction option
-def display_and_correct(file_list):
+def display_and_correct(file_list, decisions_file=None):
     for file_path in file_list:
-        img = nib.load(file_path)
+        # Voxel data stay on disk (proxy); only the displayed slice is read here, and the
+        # volumes are read in their stored dtype (not float64) when the corrected files are written
+        img = nifti_slices.load(file_path)
         global data
-        data = img.get_fdata()
+        data = img.dataobj
 
         mask_file = file_path.replace("-T2", "-LesionSeg-T2")
         assert os.path.exists(mask_file)
-        mask_img = nib.load(mask_file)
+        mask_img = nifti_slices.load(mask_file)
         global mask_data
-        mask_data = mask_img.get_fdata()
+        mask_data = mask_img.dataobj
 
         # Display the middle slice
-        mid_slice = data.shape[2] // 2
+        mid_slice = nifti_slices.slice_count(img) // 2
         fig, ax = plt.subplots()
-        ax.imshow(data[:, :, mid_slice], cmap="gray")
+        ax.imshow(nifti_slices.read_slices(img, [mid_slice])[mid_slice], cmap="gray")
         ax.set_title(f"File: {file_path.split('/')[-1]} - Middle Slice")
         plt.axis("off")
 
@@ -33,35 +70,28 @@ def display_and_correct(file_list):
         img.header['qform_code']=1
         mask_img.header['qform_code']=1
         
-        # Check if file already ends with "_oriented" to avoid duplicating it
-        if file_path.endswith(".nii.gz") and not file_path.endswith("_oriented.nii.gz"):
-            corrected_path = file_path.replace(".nii.gz", "_oriented.nii.gz")
-        elif file_path.endswith(".nii") and not file_path.endswith("_oriented.nii"):
-            corrected_path = file_path.replace(".nii", "_oriented.nii")
-        else:
-            corrected_path = file_path
+        corrected_path = oriented_path(file_path)
+        rotated = [False]
 
         # Function to apply the rotation and save the corrected imagery/mask data
         def apply_rotation(event):
             global data, mask_data
-            data = np.rot90(data, k=-1, axes=(0, 1))  # Rotate main image 90° clockwise
-            mask_data = np.rot90(mask_data, k=-1, axes=(0, 1))
+            data = np.rot90(np.asanyarray(data), k=-1, axes=(0, 1))  # Rotate main image 90° clockwise
+            mask_data = np.rot90(np.asanyarray(mask_data), k=-1, axes=(0, 1))
+            rotated[0] = True
             continue_to_next(None)
 
         # Function to move to the next file
         def continue_to_next(event):
-            corrected_img = nib.Nifti1Image(data, img.affine, img.header)
+            if decisions_file:
+                record_decision(decisions_file, file_path, rotated[0])
+            corrected_img = nib.Nifti1Image(np.array(data), img.affine, img.header)
             nib.save(corrected_img, corrected_path)
             print(f"Saved corrected file as {corrected_path}")
         
             # Process and save the corresponding mask file
-            if mask_file.endswith(".nii.gz") and not mask_file.endswith("_oriented.nii.gz"):
-                corrected_mask_path = mask_file.replace(".nii.gz", "_oriented.nii.gz")
-            elif mask_file.endswith(".nii") and not mask_file.endswith("_oriented.nii"):
-                corrected_mask_path = mask_file.replace(".nii", "_oriented.nii")
-            else:
-                corrected_mask_path = mask_file
-            corrected_mask_img = nib.Nifti1Image(mask_data, mask_img.affine, mask_img.header)
+            corrected_mask_path = oriented_path(mask_file)
+            corrected_mask_img = nib.Nifti1Image(np.array(mask_data), mask_img.affine, mask_img.header)
             nib.save(corrected_mask_img, corrected_mask_path)
             print(f"Saved corrected mask file as {corrected_mask_path}")
             plt.close(fig)  # Close current figure to move to the next file
@@ -78,5 +108,107 @@ def display_and_correct(file_list):
 
         plt.show()
 
-files_ms_muslim_15t = glob.glob(os.path.expanduser('~/dissertation/data/MRI/Muslim_et_al/Patient-*/*[0-9]-T2.nii'), recursive=True)
-display_and_correct(files_ms_muslim_15t)
\ No newline at end of file
+
+#
+# Batch (header-only) mode
+#
+
+def rotation_index_map(shape):
+    """
+    Voxel-index affine G of np.rot90(data, k=-1, axes=(0, 1)): original index = G @ rotated index,
+    i.e. data[nx - 1 - j', i', k] == rotated[i', j', k].
+    """
+    nx = shape[0]
+    return np.array([[0, -1, 0, nx - 1],
+                     [1,  0, 0, 0],
+                     [0,  0, 1, 0],
+                     [0,  0, 0, 1]], dtype=float)
+
+def corrected_header(img, affine, shape):
+    """
+    Header nibabel would write for nib.Nifti1Image(<data of `shape`>, affine, header) after the
+    quatern_d / qform_code fix, keeping the stored dtype and the original scaling.
+    """
+    header = img.header.copy()
+    # replace invalid 0.0 value with identity
+    header['quatern_d'] = 1.0
+    # replace 'unknown' with 'scanner'
+    header['qform_code'] = 1
+    # zero-size stand-in for the voxel data: only its shape/dtype are used
+    stub = np.broadcast_to(np.zeros((), dtype=img.get_data_dtype()), shape)
+    new_img = nib.Nifti1Image(stub, affine, header)
+    new_img.update_header()
+    new_header = new_img.header
+    new_header['scl_slope'] = img.header['scl_slope']  # voxel bytes are copied unscaled
+    new_header['scl_inter'] = img.header['scl_inter']
+    return new_header
+
+def _open(path, mode):
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+
+def write_header_only(src_path, dst_path, header):
+    """Copy `src_path` with its header block replaced; voxel bytes are streamed unchanged."""
+    block = header.binaryblock
+    with _open(src_path, 'rb') as src, _open(dst_path, 'wb') as dst:
+        src.read(len(block))
+        dst.write(block)
+        shutil.copyfileobj(src, dst, 1 << 20)
+
+def write_rotated(img, dst_path, header, chunk_slices=16):
+    """
+    Write the voxel data rotated 90° clockwise in-plane in the stored dtype, reading `chunk_slices`
+    z-slices at a time from the source file (a forward stream for .nii.gz), so only one chunk is in memory.
+    """
+    proxy = img.dataobj
+    shape = proxy.shape
+    assert len(shape) == 3, f"expected a 3D volume, got shape {shape}"
+    dtype = header.get_data_dtype()
+    with _open(img.get_filename(), 'rb') as src, _open(dst_path, 'wb') as dst:
+        header.write_to(dst)
+        dst.write(b'\x00' * (int(header['vox_offset']) - dst.tell()))
+        for start in range(0, shape[2], chunk_slices):
+            # unscaled bytes of z-slices start..stop-1 (NIfTI data are Fortran-ordered)
+            block = fileslice(src, (slice(None), slice(None), slice(start, start + chunk_slices)),
+                              shape, proxy.dtype, proxy.offset, order='F')
+            for k in range(block.shape[2]):
+                dst.write(np.rot90(block[:, :, k], k=-1).astype(dtype, copy=False).tobytes(order='F'))
+
+def repair_file(file_path, rotate, rewrite_voxels=False):
+    img = nifti_slices.load(file_path)
+    corrected_path = oriented_path(file_path)
+    if not rotate:
+        write_header_only(file_path, corrected_path, corrected_header(img, img.affine, img.shape))
+    elif rewrite_voxels:
+        rotated_shape = (img.shape[1], img.shape[0]) + img.shape[2:]
+        write_rotated(img, corrected_path, corrected_header(img, img.affine, rotated_shape))
+    else:
+        # same world-space image as rotating the voxels: A' = A @ G^-1 for the unrotated data
+        affine = img.affine @ np.linalg.inv(rotation_index_map(img.shape))
+        write_header_only(file_path, corrected_path, corrected_header(img, affine, img.shape))
+    return corrected_path
+
+def batch_correct(decisions_file, rewrite_voxels=False):
+    """Apply the decisions in `decisions_file` (columns file,rotate) to every scan and its lesion mask."""
+    with open(decisions_file, newline='') as f:
+        decisions = list(csv.DictReader(f))
+    for row in decisions:
+        file_path = os.path.expanduser(row['file'])
+        rotate = bool(int(row['rotate']))
+        mask_file = file_path.replace("-T2", "-LesionSeg-T2")
+        assert os.path.exists(mask_file)
+        for path in (file_path, mask_file):
+            print(f"Saved corrected file as {repair_file(path, rotate, rewrite_voxels)}")
+
+if __name__ == '__main__': # best practice to prevent execution on import
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--decisions', help='CSV (file,rotate): batch mode without the button UI')
+    parser.add_argument('--rewrite-voxels', action='store_true',
+                        help='batch mode: rotate the voxel data instead of the affine')
+    parser.add_argument('--record', help='interactive mode: append decisions to this CSV')
+    args = parser.parse_args()
+
+    if args.decisions:
+        batch_correct(args.decisions, rewrite_voxels=args.rewrite_voxels)
+    else:
+        files_ms_muslim_15t = glob.glob(os.path.expanduser('~/dissertation/data/MRI/Muslim_et_al/Patient-*/*[0-9]-T2.nii'), recursive=True)
+        display_and_correct(files_ms_muslim_15t, decisions_file=args.record)
\ No newline at end of file
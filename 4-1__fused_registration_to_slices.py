@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Fused per-scan worker: N4 + rigid registration (step 4) -> lesion mask transforms (step 5)
+# -> export of the selected 43-slice range as grayscale PNGs (step 7's "Extract Slices to
+# Grayscale Files"), all in one job per scan, scheduled across scans by scheduler.py.
+#
+# The ANTs stages use the exact commands and manifests of 4__/5__ (pipeline.py), so stages
+# already completed by either script are skipped here and vice versa. The warped volume is
+# decompressed once, only for the selected z-range, and written straight to the slice folder
+# (`slice_{i:03d}.png`, per-slice min-max scaled to uint8 as in step 7), removing the copies
+# into `*_slices_<start>_<end>` folders and the repeated full-volume loads between stages.
+#
+# Slice ranges come from a CSV (scan, slice_start, slice_end, dest_dir) or are derived from
+# the step-7 selection folders already on disk:
+#
+#   python 4-1__fused_registration_to_slices.py --ranges slice_ranges.csv
+#   python 4-1__fused_registration_to_slices.py --from-selection-dirs
+#
+# ---
+#
+# `conda activate mri`
+
+import argparse
+import glob
+import os
+
+import pandas as pd
+
+import nifti_slices
+import pipeline
+import scheduler
+
+MRI_ROOT = os.path.expanduser('~/dissertation/data/MRI/')
+
+
+def t2_scans():
+    """The T2 scans registered by 4__rigid_registration_MI.py."""
+    patterns = [
+        'ISBI/testdata_website/test*/orig/*t2.nii.gz',
+        'ISBI/training/training*/orig/*t2.nii.gz',
+        'Muslim_et_al/Patient-*/*[0-9]-T2_oriented_z.nii',
+        'IXI/*HH*T2.nii.gz',
+        'IXI/*Guy*T2.nii.gz',
+        'IXI/*IOP*T2.nii.gz',
+    ]
+    return [f for pattern in patterns for f in glob.glob(os.path.join(MRI_ROOT, pattern))]
+
+
+def lesion_masks_for_scan(scan_path):
+    """Lesion masks paired with a scan in 5__ (ISBI: mask1/mask2 in ../masks/; Muslim et al.: *-LesionSeg-*)."""
+    if '/ISBI/training/' in scan_path:
+        mask_dir = os.path.dirname(scan_path).replace('/orig', '/masks')
+        stem = os.path.basename(scan_path).replace('t2.nii.gz', '')
+        return sorted(glob.glob(os.path.join(mask_dir, f'{stem}mask[12].nii')))
+    if '/Muslim_et_al/' in scan_path:
+        mask = scan_path.replace('-T2_oriented_z.nii', '-LesionSeg-T2_oriented_z.nii')
+        return [mask] if os.path.exists(mask) else []
+    return []
+
+
+def dest_dir_for(selection_dir, fname):
+    """Slice folder for a warped file in a step-7 selection folder (same rules as the step-7 notebook)."""
+    rel = os.path.relpath(selection_dir, MRI_ROOT)
+    if rel.startswith("ISBI/registered_test"):
+        return os.path.join(MRI_ROOT, f"_MS__ISBI_3T_test/{fname[4:9]}")
+    if rel.startswith("ISBI/registered_train"):
+        return os.path.join(MRI_ROOT, f"_MS__ISBI_3T_train/{fname[8:13]}")
+    if rel.startswith("IXI/registered_15T_Guys"):
+        return os.path.join(MRI_ROOT, f"_Healthy__IXI_15T_Guys/{fname[7:16]}")
+    if rel.startswith("IXI/registered_15T_IOP"):
+        return os.path.join(MRI_ROOT, f"_Healthy__IXI_15T_IOP/{fname[7:15]}")
+    if rel.startswith("IXI/registered_3T_HH"):
+        return os.path.join(MRI_ROOT, f"_Healthy__IXI_3T/{fname[7:14]}")
+    if rel.startswith("Muslim_et_al/registered_256x256"):
+        return os.path.join(MRI_ROOT, f"_MS__Muslim_et_al_15T/{fname[:2].split('-')[0]}")
+    return None
+
+
+def ranges_from_selection_dirs(scans):
+    """(scan, slice_start, slice_end, dest_dir) rows from the step-7 `*_slices_<start>_<end>` folders."""
+    warped_to_scan = {os.path.basename(pipeline.registration_paths(scan)['output_warped']): scan for scan in scans}
+    rows = []
+    for selection_dir in glob.glob(os.path.join(MRI_ROOT, '**/*_slices_*'), recursive=True):
+        if not os.path.isdir(selection_dir):
+            continue
+        slice_start, slice_end = (int(x) for x in os.path.basename(selection_dir).split("slices_")[-1].split("_"))
+        for fname in os.listdir(selection_dir):
+            dest_dir = dest_dir_for(selection_dir, fname)
+            if fname in warped_to_scan and dest_dir is not None:
+                rows.append({'scan': warped_to_scan[fname], 'slice_start': slice_start,
+                             'slice_end': slice_end, 'dest_dir': dest_dir})
+    return pd.DataFrame(rows, columns=['scan', 'slice_start', 'slice_end', 'dest_dir'])
+
+
+def slices_up_to_date(volume_path, slice_start, slice_end, dest_dir):
+    n_slices = nifti_slices.slice_count(volume_path)
+    pngs = [os.path.join(dest_dir, f"slice_{i:03d}.png") for i in range(slice_start, min(slice_end + 1, n_slices))]
+    volume_mtime = os.path.getmtime(volume_path)
+    return all(os.path.exists(png) and os.path.getmtime(png) >= volume_mtime for png in pngs)
+
+
+def process_scan(scan_path, slice_start, slice_end, dest_dir, threads=4):
+    env = pipeline.ants_env(threads)
+    paths = pipeline.registration_paths(scan_path)
+    scan_name = pipeline.strip_nifti_ext(scan_path)
+
+    # Step 1: N4 + rigid registration (skipped if unchanged since 4__ or an earlier run)
+    n4_result = pipeline.run_stage("n4", pipeline.n4_command(scan_path, paths['corrected_image']),
+                                   inputs=[scan_path], outputs=[paths['corrected_image']],
+                                   manifest_file=paths['manifest_file'], env=env)
+    if not pipeline.stage_succeeded(n4_result):
+        print(f"[ERROR] N4 {scan_name}:\n" + ("\n".join(n4_result.get('stderr_tail', [])) or n4_result.get('error', '')))
+        return n4_result['status']
+    result = pipeline.run_stage("rigid_registration",
+                                pipeline.rigid_registration_command(paths['corrected_image'], paths['output_prefix'],
+                                                                    paths['output_warped']),
+                                inputs=[paths['corrected_image'], pipeline.TEMPLATE_T2W],
+                                outputs=[paths['output_warped'], paths['output_transform']],
+                                manifest_file=paths['manifest_file'], env=env)
+    if not pipeline.stage_succeeded(result):
+        print(f"[ERROR] registration {scan_name}:\n" + ("\n".join(result.get('stderr_tail', [])) or result.get('error', '')))
+        return result['status']
+    statuses = [n4_result['status'], result['status']]
+
+    # Step 2: same transform applied to the scan's lesion masks (as 5__)
+    for lesion_mask in lesion_masks_for_scan(scan_path):
+        mask_paths = pipeline.mask_transform_paths(lesion_mask)
+        mask_result = pipeline.run_stage(
+            "apply_transform",
+            pipeline.apply_transform_command(lesion_mask, paths['output_transform'], mask_paths['output_mask_transformed']),
+            inputs=[lesion_mask, paths['output_transform'], pipeline.TEMPLATE_T2W],
+            outputs=[mask_paths['output_mask_transformed']],
+            manifest_file=mask_paths['manifest_file'], env=env)
+        if not pipeline.stage_succeeded(mask_result):
+            print(f"[ERROR] mask transform {lesion_mask}:\n" + "\n".join(mask_result.get('stderr_tail', [])))
+            return mask_result['status']
+        statuses.append(mask_result['status'])
+
+    # Step 3: selected slice range straight from the warped volume to PNG
+    if slices_up_to_date(paths['output_warped'], slice_start, slice_end, dest_dir):
+        statuses.append('skipped')
+    else:
+        n_written = nifti_slices.export_slice_range(paths['output_warped'], slice_start, slice_end, dest_dir)
+        print(f"[OK] {scan_name}: {n_written} slices ({slice_start}-{slice_end}) -> {dest_dir}")
+        statuses.append('ok')
+
+    # 'ok' only when something actually ran, so cached runs don't skew the scheduler's timings
+    return 'ok' if 'ok' in statuses else 'skipped'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--ranges', help='CSV with columns scan, slice_start, slice_end, dest_dir')
+    source.add_argument('--from-selection-dirs', action='store_true',
+                        help='derive ranges from the step-7 *_slices_<start>_<end> folders under the MRI root')
+    parser.add_argument('--cores', type=int, default=None, help='default: detected allocation')
+    args = parser.parse_args()
+
+    ranges = pd.read_csv(args.ranges) if args.ranges else ranges_from_selection_dirs(t2_scans())
+    ranges['scan'] = ranges['scan'].map(os.path.expanduser)
+    ranges['dest_dir'] = ranges['dest_dir'].map(os.path.expanduser)
+    print(f"{len(ranges)} scans with a selected slice range.")
+
+    jobs = [scheduler.Job(key=row.scan, stage='fused_registration_to_slices', voxels=scheduler.voxel_count(row.scan),
+                          args=(row.scan, row.slice_start, row.slice_end, row.dest_dir))
+            for row in ranges.itertuples(index=False)]
+    results = scheduler.schedule(jobs, process_scan, cores=args.cores,
+                                 history=scheduler.TimingHistory('ants_job_timings.json'))
+
+    failed = [scan for scan, status in results.items() if status not in ('ok', 'skipped')]
+    print(f"Done: {len(results) - len(failed)} scans up to date, {len(failed)} failed.")
+    for scan in failed:
+        print(f"  FAILED: {scan}")
+
+
+if __name__ == '__main__': # best practice to prevent execution on import
+    main()
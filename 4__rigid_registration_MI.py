@@ -2,6 +2,7 @@
 # coding: utf-8
 
 # - Running via `nbconvert --to script` per multiprocessing
+#   - jobs/threads are packed to the allocation by scheduler.py (below is what was used)
 #   - 8 tasks/processes
 #     - (`#SBATCH --ntasks=8`)
 #   - 4 threads per task
@@ -66,95 +67,77 @@ files_healthy_ge15 = glob.glob(os.path.expanduser('~/dissertation/data/MRI/IXI/*
 # In[ ]:
 
 
-import multiprocessing
 import sys
 
-def process_scan(scan_path):
+import pipeline
+import scheduler
+
+def process_scan(scan_path, threads=4):
     import os
-    from subprocess import run
 
-    # Set environment variables for multi-threading
-    env = os.environ.copy()
-    env['OMP_NUM_THREADS'] = '4'  # Limits OpenMP threads
-    env['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'] = '4'  # Limits ITK threads
+    # Set environment variables for multi-threading (threads assigned by the scheduler)
+    env = pipeline.ants_env(threads)
 
     scan_path = os.path.expanduser(scan_path)
 
     # Get scan filename without extension
-    scan_name = os.path.basename(scan_path).replace(".nii.gz", "").replace(".nii", "")
+    scan_name = pipeline.strip_nifti_ext(scan_path)
     print(f"Processing scan: {scan_name}")
 
     # Get scan directory
     output_dir = os.path.dirname(scan_path)
     
     # Define output paths for bias-corrected image and registration
-    corrected_image = os.path.join(output_dir, f"{scan_name}_N4Corrected.nii.gz")
-    output_prefix = os.path.join(output_dir, f"{scan_name}_rigid_MI")
-    output_warped = f"{output_prefix}Warped.nii.gz"
-    output_transform = f"{output_prefix}0GenericAffine.mat"
+    paths = pipeline.registration_paths(scan_path)
+    corrected_image = paths['corrected_image']
+    output_prefix = paths['output_prefix']
+    output_warped = paths['output_warped']
+    output_transform = paths['output_transform']
     
     # Reference image for registration
-    reference_image = os.path.expanduser(
-        '~/.cache/templateflow/tpl-MNI152NLin2009cAsym/tpl-MNI152NLin2009cAsym_res-01_T2w.nii.gz'
-    )
+    reference_image = pipeline.TEMPLATE_T2W
     print(output_prefix)    
     
-    # Step 1: N4 Bias Field Correction
-    ## https://github.com/ANTsX/ANTs/wiki/N4BiasFieldCorrection
-    n4_command = [
-        "N4BiasFieldCorrection",
-        "-d", "3",  # 3D imagery
-        "-i", scan_path,  # Input image
-        "-o", corrected_image,  # Output corrected image
-        "-s", "2",  # Shrink factor 
-        "-c", "[50x50x50x50,0.0001]",  # Convergence criteria
-        "-b", "[200]",  # spline distance for the B-spline field (defines the coarseness of the bias field estimate)
-        "-v", "1",  # Verbose output
-    ]
+    # Step 1: N4 Bias Field Correction (command in pipeline.n4_command)
+    n4_command = pipeline.n4_command(scan_path, corrected_image)
+
+    # Per-scan manifest: stages whose inputs/parameters are unchanged and whose
+    # outputs still match are skipped, so interrupted runs resume where they stopped
+    manifest_file = paths['manifest_file']
 
     # Run N4 Bias Correction
     print(f"Running N4BiasFieldCorrection for {scan_path}...")
-    n4_result = run(n4_command, capture_output=True, text=True, env=env)
-    if n4_result.returncode != 0:
+    n4_result = pipeline.run_stage("n4", n4_command, inputs=[scan_path], outputs=[corrected_image],
+                                   manifest_file=manifest_file, env=env)
+    if not pipeline.stage_succeeded(n4_result):
         print(f"Error in N4BiasFieldCorrection for {scan_path}:")
-        print(n4_result.stderr)
-        return  # Skip registration if bias correction fails
+        print("\n".join(n4_result.get('stderr_tail', [])) or n4_result.get('error', ''))
+        return n4_result['status']  # Skip registration if bias correction fails
+    elif n4_result['status'] == 'skipped':
+        print(f"Bias-corrected image up to date: {corrected_image}.")
     else:
         print(f"Bias-corrected image saved to {corrected_image}.")
 
     
-    # Step 2: Rigid Registration
-    ants_command = [
-        "antsRegistration",                                                        # ANTs registration command
-        "--dimensionality", "3",                                                   # 3D imagery
-        "--float", "0",                                                            # Use double precision
-        "--output", f"[{output_prefix},{output_warped}]",                          # Output prefix
-        "--interpolation", "Linear",                                               # Interpolation method
-        "--winsorize-image-intensities", "[0.005,0.995]",                          # Intensity normalization
-        "--use-histogram-matching", "1", # Histogram matching helps align distribution differences caused by non-brain tissue, making similarity metric more effective
-        "--initial-moving-transform", f"[{reference_image},{corrected_image},1]",  # Initial transform
-        "--transform", "Rigid[0.1]",                                               # Rigid transformation
-        # Cross Correlation metric should work better than Mutual Information 
-        #       when same (e.g., T2-w) modality (according to documentation); 
-        #       however, on average across the different 1.5T/3T scans, MI 
-        #       appears to result in more consistent head positioning 
-        "--metric", f"MI[{reference_image},{corrected_image},1,32,Regular,0.25]",  # Mutual information metric
-        "--convergence", "[2000x1000x500x250,1e-6,10]",  # Convergence criteria (increased iterations to help account for non-brain tissue) 
-        "--shrink-factors", "12x8x4x2",      # Multi-resolution levels (increased to handle larger, more complex images due to inclusion of skull/dura)
-        "--smoothing-sigmas", "4x3x2x1vox",  # Smoothing at each level (increased to handle larger, more complex images due to inclusion of skull/dura)
-        "--verbose", "1"
-    ]
+    # Step 2: Rigid Registration (MI metric, multi-resolution; see pipeline.rigid_registration_command)
+    ants_command = pipeline.rigid_registration_command(corrected_image, output_prefix, output_warped, reference_image)
     
     # Run the command
     print(f"Registering {corrected_image}...")
-    result = run(ants_command, capture_output=True, text=True, env=env)
+    result = pipeline.run_stage("rigid_registration", ants_command,
+                                inputs=[corrected_image, reference_image],
+                                outputs=[output_warped, output_transform],
+                                manifest_file=manifest_file, env=env)
     
     # Check for errors
-    if result.returncode != 0:
+    if not pipeline.stage_succeeded(result):
         print(f"Error with {corrected_image}:")
-        print(result.stderr)
+        print("\n".join(result.get('stderr_tail', [])) or result.get('error', ''))
+    elif result['status'] == 'skipped':
+        print(f"Registration up to date for {corrected_image}.")
     else:
         print(f"Successfully registered {corrected_image}. Outputs saved to {output_dir}.")
+    return result['status']
 
 def main():
     # List of T2 scan paths
@@ -167,14 +150,20 @@ def main():
         *files_healthy_ge15
     ]
 
-    # Use multiprocessing Pool to process scans in parallel
-    num_processes = 8  # Number of parallel processes
-
-    # Handle Jupyter notebook environment for multiprocessing
-    multiprocessing.set_start_method('fork', force=True) # similar to 'spawn' on Windows
-
-    with multiprocessing.Pool(processes=num_processes) as pool:
-        pool.map(process_scan, t2_scans)
+    # Longest (largest) scans first; each job gets the cores free at launch, so ITK threads
+    # grow as the queue drains. Past timings in ants_job_timings.json refine the estimates.
+    jobs = [scheduler.Job(key=scan, stage='n4_rigid_registration',
+                          voxels=scheduler.voxel_count(scan), args=(scan,))
+            for scan in t2_scans]
+    history = scheduler.TimingHistory('ants_job_timings.json')
+    results = scheduler.schedule(jobs, process_scan, history=history)
+    statuses = [results[scan] for scan in t2_scans]
+
+    # Per-scan details (runtime, stderr tail) are in each scan's *_rigid_MI_manifest.json
+    failed = [scan for scan, status in zip(t2_scans, statuses) if status == 'failed']
+    print(f"Done: {len(t2_scans) - len(failed)} scans up to date, {len(failed)} failed.")
+    for scan in failed:
+        print(f"  FAILED: {scan}")
 
 if __name__ == '__main__': # best practice to prevent execution on import
     main()
@@ -0,0 +1,29 @@
+#conda activate mri
+#
+# Builds the per-slice lesion-load index (lesion_index.py) from the template-space lesion
+# masks written by 5__transform_lesion_masks_to_template_space.py, for every slice in the
+# selected slice folders, in parallel.
+#
+#   python 5-1__build_lesion_index.py                       # -> lesion_index.parquet
+
+import argparse
+import os
+
+import lesion_index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mri-root', default='~/dissertation/data/MRI/')
+    parser.add_argument('--output', default='lesion_index.parquet')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    index = lesion_index.build_lesion_index(args.mri_root, processes=args.processes)
+    lesion_index.write_lesion_index(index, args.output)
+    print(f"Indexed {len(index)} slices from {index[['dataset', 'scan_id']].drop_duplicates().shape[0]} scans "
+          f"({int((index['lesion_voxels'] > 0).sum())} with lesions) -> {args.output}")
+
+
+if __name__ == '__main__': # best practice to prevent execution on import
+    main()
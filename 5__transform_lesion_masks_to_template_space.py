@@ -2,6 +2,7 @@
 # coding: utf-8
 
 # - Running via `nbconvert --to script` per multiprocessing
+#   - jobs/threads are packed to the allocation by scheduler.py (below is what was used)
 #   - 8 tasks/processes
 #     - (`#SBATCH --ntasks=8`)
 #   - 4 threads per task
@@ -32,55 +33,47 @@
 
 import glob
 import os
-import multiprocessing
-from subprocess import run
 
-def process_scan(args):
+import pipeline
+import scheduler
+
+def process_scan(args, threads=4):
     lesion_mask, affine_transform = args
 
     if not os.path.exists(affine_transform):
         print(f"[SKIP] Missing transform: {affine_transform}")
-        return
+        return 'missing_transform'
     
-    # Set environment variables for multi-threading
-    env = os.environ.copy()
-    env['OMP_NUM_THREADS'] = '4'  # Limits OpenMP threads
-    env['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'] = '4'  # Limits ITK threads
+    # Set environment variables for multi-threading (threads assigned by the scheduler)
+    env = pipeline.ants_env(threads)
 
     lesion_mask = os.path.expanduser(lesion_mask)
     affine_transform = os.path.expanduser(affine_transform)
-    output_dir = os.path.dirname(lesion_mask)
-    
-    output_mask_transformed = os.path.join(
-        output_dir,
-        os.path.basename(lesion_mask).replace('.nii.gz', '').replace('.nii', '') + '_rigid_MIWarped.nii.gz'
-    )
     
-    # Reference image used in registration
-    reference_image = os.path.expanduser(
-        '~/.cache/templateflow/tpl-MNI152NLin2009cAsym/tpl-MNI152NLin2009cAsym_res-01_T2w.nii.gz'
-    )
+    paths = pipeline.mask_transform_paths(lesion_mask)
+    output_mask_transformed = paths['output_mask_transformed']
     
-    # Construct the antsApplyTransforms command
-    apply_command = [
-        "antsApplyTransforms",
-        "-d", "3",                                     # 3D image
-        "-i", lesion_mask,                             # Input image (mask)
-        "-r", reference_image,                         # Reference image (target space)
-        "-t", affine_transform,                        # Rigid/affine transform
-        "-o", output_mask_transformed,                 # Output filename
-        "-n", "NearestNeighbor"                        # Important: use nearest neighbor for masks
-    ]
+    # Construct the antsApplyTransforms command (nearest neighbor into the template grid)
+    apply_command = pipeline.apply_transform_command(lesion_mask, affine_transform, output_mask_transformed)
     
-    # Run the command
+    # Run the command (skipped if mask, transform, reference and parameters are unchanged
+    # and the warped mask still matches; see the per-mask *_rigid_MI_manifest.json)
     print(f"Transforming mask to template space: {os.path.basename(lesion_mask)}...")
-    result = run(apply_command, capture_output=True, text=True, env=env)
+    manifest_file = paths['manifest_file']
+    result = pipeline.run_stage("apply_transform", apply_command,
+                                inputs=[lesion_mask, affine_transform, pipeline.TEMPLATE_T2W],
+                                outputs=[output_mask_transformed],
+                                manifest_file=manifest_file, env=env)
     
     # Check for errors
-    if result.returncode != 0:
-        print(f"[ERROR] {lesion_mask}:\n{result.stderr}")
+    if not pipeline.stage_succeeded(result):
+        stderr = "\n".join(result.get('stderr_tail', [])) or result.get('error', '')
+        print(f"[ERROR] {lesion_mask}:\n{stderr}")
+    elif result['status'] == 'skipped':
+        print(f"[UP TO DATE] {lesion_mask} → {output_mask_transformed}")
     else:
         print(f"[OK] {lesion_mask} → {output_mask_transformed}")
+    return result['status']
 
 def main():
     # ISBI dataset (2:1 masks : .mat)
@@ -115,12 +108,16 @@ def main():
     # Combine both datasets
     all_pairs = isbi_pairs + muslim_pairs
 
-    # Use multiprocessing to apply transforms
-    num_processes = 8
-    multiprocessing.set_start_method('fork', force=True)
+    # Largest masks first, threads packed to the available cores (see scheduler.py)
+    jobs = [scheduler.Job(key=mask, stage='apply_transform',
+                          voxels=scheduler.voxel_count(os.path.expanduser(mask)), args=((mask, mat),))
+            for mask, mat in all_pairs]
+    history = scheduler.TimingHistory('ants_job_timings.json')
+    results = scheduler.schedule(jobs, process_scan, history=history)
+    statuses = [results[mask] for mask, _ in all_pairs]
 
-    with multiprocessing.Pool(processes=num_processes) as pool:
-        pool.map(process_scan, all_pairs)
+    failed = [mask for (mask, _), status in zip(all_pairs, statuses) if status not in ('ok', 'skipped')]
+    print(f"{len(all_pairs) - len(failed)} masks up to date, {len(failed)} failed or skipped.")
 
 if __name__ == '__main__': # best practice to prevent execution on import
     print('STARTING')
@@ -0,0 +1,159 @@
+#conda activate mri
+#
+# Batch proposer for the 43-slice window of every registered volume (step 7 without clicking).
+#
+# For each volume, a compact per-slice profile is computed from chunked proxy reads
+# (nifti_slices): mean intensity and head/brain-mask fraction per axial slice, on a strided
+# in-plane subsample, normalized by the volume's 99th percentile. Every candidate window
+# (low .. low+42) is scored in one vectorized pass against
+#   - the template profile (tpl-MNI152NLin2009cAsym T2w, window starting at --template-low), and
+#   - the mean window profile of scans already approved in the interactive selector
+#     (7__slice_range_selections.jsonl),
+# and the top proposals are written with a confidence (separation of the best window from the
+# best clearly different one). Scans below --min-confidence are listed for the interactive
+# viewer (`7__post_registration_slice_range_selector.py --scans 7-1__needs_review.txt`).
+#
+#   python 7-1__propose_slice_ranges.py --template-low 81 \
+#       ~/dissertation/data/MRI/IXI/*IOP*T2_rigid_MIWarped.nii.gz
+
+import argparse
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import nifti_slices
+import pipeline
+
+WINDOW = 43          # slices per selected range (low .. low+42)
+MASK_LEVEL = 0.15    # mask = voxels above this fraction of the volume's 99th percentile
+
+
+def slice_profile(path, chunk=16, stride=4):
+    """
+    Per-slice profile of a volume, float32 (n_slices, 2): [mean intensity, mask fraction].
+
+    The volume is read `chunk` slices at a time in its stored dtype and subsampled every
+    `stride` voxels in-plane, so the full float volume is never materialized.
+    """
+    img = nifti_slices.load(path)
+    n = nifti_slices.slice_count(img)
+    samples = []
+    for start in range(0, n, chunk):
+        block = nifti_slices.read_slice_range(img, start, start + chunk)
+        sub = block[::stride, ::stride, :]
+        samples.append(sub.reshape(-1, sub.shape[2]).astype(np.float32))
+    samples = np.concatenate(samples, axis=1)
+    p99 = max(float(np.percentile(samples, 99)), np.finfo(np.float32).eps)
+    intensity = samples.mean(axis=0) / p99
+    mask = (samples > MASK_LEVEL * p99).mean(axis=0)
+    return np.stack([intensity, mask], axis=1).astype(np.float32)
+
+
+def window_costs(profile, reference):
+    """Mean squared difference between every candidate window of `profile` and `reference` (WINDOW, 2)."""
+    if len(profile) < WINDOW:
+        return np.empty(0, dtype=np.float32)
+    windows = sliding_window_view(profile, (WINDOW, profile.shape[1]))[:, 0]   # (n - 42, 43, 2)
+    return ((windows - reference[None]) ** 2).mean(axis=(1, 2))
+
+
+def propose(profile, references, weights, top_k=3, exclusion=3):
+    """
+    Ranked candidate windows for one profile.
+
+    Returns (proposals, confidence): proposals as [(low, cost)], best first; confidence in [0, 1]
+    is 1 - best cost / best cost among windows more than `exclusion` slices away from the best.
+    """
+    costs = sum(w * window_costs(profile, ref) for ref, w in zip(references, weights))
+    if np.ndim(costs) == 0 or len(costs) == 0:
+        return [], 0.0
+    order = np.argsort(costs)
+    best = int(order[0])
+    far = np.abs(np.arange(len(costs)) - best) > exclusion
+    runner_up = costs[far].min() if far.any() else np.inf
+    confidence = float(1.0 - costs[best] / runner_up) if runner_up > 0 else 0.0
+    proposals, taken = [], []
+    for low in order:
+        if all(abs(int(low) - t) > exclusion for t in taken):
+            proposals.append((int(low), float(costs[low])))
+            taken.append(int(low))
+        if len(proposals) == top_k:
+            break
+    return proposals, confidence
+
+
+def approved_reference(selections, profiles):
+    """
+    Mean window profile of the approved selections (scan, low) whose profiles are available.
+
+    Returns the mean profile (None if no window fits) and the number of windows averaged.
+    """
+    windows = []
+    for record in selections:
+        profile = profiles.get(record['scan'])
+        if profile is not None and record['low'] + WINDOW <= len(profile):
+            windows.append(profile[record['low']:record['low'] + WINDOW])
+    return (np.mean(windows, axis=0) if windows else None), len(windows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('volumes', nargs='+', help='registered (template-space) volumes')
+    parser.add_argument('--template', default=pipeline.TEMPLATE_T2W)
+    parser.add_argument('--template-low', type=int, required=True,
+                        help='first slice of the reference window on the template grid')
+    parser.add_argument('--approved', default='7__slice_range_selections.jsonl',
+                        help='selections from the interactive viewer used as a second reference')
+    parser.add_argument('--approved-weight', type=float, default=1.0)
+    parser.add_argument('--min-confidence', type=float, default=0.2)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='7-1__slice_range_proposals.csv')
+    parser.add_argument('--needs-review', default='7-1__needs_review.txt')
+    args = parser.parse_args()
+
+    template_profile = slice_profile(args.template)
+    if not 0 <= args.template_low <= len(template_profile) - WINDOW:
+        parser.error(f"--template-low must be in [0, {len(template_profile) - WINDOW}] for a {WINDOW}-slice "
+                     f"window on the {len(template_profile)}-slice template")
+
+    volumes = [os.path.expanduser(v) for v in args.volumes]
+    selections = pipeline.load_selections(args.approved)
+    approved_scans = [record['scan'] for record in selections]
+    to_profile = list(dict.fromkeys(volumes + [s for s in approved_scans if os.path.exists(s)]))
+
+    with multiprocessing.Pool(processes=args.processes) as pool:
+        profiles = dict(zip(to_profile, pool.map(slice_profile, to_profile)))
+
+    references = [template_profile[args.template_low:args.template_low + WINDOW]]
+    weights = [1.0]
+    approved, n_approved = approved_reference(selections, profiles)
+    if approved is not None:
+        references.append(approved)
+        weights.append(args.approved_weight)
+        print(f"Using {n_approved} approved selections as a second reference.")
+
+    rows, needs_review = [], []
+    for volume in volumes:
+        proposals, confidence = propose(profiles[volume], references, weights, top_k=args.top_k)
+        review = confidence < args.min_confidence or not proposals
+        if review:
+            needs_review.append(volume)
+        for rank, (low, cost) in enumerate(proposals, start=1):
+            n_slices = len(profiles[volume])
+            rows.append({'scan': volume, 'rank': rank, 'slice_start': low,
+                         'slice_end': min(low + WINDOW - 1, n_slices - 1),
+                         'cost': cost, 'confidence': confidence, 'needs_review': review})
+
+    pd.DataFrame(rows).to_csv(args.output, index=False)
+    with open(args.needs_review, 'w') as f:
+        f.writelines(f"{volume}\n" for volume in needs_review)
+    print(f"{len(volumes) - len(needs_review)} proposals above confidence {args.min_confidence}; "
+          f"{len(needs_review)} scans listed in {args.needs_review} for the interactive viewer.")
+
+
+if __name__ == '__main__': # best practice to prevent execution on import
+    main()
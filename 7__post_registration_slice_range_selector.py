@@ -1,25 +1,25 @@
 #conda activate mri
 
+import argparse
 import glob
 import os
-import nibabel as nib
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
 
-def interactive_mri_visualization(scan, slice_positions, selected_scans):
+import nifti_slices
+import pipeline
+
+def candidate_slices(scan, slice_positions):
     """
-    Displays one pair of low/high MRI slices (from the given scan) at a time.
-    
-    - scan: a file path to the scan (or a nibabel image object; here we assume a path)
-    - slice_positions: list of fractional positions (or absolute indices) for the low slice.
-      (For fractional positions, the low slice is computed as int(total_slices * pos).)
-    - selected_scans: a dict that maps the slice position index (0...len(slice_positions)-1)
-      to a list of scan paths that were “accepted” when that slice was shown.
+    Low/high slice indices for every slice position and the corresponding slices.
+
+    Only the candidate slices are read (through the memory-mapped / streamed proxy), so this is
+    cheap enough to run ahead for the next scans while the current one is reviewed.
     """
-    # Load the MRI scan using nibabel.
-    img = nib.load(scan)
-    data = img.get_fdata()
-    num_slices = data.shape[2]
+    # Open the MRI scan using nibabel (header only; voxel data stay on disk).
+    img = nifti_slices.load(scan)
+    num_slices = nifti_slices.slice_count(img)
     
     # Compute the low and high slice indices for each slice position.
     low_indices = []
@@ -34,6 +34,24 @@ def interactive_mri_visualization(scan, slice_positions, selected_scans):
         high_idx = min(low_idx + 42, num_slices - 1)
         low_indices.append(low_idx)
         high_indices.append(high_idx)
+
+    # Read only the candidate low/high slices (stored dtype), not the whole volume as float64.
+    data = nifti_slices.read_slices(img, low_indices + high_indices)
+    return low_indices, high_indices, data
+
+def interactive_mri_visualization(scan, slice_positions, selected_scans, candidates=None, on_select=None):
+    """
+    Displays one pair of low/high MRI slices (from the given scan) at a time.
+    
+    - scan: a file path to the scan (or a nibabel image object; here we assume a path)
+    - slice_positions: list of fractional positions (or absolute indices) for the low slice.
+      (For fractional positions, the low slice is computed as int(total_slices * pos).)
+    - selected_scans: a dict that maps the slice position index (0...len(slice_positions)-1)
+      to a list of scan paths that were “accepted” when that slice was shown.
+    - candidates: optional result of candidate_slices(scan, slice_positions) (e.g. prefetched).
+    - on_select: optional callback(scan, idx, low_idx, high_idx) when Continue is clicked.
+    """
+    low_indices, high_indices, data = candidates or candidate_slices(scan, slice_positions)
     
     # We'll use a mutable container (a one‐element list) for the current index.
     current_index = [0]  # start with the first slice position
@@ -43,12 +61,12 @@ def interactive_mri_visualization(scan, slice_positions, selected_scans):
     plt.subplots_adjust(bottom=0.3)  # make room for buttons
 
     # Display the initial slices
-    im_low = axs[0].imshow(data[:, :, low_indices[current_index[0]]].T,
+    im_low = axs[0].imshow(data[low_indices[current_index[0]]].T,
                            cmap='gray', origin='lower')
     axs[0].set_title(f"Low Slice: {low_indices[current_index[0]]}")
     axs[0].axis('off')
 
-    im_high = axs[1].imshow(data[:, :, high_indices[current_index[0]]].T,
+    im_high = axs[1].imshow(data[high_indices[current_index[0]]].T,
                             cmap='gray', origin='lower')
     axs[1].set_title(f"High Slice: {high_indices[current_index[0]]}")
     axs[1].axis('off')
@@ -65,9 +83,9 @@ def interactive_mri_visualization(scan, slice_positions, selected_scans):
     def update_display():
         """Update both subplots with the new low and high slice images."""
         idx = current_index[0]
-        im_low.set_data(data[:, :, low_indices[idx]].T)
+        im_low.set_data(data[low_indices[idx]].T)
         axs[0].set_title(f"Low Slice: {low_indices[idx]}")
-        im_high.set_data(data[:, :, high_indices[idx]].T)
+        im_high.set_data(data[high_indices[idx]].T)
         axs[1].set_title(f"High Slice: {high_indices[idx]}")
         fig.canvas.draw_idle()
 
@@ -90,6 +108,8 @@ def interactive_mri_visualization(scan, slice_positions, selected_scans):
         """
         idx = current_index[0]
         selected_scans[idx].append(scan)
+        if on_select is not None:
+            on_select(scan, idx, low_indices[idx], high_indices[idx])
         plt.close(fig)  # close the figure to move on to the next scan
 
     # Connect the buttons to their callbacks
@@ -99,6 +119,34 @@ def interactive_mri_visualization(scan, slice_positions, selected_scans):
 
     plt.show()
 
+def review_scans(scans, slice_positions, selected_scans, selections_file, prefetch=4):
+    """
+    Review every scan not yet in `selections_file`, prefetching the candidate slices of the
+    next `prefetch` scans in a background thread while the current one is shown.
+    """
+    done = set()
+    for record in pipeline.load_selections(selections_file):
+        if record['scan'] in scans:
+            selected_scans[record['position_idx']].append(record['scan'])
+            done.add(record['scan'])
+    pending = [scan for scan in scans if scan not in done]
+    print(f"{len(done)} scans already reviewed, {len(pending)} to go.")
+
+    def on_select(scan, idx, low_idx, high_idx):
+        pipeline.append_selection(selections_file, {'scan': scan, 'position_idx': idx,
+                                           'slice_position': slice_positions[idx],
+                                           'low': low_idx, 'high': high_idx})
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        futures = {}
+        for i, scan in enumerate(pending):
+            for ahead in pending[i:i + prefetch + 1]:
+                if ahead not in futures:
+                    futures[ahead] = executor.submit(candidate_slices, ahead, slice_positions)
+            candidates = futures.pop(scan).result()
+            interactive_mri_visualization(scan, slice_positions, selected_scans,
+                                          candidates=candidates, on_select=on_select)
+
 #
 #
 #
@@ -113,6 +161,15 @@ if __name__ == "__main__":
     # files_ms_muslim_15t = [os.path.expanduser(f'~/dissertation/data/MRI/Muslim_et_al/Patient-{i}/{i}-T2_oriented_z_rigid_MIWarped.nii.gz') for i in x256_y256]
     # files_ms_isbi_ph3 = glob.glob(os.path.expanduser('~/dissertation/data/MRI/ISBI/training/training*/orig/*t2_rigid_MIWarped.nii.gz'), recursive=True)
     files_ms_isbi_ph3_test = glob.glob(os.path.expanduser('~/dissertation/data/MRI/ISBI/testdata_website/test*/orig/*t2_rigid_MIWarped.nii.gz'), recursive=True)
+
+    # Optionally review only the scans the batch proposer was not confident about
+    # (python 7__post_registration_slice_range_selector.py --scans 7-1__needs_review.txt)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scans', help='text file with one scan path per line (default: the list above)')
+    args = parser.parse_args()
+    if args.scans:
+        with open(args.scans) as f:
+            files_ms_isbi_ph3_test = [line.strip() for line in f if line.strip()]
     
     # Define slice positions. (Assuming fractional positions.)
     slice_positions = [0.3, 0.34, 0.37, 0.39, 0.4, 0.42, 0.45, 0.48, 0.5, 0.52, 0.54]
@@ -124,8 +181,9 @@ if __name__ == "__main__":
     # Loop over each scan. For each scan, the interactive window will show the pair (low/high)
     # for one slice position at a time. The user may change the displayed slice with Up/Down,
     # and then click Continue to record the scan (for the currently shown slice) and move on.
-    for scan in files_ms_isbi_ph3_test:
-        interactive_mri_visualization(scan, slice_positions, selected_scans)
+    # Every Continue is appended to the selections file; re-running skips reviewed scans.
+    review_scans(files_ms_isbi_ph3_test, slice_positions, selected_scans,
+                 selections_file='7__slice_range_selections.jsonl')
 
     # When all scans have been processed, you can inspect the dictionary.
     print("Selected scans by slice position:")
@@ -0,0 +1,79 @@
+#conda activate mri
+#
+# Python replacement for 8__matlab_execute.py: every slice PNG is decoded once and all
+# seven variants (_blurred_SD1..4, _contrast_imadjust/histeq/adapthisteq) are produced in
+# memory (augment.py) and written by a process pool. No MATLAB licence needed.
+#
+#   python 8__python_execute.py                       # regenerate all variant trees
+#   python 8__python_execute.py --validate 500        # tolerance report vs. existing MATLAB trees
+
+import argparse
+import glob
+import multiprocessing
+import os
+import random
+
+import augment
+
+# Expand the root directory.
+orig_root = os.path.expanduser('~/dissertation/data/MRI/')
+
+
+def get_all_folders():
+    # Get list of all matching directories.
+    matching_dirs = [
+        d for d in glob.glob(os.path.join(orig_root, '_[MH]*/*'), recursive=True)
+        if os.path.isdir(d)
+    ]
+
+    # Filter folders by matching substrings.
+    slice_folders_ms_isbi_ph3_test =    [x for x in matching_dirs if '_MS__ISBI_3T_test' in x]
+    slice_folders_ms_isbi_ph3_train =   [x for x in matching_dirs if '_MS__ISBI_3T_train' in x]
+    slice_folders_ms_muslim_15t       = [x for x in matching_dirs if '_MS__Muslim_et_al_15T' in x]
+    slice_folders_healthy_ph3         = [x for x in matching_dirs if '_Healthy__IXI_3T' in x]
+    slice_folders_healthy_ph15        = [x for x in matching_dirs if '_Healthy__IXI_15T_Guys' in x]
+    slice_folders_healthy_ge15        = [x for x in matching_dirs if '_Healthy__IXI_15T_IOP' in x]
+
+    # Combine all folder lists.
+    return (
+        slice_folders_ms_isbi_ph3_test +
+        slice_folders_ms_isbi_ph3_train +
+        slice_folders_ms_muslim_15t +
+        slice_folders_healthy_ph3 +
+        slice_folders_healthy_ph15 +
+        slice_folders_healthy_ge15
+    )
+
+
+def process_png(png_file):
+    return augment.write_variants(png_file, orig_root)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--validate', type=int, default=0, metavar='N',
+                        help='compare N random slices against the MATLAB trees instead of writing')
+    parser.add_argument('--tolerance', type=int, default=1)
+    args = parser.parse_args()
+
+    png_files = [f for folder in get_all_folders() for f in glob.glob(os.path.join(folder, '*.png'))]
+    print(f"Found {len(png_files)} slices.")
+
+    if args.validate:
+        random.seed(42)
+        sample = random.sample(png_files, min(args.validate, len(png_files)))
+        per_slice, summary = augment.validate_against_matlab(sample, orig_root, tolerance=args.tolerance)
+        per_slice.to_csv('8__python_vs_matlab__per_slice.csv', index=False)
+        summary.to_csv('8__python_vs_matlab__summary.csv', index=False)
+        print(summary.to_string(index=False))
+        return
+
+    with multiprocessing.Pool(processes=args.processes) as pool:
+        for i, _ in enumerate(pool.imap_unordered(process_png, png_files, chunksize=64), start=1):
+            if i % 1000 == 0 or i == len(png_files):
+                print(f"Processed {i}/{len(png_files)} slices")
+
+
+if __name__ == '__main__': # best practice to prevent execution on import
+    main()
@@ -0,0 +1,137 @@
+import os
+import random
+import re
+import sys
+import numpy as np
+import pandas as pd
+
+import instrument
+
+# NumPy/pandas-only analysis core: seeding, slice normalization, prediction-table helpers,
+# the columnar array store and calibration sampling. Nothing here imports TensorFlow, Pillow
+# or the SciPy/scikit-image stack, so sweep workers and statistics scripts can use it without
+# the model layer (`util` re-exports everything below for existing callers).
+
+
+SEED = 42
+def set_seeds():
+    """Seed Python's `random` and NumPy (TensorFlow is seeded by `util.set_seeds`)."""
+    random.seed(SEED)
+    np.random.seed(SEED)
+    # Ensure reproducibility with certain environment variables
+    os.environ['PYTHONHASHSEED'] = str(SEED)
+
+# Redirect sys.stdout to suppress progress bars
+class NoOutput:
+    def __enter__(self):
+        self._original_stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+    def __exit__(self, exc_type, exc_value, traceback):
+        sys.stdout.close()
+        sys.stdout = self._original_stdout
+
+def min_max_normalize_np(image):
+    return (image - image.min()) / (image.max() - image.min())
+
+def preprocess_slice_np(image):
+    image = image.astype(np.float32)
+    return min_max_normalize_np(image)
+
+def array_store_path(prefix, name):
+    return f'{prefix}__{name}.npy'
+
+def open_array_store(prefix, n_rows, widths):
+    """
+    Create one float32 `.npy` matrix per output, memory-mapped for incremental writes.
+
+    Parameters:
+      prefix (str): Path prefix; arrays are written to `<prefix>__<name>.npy`.
+      n_rows (int): Total number of slices (rows) that will be written.
+      widths (dict): Output name -> number of columns (e.g. {'embeddings': 1024, 'logits': 2}).
+    """
+    directory = os.path.dirname(prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return {
+        name: np.lib.format.open_memmap(array_store_path(prefix, name), mode='w+',
+                                        dtype=np.float32, shape=(n_rows, width))
+        for name, width in widths.items()
+    }
+
+def load_array_store(prefix, names=('embeddings', 'logits'), mmap_mode='r'):
+    """
+    Load an array store written by `predict_scans(..., array_store=prefix)`.
+
+    Returns the row index (dataset, scan_id, slice_idx, row) and a dict of memory-mapped
+    float32 matrices; row `i` of each matrix belongs to the index entry with `row == i`.
+    Outputs that were not exported are skipped.
+    """
+    index = pd.read_csv(f'{prefix}__index.csv', dtype={'scan_id': str})
+    arrays = {
+        name: np.load(array_store_path(prefix, name), mmap_mode=mmap_mode)
+        for name in names
+        if os.path.exists(array_store_path(prefix, name))
+    }
+    return index, arrays
+
+def prediction_frame(meta, probs, classes):
+    """Vectorized equivalent of the per-slice rows built by `predict_scans`."""
+    probs = np.asarray(probs, dtype=np.float64)
+    classes = np.asarray(classes, dtype=np.int64)
+    predicted = probs.argmax(axis=1)
+    df = pd.DataFrame(meta)
+    df['class'] = classes
+    df['predicted_class'] = predicted
+    df['is_correct'] = predicted == classes
+    df['pred_prob_0'] = probs[:, 0]
+    df['pred_prob_1'] = probs[:, 1]
+    df['actual_class_pred_prob'] = probs[np.arange(len(probs)), classes]
+    return df
+
+def write_paths_to_file(file_path, paths):
+    with open(file_path, "w") as f:
+        f.writelines(f"{path}\n" for path in paths)
+
+def read_paths_from_file(file_path):
+    with open(file_path, "r") as f:
+        paths_read = [line.strip() for line in f]
+    return paths_read
+
+def add_relative_slice_idx_col(df):
+    df['relative_slice_idx'] = df.groupby('scan_id')['slice_idx'].transform(lambda x: x - x.min())
+
+def extract_data_variant(model_str):
+    patterns = ['baseline', 'blurred_SD[1-4]', 'contrast_(?:imadjust|histeq|adapthisteq)']
+    match = re.search('|'.join(patterns), model_str)
+    return match.group(0) if match else None
+
+def parse_model_and_add_data_variant_col(df, model):
+    df = df.copy()
+    df['model'] = model
+    df['data_variant'] = df['model'].apply(extract_data_variant)
+    return df #.drop('model', axis=1)
+
+@instrument.traced('analysis.select_calibration_ids_with_class_check')
+def select_calibration_ids_with_class_check(ids_cal, st, NUM_SELECT, run, max_attempts=1000):
+    """
+    Try up to `max_attempts` times to sample calibration IDs that include both classes.
+    Increments the seed by 1000 on each retry attempt.
+    """
+    for attempt in range(max_attempts):
+        current_seed = run + attempt * 1000
+        rng = np.random.default_rng(current_seed)
+        cal_ids = rng.choice(ids_cal, NUM_SELECT, replace=False)
+        instrument.count('analysis.calibration_sample_attempts')
+
+        # Check if both classes are present in the selected calibration set
+        with instrument.span('analysis.select_calibration.query', run=run, attempt=attempt):
+            cal_slice = st.cal_df.query("scan_id in @cal_ids")
+        classes_present = cal_slice['class'].unique()
+
+        if set(classes_present) >= {0, 1}:
+            return cal_ids, current_seed  # Successful sample with both classes
+
+    # If no valid sample found after all attempts, raise an error
+    raise ValueError(
+        f"Unable to select calibration IDs with both classes present after {max_attempts} attempts for run {run}."
+    )
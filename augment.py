@@ -0,0 +1,235 @@
+import collections
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+from PIL import Image
+from scipy import ndimage
+from skimage import exposure
+
+# NumPy/SciPy/scikit-image ports of the MATLAB blur/contrast operations in `matlab_functions/`
+# (default arguments, uint8 in -> uint8 out), used to generate the distribution-shift variants
+# without a MATLAB licence. `validate_against_matlab` reports pixel-level agreement with the
+# existing MATLAB-generated trees.
+
+
+def read_png(png_path):
+    """Decode a slice PNG as a 2D uint8 array (grayscale, as `imread` + `rgb2gray`)."""
+    return np.array(Image.open(png_path).convert('L'))
+
+
+def write_png(image, png_path):
+    Image.fromarray(np.asarray(image, dtype=np.uint8)).save(png_path)
+
+
+def _round_to_uint8(image):
+    return np.clip(np.round(image), 0, 255).astype(np.uint8)
+
+
+def imgaussfilt(img, sigma):
+    """
+    MATLAB `imgaussfilt(img, sigma)`: kernel size 2*ceil(2*sigma)+1 and 'replicate' padding
+    (scipy 'nearest'), rounded back to uint8.
+    """
+    radius = int(np.ceil(2 * sigma))
+    blurred = ndimage.gaussian_filter(img.astype(np.float64), sigma, mode='nearest', truncate=radius / sigma)
+    return _round_to_uint8(blurred)
+
+
+def stretchlim(img, tol=(0.01, 0.99)):
+    """MATLAB `stretchlim` for uint8 input: intensity limits saturating 1% at each end (as fractions of 255)."""
+    cdf = np.cumsum(np.bincount(img.ravel(), minlength=256)) / img.size
+    low = np.argmax(cdf > tol[0])
+    high = np.argmax(cdf >= tol[1])
+    if low == high:
+        return 0.0, 1.0
+    return low / 255, high / 255
+
+
+def imadjust(img):
+    """MATLAB `imadjust(img)`: linear contrast stretch between `stretchlim` limits."""
+    low, high = stretchlim(img)
+    values = np.arange(256) / 255
+    lut = (np.clip(values, low, high) - low) / (high - low)
+    return _round_to_uint8(lut * 255)[img]
+
+
+def histeq(img, n=64):
+    """
+    MATLAB `histeq(img)` (default n=64 flat target histogram), following the toolbox's
+    cumulative-histogram matching with the half-bin tolerance.
+    """
+    counts = np.bincount(img.ravel(), minlength=256).astype(np.float64)
+    target = np.full(n, img.size / n)
+    cum = np.cumsum(target)
+    cumd = np.cumsum(counts)
+    tol = np.minimum(np.append(counts[:-1], 0), np.insert(counts[1:], 0, 0)) / 2
+    err = cum[:, None] - cumd[None, :] + tol[None, :]
+    err[err < -img.size * np.sqrt(np.finfo(float).eps)] = img.size
+    lut = np.argmin(err, axis=0) / (n - 1)
+    return _round_to_uint8(lut * 255)[img]
+
+
+def adapthisteq(img, num_tiles=(8, 8), clip_limit=0.01, nbins=256):
+    """
+    MATLAB `adapthisteq(img)` defaults (8x8 tiles, ClipLimit 0.01, 256 bins, uniform) via
+    scikit-image's CLAHE. The two implementations interpolate and clip slightly differently;
+    see `validate_against_matlab` for the resulting tolerance.
+    """
+    kernel_size = (int(np.ceil(img.shape[0] / num_tiles[0])), int(np.ceil(img.shape[1] / num_tiles[1])))
+    equalized = exposure.equalize_adapthist(img, kernel_size=kernel_size, clip_limit=clip_limit, nbins=nbins)
+    return _round_to_uint8(equalized * 255)
+
+
+SIGMA_VALUES = [1, 2, 3, 4]
+
+# destination folder suffix -> operation (matches the trees written by 8__matlab_execute.py)
+VARIANTS = {
+    **{f'_blurred_SD{sigma}': (lambda img, sigma=sigma: imgaussfilt(img, sigma)) for sigma in SIGMA_VALUES},
+    '_contrast_imadjust': imadjust,
+    '_contrast_histeq': histeq,
+    '_contrast_adapthisteq': adapthisteq,
+}
+
+
+def apply_variants(img, variants=VARIANTS):
+    """All variants of one decoded slice, {folder suffix: uint8 image}."""
+    return {name: op(img) for name, op in variants.items()}
+
+
+def variant_path(png_file, orig_root, variant):
+    """`<orig_root>/<variant>/<path of png_file relative to orig_root>`."""
+    return os.path.join(orig_root, variant, os.path.relpath(png_file, orig_root))
+
+
+def write_variants(png_file, orig_root, variants=VARIANTS):
+    """Decode `png_file` once and write every variant into its mirrored variant tree."""
+    img = read_png(png_file)
+    for name, out in apply_variants(img, variants).items():
+        dest_file = variant_path(png_file, orig_root, name)
+        os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+        write_png(out, dest_file)
+    return png_file
+
+
+def compare_with_matlab(png_file, orig_root, variants=VARIANTS, tolerance=1):
+    """Per-variant pixel differences between this engine and the MATLAB output for one slice."""
+    img = read_png(png_file)
+    rows = []
+    for name, out in apply_variants(img, variants).items():
+        matlab_file = variant_path(png_file, orig_root, name)
+        if not os.path.exists(matlab_file):
+            continue
+        diff = np.abs(out.astype(np.int16) - read_png(matlab_file).astype(np.int16))
+        rows.append({
+            'variant': name,
+            'png_file': png_file,
+            'max_abs_diff': int(diff.max()),
+            'mean_abs_diff': float(diff.mean()),
+            'frac_within_tolerance': float((diff <= tolerance).mean()),
+            'exact': bool((diff == 0).all()),
+        })
+    return rows
+
+
+def validate_against_matlab(png_files, orig_root, variants=VARIANTS, tolerance=1):
+    """
+    Pixel-level tolerance report against the MATLAB-generated variant trees.
+
+    Returns (per_slice, summary): one row per (slice, variant), and per variant the number
+    of slices compared, worst/mean absolute difference, mean fraction of pixels within
+    `tolerance` grey levels, and the fraction of bit-exact slices.
+    """
+    per_slice = pd.DataFrame([row for png_file in png_files
+                              for row in compare_with_matlab(png_file, orig_root, variants, tolerance)])
+    summary = (per_slice
+               .groupby('variant')
+               .agg(n_slices=('png_file', 'count'),
+                    max_abs_diff=('max_abs_diff', 'max'),
+                    mean_abs_diff=('mean_abs_diff', 'mean'),
+                    frac_within_tolerance=('frac_within_tolerance', 'mean'),
+                    frac_exact=('exact', 'mean'))
+               .reset_index())
+    return per_slice, summary
+
+
+def gamma(img, g):
+    """Gamma remap of a uint8 image: 255 * (img / 255) ** g."""
+    lut = 255 * (np.arange(256) / 255) ** g
+    return _round_to_uint8(lut)[img]
+
+
+_CONTRAST_OPS = {'imadjust': imadjust, 'histeq': histeq, 'adapthisteq': adapthisteq}
+
+
+def parse_variant(spec):
+    """
+    Resolve a variant spec to a uint8 -> uint8 operation (None for 'baseline').
+
+    Specs use the variant folder names, with or without the leading underscore:
+    'baseline', '_blurred_SD<sigma>' (any positive sigma, e.g. '_blurred_SD1.5'),
+    '_contrast_imadjust' / '_contrast_histeq' / '_contrast_adapthisteq' and
+    '_gamma_<g>' (e.g. '_gamma_0.8'). Callables are returned unchanged.
+    """
+    if callable(spec):
+        return spec
+    name = spec.lstrip('_')
+    if name == 'baseline':
+        return None
+    match = re.fullmatch(r'blurred_SD(\d+(?:\.\d+)?)', name)
+    if match:
+        sigma = float(match.group(1))
+        return lambda img: imgaussfilt(img, sigma)
+    match = re.fullmatch(r'contrast_(\w+)', name)
+    if match and match.group(1) in _CONTRAST_OPS:
+        return _CONTRAST_OPS[match.group(1)]
+    match = re.fullmatch(r'gamma_(\d+(?:\.\d+)?)', name)
+    if match:
+        g = float(match.group(1))
+        return lambda img: gamma(img, g)
+    raise ValueError(f"Unknown variant spec: {spec!r}")
+
+
+class VariantCache:
+    """Thread-safe bounded LRU cache of generated variant slices, keyed by (png path, spec)."""
+
+    def __init__(self, max_items=50000):
+        self.max_items = max_items
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            image = self._items.get(key)
+            if image is not None:
+                self._items.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        with self._lock:
+            self._items[key] = image
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+def load_variant_slice(png_file, spec='baseline', cache=None):
+    """
+    Decode a baseline slice PNG and generate the requested variant on the fly.
+
+    With a `VariantCache`, generated variants are reused across calls (bounded memory).
+    """
+    if cache is not None and not callable(spec):
+        key = (png_file, spec.lstrip('_'))
+        image = cache.get(key)
+        if image is None:
+            image = load_variant_slice(png_file, spec)
+            cache.put(key, image)
+        return image
+    op = parse_variant(spec)
+    image = read_png(png_file)
+    return image if op is None else op(image)
@@ -0,0 +1,302 @@
+# Benchmarks for the conformal, calibration-sampling and inference hot paths (CPU only, no external data).
+#
+# Every case runs on synthetic inputs generated from fixed seeds:
+#   - prediction tables with the `predict_scans` schema (43 slices per scan, MS scans labelled 1 with
+#     ISBI-style ids, healthy scans 0 with numeric ids, one copy per `variant_test_data` stratum),
+#     scaled in calibration size, test size, number of runs and number of strata;
+#   - a slice tree of random PNGs (`_MS__ISBI_3T_train/01_01/slice_000.png`, ...) and a randomly
+#     initialized, narrowed copy of the slice classifier (`util.create_model(width=...)`) for `predict_scans`.
+# Each case reports latency percentiles over repeated calls, throughput (rows / slices / runs per
+# second) and peak memory (tracemalloc peak of one extra call; TF allocations are native and only
+# show in the process high-water RSS). Results are written as JSON and can be compared against a
+# stored baseline. The `import_time` cases spawn a fresh interpreter per call and fail the run if
+# importing the analysis core pulls in TensorFlow / Pillow / SciPy or exceeds IMPORT_BUDGET_S:
+#
+#   python benchmark.py --suite quick --output benchmark_baseline.json
+#   python benchmark.py --suite quick --baseline benchmark_baseline.json --tolerance 0.25
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')   # CPU only; must be set before TF is first imported
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+import conformal
+import util
+
+SLICES_PER_SCAN = 43
+NUM_SELECT = 42
+
+# modules the analysis core (analysis, conformal, util at import) must not load
+HEAVY_MODULES = ['tensorflow', 'keras', 'PIL', 'scipy', 'skimage', 'augment']
+IMPORT_BUDGET_S = 1.0   # per spawned worker: interpreter start + imports
+
+_IMPORT_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'import_s': time.perf_counter() - start, 'heavy': sorted(set(sys.modules) & set({heavy!r}))}}))
+'''
+
+# case grids; every combination of the listed parameters is one benchmark case
+SUITES = {
+    'quick': {
+        'conformal_prediction': {'cal_scans': [42], 'test_scans': [40, 160], 'class_conditional': [False, True]},
+        'conformal_prediction_quantile_based': {'cal_scans': [42], 'test_scans': [40, 160]},
+        'select_calibration_ids_with_class_check': {'pool_scans': [100], 'strata': [1, 6], 'runs': [100]},
+        'predict_scans': {'scans': [2], 'width': [0.125]},
+        'import_time': {'module': ['analysis', 'conformal', 'util']},
+    },
+    'full': {
+        'conformal_prediction': {'cal_scans': [42, 84, 168], 'test_scans': [40, 160, 640],
+                                 'class_conditional': [False, True]},
+        'conformal_prediction_quantile_based': {'cal_scans': [42, 84, 168], 'test_scans': [40, 160, 640]},
+        'select_calibration_ids_with_class_check': {'pool_scans': [100, 400], 'strata': [1, 6, 24], 'runs': [100]},
+        'predict_scans': {'scans': [2, 8], 'width': [0.125, 1.0]},
+        'import_time': {'module': ['analysis', 'conformal', 'util']},
+    },
+}
+
+
+def synthetic_predictions(n_scans, strata=1, ms_fraction=0.5, seed=util.SEED):
+    """
+    Prediction table with the `predict_scans` columns plus `variant_test_data`.
+
+    The probability of the actual class is Beta(5, 1.5) distributed (a fairly accurate classifier),
+    so both classes appear in every table and calibration sets behave like the real ones.
+    """
+    rng = np.random.default_rng(seed)
+    n_ms = int(round(n_scans * ms_fraction))
+    scan_ids = [f'{i // 4 + 1:02d}_{i % 4 + 1:02d}' for i in range(n_ms)] + \
+               [f'{i:03d}' for i in range(n_scans - n_ms)]
+    classes = np.repeat(np.array([1] * n_ms + [0] * (n_scans - n_ms)), SLICES_PER_SCAN)
+    frames = []
+    for s in range(strata):
+        actual = rng.beta(5, 1.5, size=len(classes))
+        probs = np.empty((len(classes), 2))
+        probs[np.arange(len(classes)), classes] = actual
+        probs[np.arange(len(classes)), 1 - classes] = 1 - actual
+        meta = {
+            'dataset': np.where(classes == 1, 'ISBI_3T_train', 'IXI_3T'),
+            'scan_id': np.repeat(scan_ids, SLICES_PER_SCAN),
+            'slice_idx': np.tile(np.arange(80, 80 + SLICES_PER_SCAN), n_scans),
+        }
+        df = util.prediction_frame(meta, probs, classes)
+        df['variant_test_data'] = 'baseline' if s == 0 else f'_stratum_{s}'
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def synthetic_slice_tree(root, n_scans, size=(256, 256), seed=util.SEED):
+    """Write `n_scans` scan folders of random uint8 slice PNGs; returns (scan_dirs, class_labels)."""
+    rng = np.random.default_rng(seed)
+    scan_dirs = []
+    for i in range(n_scans):
+        scan_dir = os.path.join(root, '_MS__ISBI_3T_train', f'{i // 4 + 1:02d}_{i % 4 + 1:02d}')
+        os.makedirs(scan_dir, exist_ok=True)
+        for slice_idx in range(80, 80 + SLICES_PER_SCAN):
+            image = rng.integers(0, 256, size=size, dtype=np.uint8)
+            Image.fromarray(image).save(os.path.join(scan_dir, f'slice_{slice_idx:03d}.png'))
+        scan_dirs.append(scan_dir)
+    return scan_dirs, [1] * n_scans
+
+
+def measure(fn, repeats, warmup=1):
+    """Latency statistics of `repeats` calls of `fn` and the tracemalloc peak of one more call."""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    latencies = np.array(latencies)
+    return {
+        'repeats': repeats,
+        'mean_s': float(latencies.mean()),
+        'p50_s': float(np.percentile(latencies, 50)),
+        'p99_s': float(np.percentile(latencies, 99)),
+        'min_s': float(latencies.min()),
+        'peak_traced_mb': peak / 2**20,
+    }
+
+
+def split_cal_test(df, cal_scans, test_scans, seed=util.SEED):
+    """Calibration / test rows of disjoint random scans (both classes in the calibration scans)."""
+    ids = df['scan_id'].unique()
+    rng = np.random.default_rng(seed)
+    ids = rng.permutation(ids)
+    cal_ids, test_ids = ids[:cal_scans], ids[cal_scans:cal_scans + test_scans]
+    return df[df['scan_id'].isin(cal_ids)], df[df['scan_id'].isin(test_ids)]
+
+
+def bench_conformal_prediction(cal_scans, test_scans, class_conditional, repeats):
+    cal, test = split_cal_test(synthetic_predictions(cal_scans + test_scans), cal_scans, test_scans)
+    stats = measure(lambda: conformal.conformal_prediction(cal, test, alpha=0.1, class_conditional=class_conditional,
+                                                           verbose=False), repeats)
+    return stats, len(test)
+
+
+def bench_conformal_prediction_quantile_based(cal_scans, test_scans, repeats):
+    cal, test = split_cal_test(synthetic_predictions(cal_scans + test_scans), cal_scans, test_scans)
+    stats = measure(lambda: conformal.conformal_prediction_quantile_based(cal, test, alpha=0.1, verbose=False),
+                    repeats)
+    return stats, len(test)
+
+
+def bench_select_calibration_ids_with_class_check(pool_scans, strata, runs, repeats):
+    # one sample per sweep run, as in the 9-2-0 experiment loop
+    st = SimpleNamespace(cal_df=synthetic_predictions(pool_scans, strata=strata))
+    ids_cal = st.cal_df['scan_id'].unique()
+    run_ids = itertools.cycle(range(runs))
+    stats = measure(lambda: util.select_calibration_ids_with_class_check(ids_cal, st, NUM_SELECT, next(run_ids)),
+                    repeats * runs)
+    return stats, 1
+
+
+def bench_predict_scans(scans, width, repeats):
+    util.set_seeds()
+    model = util.create_model(width=width)
+    root = tempfile.mkdtemp(prefix='mricp_bench_')
+    try:
+        scan_dirs, class_labels = synthetic_slice_tree(root, scans)
+        with util.NoOutput():
+            stats = measure(lambda: util.predict_scans(scan_dirs, class_labels, model), repeats)
+    finally:
+        shutil.rmtree(root)
+    return stats, scans * SLICES_PER_SCAN
+
+
+def bench_import_time(module, repeats):
+    # one call = spawning a worker interpreter that imports `module` (as a process pool would)
+    code = _IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    probes = []
+
+    def spawn():
+        out = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True, text=True, check=True)
+        probes.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    stats = measure(spawn, repeats)
+    stats['import_s'] = float(np.median([p['import_s'] for p in probes]))
+    stats['heavy_modules'] = sorted({m for p in probes for m in p['heavy']})
+    stats['over_budget'] = stats['p50_s'] > IMPORT_BUDGET_S
+    return stats, 1
+
+
+BENCHMARKS = {
+    'conformal_prediction': (bench_conformal_prediction, 'rows'),
+    'conformal_prediction_quantile_based': (bench_conformal_prediction_quantile_based, 'rows'),
+    'select_calibration_ids_with_class_check': (bench_select_calibration_ids_with_class_check, 'samples'),
+    'predict_scans': (bench_predict_scans, 'slices'),
+    'import_time': (bench_import_time, 'workers'),
+}
+
+
+def case_key(result):
+    return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+
+def run_suite(suite='quick', only=None, repeats=5):
+    results = []
+    for name, grid in SUITES[suite].items():
+        if only and name not in only:
+            continue
+        fn, unit = BENCHMARKS[name]
+        for values in itertools.product(*grid.values()):
+            params = dict(zip(grid, values))
+            stats, items = fn(**params, repeats=repeats)
+            stats.update(items=items, unit=unit, throughput_per_s=items / stats['p50_s'])
+            results.append({'name': name, 'params': params, **stats})
+            print(f"{name} {params}: p50 {1000 * stats['p50_s']:.2f} ms, p99 {1000 * stats['p99_s']:.2f} ms, "
+                  f"{stats['throughput_per_s']:.0f} {unit}/s, peak {stats['peak_traced_mb']:.1f} MB")
+    return results
+
+
+def environment():
+    import tensorflow as tf
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'tensorflow': tf.__version__,
+        'cpu_count': os.cpu_count(),
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Compare p50 latencies against a baseline file's results.
+
+    Returns rows (name, params, baseline p50, p50, ratio, regressed) for the cases present in both.
+    """
+    previous = {case_key(r): r for r in baseline['results']}
+    rows = []
+    for result in results:
+        base = previous.get(case_key(result))
+        if base is None:
+            continue
+        ratio = result['p50_s'] / base['p50_s']
+        rows.append({'name': result['name'], 'params': result['params'], 'baseline_p50_s': base['p50_s'],
+                     'p50_s': result['p50_s'], 'ratio': ratio, 'regressed': ratio > 1 + tolerance})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='run only these benchmarks')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='p50 slowdown (fraction) reported as a regression')
+    args = parser.parse_args()
+
+    results = run_suite(args.suite, args.only, args.repeats)
+    report = {'suite': args.suite, 'environment': environment(), 'results': results}
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(results, json.load(f), args.tolerance)
+        for row in report['comparison']:
+            flag = 'REGRESSION' if row['regressed'] else 'ok'
+            print(f"{flag:>10}  {row['name']} {row['params']}: {row['ratio']:.2f}x baseline p50")
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    failed = any(row['regressed'] for row in report.get('comparison', []))
+    for result in results:
+        if result.get('heavy_modules') or result.get('over_budget'):
+            print(f"IMPORT GUARD  import {result['params']['module']}: p50 {result['p50_s']:.2f} s "
+                  f"(budget {IMPORT_BUDGET_S} s), heavy modules loaded: {result['heavy_modules']}")
+            failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__': # best practice to prevent execution on import
+    main()
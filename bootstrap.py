@@ -0,0 +1,135 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import analysis
+import instrument
+
+# Scan-level (cluster) bootstrap confidence intervals for the per-run coverage (`verdict`) and
+# mean prediction-set size (`ps_size`) of the 9-2-0 conformal sweep, overall and per class.
+#
+# Slices of one scan are not independent (43 per scan), so replicates resample test scans. Each
+# (class_conditional, variant_test_data, cal_test) configuration is reduced to per-(run, scan)
+# sufficient statistics X (runs x scans x [slices, covered, set-size sum] per class), and all
+# replicates of all runs are drawn at once as multinomial scan-weight matrices W (runs x replicates
+# x scans), so replicate totals are a single batched product W @ X. Resampling is stratified by
+# scan class by default, so every replicate keeps each run's MS / healthy scan counts.
+#
+#   run_cis, summary_cis = bootstrap.bootstrap_cis(df_combined, n_boot=2000)
+#   runs = bootstrap.append_cis(runs, run_cis)            # per-run CIs of the run means
+#   summary = bootstrap.append_cis(summary, summary_cis)  # CIs of the across-run medians
+
+CONFIG_KEYS = ['class_conditional', 'variant_test_data', 'cal_test']
+CLASSES = [0, 1]
+FEATURES = ['n', 'covered', 'ps_sum']
+# output metric -> (numerator, denominator) statistic, for class 'all', 0 and 1
+METRICS = {'verdict': 'covered', 'ps_size': 'ps_sum'}
+
+
+def scan_statistics(df):
+    """Per (configuration, run, scan) slice counts, covered slices and set-size sums, overall and per class."""
+    if 'ps_size' not in df.columns:
+        df = df.assign(ps_size=df['classes'].map(len))
+    keys = CONFIG_KEYS + ['run', 'scan_id']
+    per_class = (df.assign(n=1)
+                 .groupby(keys + ['class'], observed=True)
+                 .agg(n=('n', 'sum'), covered=('verdict', 'sum'), ps_sum=('ps_size', 'sum'))
+                 .unstack('class', fill_value=0)
+                 .reindex(columns=pd.MultiIndex.from_product([FEATURES, CLASSES]), fill_value=0))
+    stats = pd.DataFrame({f'{f}_{c}': per_class[(f, c)] for f in FEATURES for c in CLASSES})
+    for f in FEATURES:
+        stats[f] = stats[[f'{f}_{c}' for c in CLASSES]].sum(axis=1)
+    # a scan's stratum is its (majority) class
+    stats['stratum'] = (stats['n_1'] > stats['n_0']).astype(int)
+    return stats.reset_index()
+
+
+def _replicate_totals(stats, columns, n_boot, rng, stratify):
+    """Original and replicate totals of `columns` per run: (runs, columns) and (runs, n_boot, columns)."""
+    runs = sorted(stats['run'].unique())
+    by_run = [group for _, group in stats.groupby('run', sort=True)]
+    n_scans = max(len(group) for group in by_run)
+    # float32 holds the integer counts exactly
+    X = np.zeros((len(runs), n_scans, len(columns)), dtype=np.float32)
+    W = np.zeros((len(runs), n_boot, n_scans), dtype=np.float32)
+    for r, group in enumerate(by_run):
+        X[r, :len(group)] = group[columns].to_numpy()
+        strata = group['stratum'].to_numpy() if stratify else np.zeros(len(group), dtype=int)
+        for stratum in np.unique(strata):
+            idx = np.flatnonzero(strata == stratum)
+            W[r][:, idx] = rng.multinomial(len(idx), np.full(len(idx), 1 / len(idx)), size=n_boot)
+    return runs, X.sum(axis=1), W @ X
+
+
+def _ratios(totals, columns):
+    """{(class, metric): ratio array} from totals with the last axis indexed like `columns`."""
+    col = {name: i for i, name in enumerate(columns)}
+    out = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for cls in ['all'] + CLASSES:
+            suffix = '' if cls == 'all' else f'_{cls}'
+            for metric, numerator in METRICS.items():
+                out[(cls, metric)] = totals[..., col[numerator + suffix]] / totals[..., col['n' + suffix]]
+    return out
+
+
+def bootstrap_cis(df, n_boot=2000, ci=0.95, stratify=True, seed=analysis.SEED):
+    """
+    Bootstrap CIs for coverage (`verdict`) and mean set size (`ps_size`), overall ('all') and per class.
+
+    Parameters:
+      df (pd.DataFrame): Slice-level sweep results (`df_combined` in 9-2-0) with the configuration
+        columns, run, scan_id, class, verdict and ps_size (or classes).
+      n_boot (int): Replicates per run.
+      ci (float): Two-sided confidence level.
+      stratify (bool): Resample scans within their class.
+
+    Returns:
+      (run_cis, summary_cis): per (configuration, run, class) CIs of the run means, and per
+        (configuration, class) CIs of the across-run medians reported in the summary tables.
+    """
+    rng = np.random.default_rng(seed)
+    q = [50 * (1 - ci), 50 * (1 + ci)]
+    stats = scan_statistics(df)
+    columns = [f'{f}{s}' for f in FEATURES for s in [''] + [f'_{c}' for c in CLASSES]]
+    run_rows, summary_rows = [], []
+    for config, group in stats.groupby(CONFIG_KEYS, sort=True, observed=True):
+        with instrument.span('bootstrap.config', runs=group['run'].nunique(), n_boot=n_boot):
+            runs, observed, replicates = _replicate_totals(group, columns, n_boot, rng, stratify)
+            observed_ratios, replicate_ratios = _ratios(observed, columns), _ratios(replicates, columns)
+        keys = dict(zip(CONFIG_KEYS, config))
+        for cls in ['all'] + CLASSES:
+            run_ci = {}
+            summary_ci = {}
+            for metric in METRICS:
+                values = replicate_ratios[(cls, metric)]                        # (runs, n_boot)
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning)   # all-NaN rows: class absent from a run
+                    low, high = np.nanpercentile(values, q, axis=1)
+                    medians = np.nanmedian(values, axis=0)                       # across runs, per replicate
+                run_ci[f'{metric}_ci_low'], run_ci[f'{metric}_ci_high'] = low, high
+                summary_ci[f'{metric}_ci_low'], summary_ci[f'{metric}_ci_high'] = np.nanpercentile(medians, q)
+            for r, run in enumerate(runs):
+                if np.isnan(observed_ratios[(cls, 'verdict')][r]):
+                    continue   # class absent from this run's test scans
+                run_rows.append({**keys, 'run': run, 'class': cls,
+                                 **{name: values[r] for name, values in run_ci.items()}})
+            summary_rows.append({**keys, 'class': cls, **summary_ci, 'n_boot': n_boot})
+    return pd.DataFrame(run_rows), pd.DataFrame(summary_rows)
+
+
+def append_cis(table, cis):
+    """
+    Left-join bootstrap CIs onto a runs or summary table from 9-2-0 (or its CSVs).
+
+    Rows are matched on the configuration, `run` (per-run tables) and `class`; `class` ('all' / 0 / 1)
+    and `variant_test_data` (with or without the leading '_') are compared as normalized strings.
+    """
+    keys = CONFIG_KEYS + (['run'] if 'run' in table.columns and 'run' in cis.columns else []) + ['class']
+    normalize = {'class': lambda s: s.astype(str), 'variant_test_data': lambda s: s.astype(str).str.strip('_')}
+    left = table.assign(**{f'__{k}': normalize.get(k, lambda s: s)(table[k]) for k in keys})
+    right = cis.assign(**{f'__{k}': normalize.get(k, lambda s: s)(cis[k]) for k in keys})
+    right = right.drop(columns=keys + [c for c in right.columns if c in table.columns and c not in keys])
+    merged = left.merge(right, on=[f'__{k}' for k in keys], how='left', validate='many_to_one')
+    return merged.drop(columns=[f'__{k}' for k in keys])
@@ -1,5 +1,7 @@
 import numpy as np
 
+import instrument
+
 ## 1. Hocevar T, Zupan B, Stålring J. Conformal Prediction with Orange. Journal of Statistical Software. 2021;98(7). doi:https://doi.org/10.18637/jss.v098.i07
 ##  => https://github.com/biolab/orange3-conformal
 
@@ -133,6 +135,7 @@ class PredictionClass:
         return max(p_y for p_y, y in self.p) - sorted([p_y for p_y, y in self.p], reverse=True)[1]
 
 
+@instrument.traced('conformal.conformal_prediction')
 def conformal_prediction(cal, test_in, alpha=0.1, class_conditional=False, verbose=True):
     """
     Generate conformal prediction sets directly using nonconformity scores with finite-sample correction.
@@ -216,30 +219,33 @@ def conformal_prediction(cal, test_in, alpha=0.1, class_conditional=False, verbo
     
     # Convert test probabilities to a numpy array.
     preds = test[['pred_prob_0', 'pred_prob_1']].to_numpy()
+    instrument.count('conformal.test_rows', len(preds))
     
     # Build prediction results with a nested list comprehension.
-    prediction_results = [
-        PredictionClass(
-            [
-                (
-                    # Use the appropriate alpha array based on the condition.
-                    (np.sum((class_alphas[cls] if class_conditional else global_alphas) >= (1 - pred)) + 1)
-                    / ((len(class_alphas[cls]) if class_conditional else len(global_alphas)) + 1),
-                    cls
-                )
-                for cls, pred in enumerate(example)
-            ],
-            eps=alpha
-        )
-        for example in preds
-    ]
+    with instrument.span('conformal.p_values', rows=len(preds), class_conditional=class_conditional):
+        prediction_results = [
+            PredictionClass(
+                [
+                    (
+                        # Use the appropriate alpha array based on the condition.
+                        (np.sum((class_alphas[cls] if class_conditional else global_alphas) >= (1 - pred)) + 1)
+                        / ((len(class_alphas[cls]) if class_conditional else len(global_alphas)) + 1),
+                        cls
+                    )
+                    for cls, pred in enumerate(example)
+                ],
+                eps=alpha
+            )
+            for example in preds
+        ]
     
     # Assign the PredictionClass results and compute the other columns.
-    test['confidence'] = [cp.confidence() for cp in prediction_results]
-    test['credibility'] = [cp.credibility() for cp in prediction_results]
-    test['margin'] = [cp.margin() for cp in prediction_results]
-    test['classes'] = [cp.classes() for cp in prediction_results]
-    test['verdict'] = [cp.verdict(cls) for cp, cls in zip(prediction_results, test['class'])]
+    with instrument.span('conformal.columns', rows=len(preds)):
+        test['confidence'] = [cp.confidence() for cp in prediction_results]
+        test['credibility'] = [cp.credibility() for cp in prediction_results]
+        test['margin'] = [cp.margin() for cp in prediction_results]
+        test['classes'] = [cp.classes() for cp in prediction_results]
+        test['verdict'] = [cp.verdict(cls) for cp, cls in zip(prediction_results, test['class'])]
     test['class_conditional'] = class_conditional
     test['cp'] = prediction_results
 
@@ -290,3 +296,47 @@ def conformal_prediction_quantile_based(cal, test, alpha=0.1, verbose=True):
         print(f'\nqhat: {qhat}\n')
         print(pred_sets.apply(lambda x: int(x['pred_prob_0']) + int(x['pred_prob_1']), axis=1).value_counts())
         print(f"\nThe empirical coverage is: {empirical_coverage:.3f}\n\n")
+
+def calibration_alphas(cal, class_conditional=False):
+    """
+    Sorted calibration nonconformity scores (1 - actual_class_pred_prob) for each class.
+
+    Returns a dict {0: alphas, 1: alphas}; both entries share the pooled scores when
+    `class_conditional` is False. Pass the result to `conformal_p_values`.
+    """
+    required_classes = {0, 1}
+    missing = required_classes - set(cal['class'].unique())
+    assert not missing, f"Calibration set is missing class(es): {missing}"
+
+    if class_conditional:
+        return {
+            cls: np.sort(np.array(1 - cal.loc[cal['class'] == cls, 'actual_class_pred_prob']))
+            for cls in [0, 1]
+        }
+    global_alphas = np.sort(np.array(1 - cal['actual_class_pred_prob']))
+    return {0: global_alphas, 1: global_alphas}
+
+def conformal_p_values(alphas, preds):
+    """
+    Vectorized conformal p-values, identical to those computed in `conformal_prediction`:
+    p(y) = (#{calibration alphas >= 1 - pred_prob_y} + 1) / (n + 1).
+
+    Parameters
+    ----------
+    alphas : dict
+        Sorted calibration alphas per class, as returned by `calibration_alphas`.
+    preds : np.ndarray
+        (n_examples, 2) predicted probabilities for classes 0 and 1.
+
+    Returns
+    -------
+    np.ndarray
+        (n_examples, 2) p-values.
+    """
+    preds = np.asarray(preds, dtype=np.float64)
+    p_values = np.empty(preds.shape)
+    for cls in [0, 1]:
+        cls_alphas = alphas[cls]
+        n_greater_equal = len(cls_alphas) - np.searchsorted(cls_alphas, 1 - preds[:, cls], side='left')
+        p_values[:, cls] = (n_greater_equal + 1) / (len(cls_alphas) + 1)
+    return p_values
@@ -0,0 +1,142 @@
+import argparse
+import hashlib
+import json
+import time
+
+import pandas as pd
+
+import quantize
+import util
+
+# Verification harness for `util.fast_inference` (fast kernels, multi-threaded) against a
+# deterministic reference run (`util.set_seeds()`, op determinism on) of the same model and scans.
+#
+# Predictions are compared slice by slice (softmax, predicted_class) and through the downstream
+# conformal sweep on shared calibration/test splits (coverage and set size, marginal and
+# class-conditional, overall and per class), each against a stated tolerance. SHA-256 checksums
+# of both prediction tables are recorded exactly and rounded to CHECKSUM_DECIMALS.
+#
+# The fast run goes first: TF op determinism cannot be switched off again once enabled.
+#
+#   python inference_check.py --model best_model__baseline__20250503.keras --scans test_dirs.txt \
+#       --intra-op-threads 0 --inter-op-threads 2
+
+TOLERANCES = {
+    'softmax_max_abs_diff': 1e-4,         # max |Δ pred_prob| over all slices
+    'predicted_class_agreement': 0.999,   # minimum fraction of slices with the same predicted class
+    'coverage_max_abs_diff': 0.005,       # max |Δ coverage| over runs / modes / classes
+    'ps_size_max_abs_diff': 0.005,        # max |Δ mean prediction-set size| over runs / modes / classes
+}
+CHECKSUM_DECIMALS = 4
+
+
+def prediction_checksum(df, decimals=None):
+    """SHA-256 of (keys, predicted_class, softmax) in key order; softmax rounded to `decimals` if given."""
+    keys = quantize.KEYS + (['variant_test_data'] if 'variant_test_data' in df.columns else [])
+    table = df[keys + ['predicted_class', 'pred_prob_0', 'pred_prob_1']].sort_values(keys)
+    float_format = None if decimals is None else f'%.{decimals}f'
+    return hashlib.sha256(table.to_csv(index=False, float_format=float_format).encode()).hexdigest()
+
+
+def verification_report(reference_df, fast_df, alpha=0.1, num_select=42, n_runs=20, tolerances=TOLERANCES):
+    """
+    Compare fast-mode predictions against the deterministic reference.
+
+    Returns a dict with the metrics, one check per tolerance ({value, tolerance, passed}),
+    the overall verdict and the prediction checksums.
+    """
+    keys = quantize.KEYS + (['variant_test_data'] if 'variant_test_data' in reference_df.columns else [])
+    merged = reference_df.merge(fast_df, on=keys, suffixes=('_ref', '_fast'), validate='one_to_one')
+    if len(merged) != len(reference_df):
+        raise ValueError(f"Fast predictions cover {len(merged)} of {len(reference_df)} reference slices.")
+
+    softmax_diff = pd.concat([(merged[f'pred_prob_{c}_ref'] - merged[f'pred_prob_{c}_fast']).abs() for c in (0, 1)])
+    metrics = {
+        'n_slices': len(merged),
+        'softmax_max_abs_diff': float(softmax_diff.max()),
+        'softmax_mean_abs_diff': float(softmax_diff.mean()),
+        'predicted_class_agreement': float((merged['predicted_class_ref'] == merged['predicted_class_fast']).mean()),
+    }
+
+    cov = quantize.coverage_comparison(reference_df, fast_df, alpha=alpha, num_select=num_select, n_runs=n_runs,
+                                       names=('reference', 'fast'))
+    value_cols = [c for c in cov.columns if c.startswith(('coverage', 'ps_size'))]
+    paired = cov.pivot_table(index=['run', 'class_conditional'], columns='model', values=value_cols)
+    deltas = {col: (paired[(col, 'fast')] - paired[(col, 'reference')]).abs().max() for col in value_cols}
+    metrics['coverage_max_abs_diff'] = float(max(v for c, v in deltas.items() if c.startswith('coverage')))
+    metrics['ps_size_max_abs_diff'] = float(max(v for c, v in deltas.items() if c.startswith('ps_size')))
+    metrics['reference_median_coverage'] = float(cov.loc[cov['model'] == 'reference', 'coverage'].median())
+
+    checks = {}
+    for name, tolerance in tolerances.items():
+        value = metrics[name]
+        passed = value >= tolerance if name == 'predicted_class_agreement' else value <= tolerance
+        checks[name] = {'value': value, 'tolerance': tolerance, 'passed': bool(passed)}
+
+    return {
+        'metrics': metrics,
+        'checks': checks,
+        'passed': all(c['passed'] for c in checks.values()),
+        'checksums': {
+            'reference': prediction_checksum(reference_df),
+            'fast': prediction_checksum(fast_df),
+            f'reference_rounded_{CHECKSUM_DECIMALS}': prediction_checksum(reference_df, CHECKSUM_DECIMALS),
+            f'fast_rounded_{CHECKSUM_DECIMALS}': prediction_checksum(fast_df, CHECKSUM_DECIMALS),
+        },
+    }
+
+
+def run_verification(scan_dirs, class_labels, model_path, intra_op_threads=0, inter_op_threads=0, **kwargs):
+    """Predict `scan_dirs` in fast mode, then deterministically, and return `verification_report` plus timings."""
+    import tensorflow as tf
+    util.fast_inference(intra_op_threads, inter_op_threads)
+    model = tf.keras.models.load_model(model_path)
+
+    timings = {}
+    with util.NoOutput():
+        util.predict_scans(scan_dirs[:1], class_labels[:1], model)   # warm-up (graph tracing)
+        start = time.perf_counter()
+        fast_df = util.predict_scans(scan_dirs, class_labels, model)
+        timings['fast_s'] = time.perf_counter() - start
+
+        util.set_seeds()   # deterministic reference
+        start = time.perf_counter()
+        reference_df = util.predict_scans(scan_dirs, class_labels, model)
+        timings['reference_s'] = time.perf_counter() - start
+    timings['speedup'] = timings['reference_s'] / timings['fast_s']
+
+    report = verification_report(reference_df, fast_df, **kwargs)
+    report['timings'] = timings
+    report['settings'] = {'model': model_path, 'n_scans': len(scan_dirs), 'intra_op_threads': intra_op_threads,
+                          'inter_op_threads': inter_op_threads}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--scans', required=True, help='text file with one scan directory per line')
+    parser.add_argument('--intra-op-threads', type=int, default=0, help='0 = all cores')
+    parser.add_argument('--inter-op-threads', type=int, default=0, help='0 = TF default')
+    parser.add_argument('--alpha', type=float, default=0.1)
+    parser.add_argument('--n-runs', type=int, default=20)
+    parser.add_argument('--output', default='inference_check.json')
+    args = parser.parse_args()
+
+    scan_dirs = util.read_paths_from_file(args.scans)
+    class_labels = [1 if 'MS' in x else 0 for x in scan_dirs]   # as in the 9-1 notebooks
+    report = run_verification(scan_dirs, class_labels, args.model, args.intra_op_threads, args.inter_op_threads,
+                              alpha=args.alpha, n_runs=args.n_runs)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name, check in report['checks'].items():
+        print(f"{'ok' if check['passed'] else 'FAIL':>4}  {name}: {check['value']:.6g} (tolerance {check['tolerance']})")
+    print(f"fast {report['timings']['fast_s']:.1f} s vs deterministic {report['timings']['reference_s']:.1f} s "
+          f"({report['timings']['speedup']:.2f}x); report written to {args.output}")
+    if not report['passed']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__': # best practice to prevent execution on import
+    main()
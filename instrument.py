@@ -0,0 +1,199 @@
+import atexit
+import collections
+import contextlib
+import cProfile
+import csv
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Opt-in timers, counters and profiling hooks for the loading / inference / conformal hot paths.
+#
+# Disabled unless MRICP_TRACE is set; `span()` then returns a shared no-op context manager, so
+# instrumented code pays one function call and a flag check per span.
+#
+#   MRICP_TRACE=1             record spans/counters in memory (export with `write_chrome_trace` / `write_csv`)
+#   MRICP_TRACE=trace.json    ... and write a Chrome trace (chrome://tracing, Perfetto) at exit
+#   MRICP_TRACE=trace.csv     ... and write a CSV at exit
+#   MRICP_TRACE_BUFFER=N      ring buffer size (default 100000 events; the oldest are dropped)
+#   MRICP_PROFILE=cprofile,tracemalloc   also profile the blocks wrapped in `profiled(label)`,
+#                             writing <label>.prof / <label>.tracemalloc.txt to MRICP_PROFILE_DIR (default '.')
+#
+#   with instrument.span('predict_scans.predict', slices=len(batch)):
+#       probs = model.predict(batch)
+#   instrument.count('slices_loaded', len(slices))
+
+_TRACE = os.environ.get('MRICP_TRACE', '')
+ENABLED = _TRACE not in ('', '0')
+PROFILE = {p.strip().lower() for p in os.environ.get('MRICP_PROFILE', '').split(',') if p.strip()}
+PROFILE_DIR = os.environ.get('MRICP_PROFILE_DIR', '.')
+
+# (name, start_ns, duration_ns, pid, thread id, args)
+_events = collections.deque(maxlen=int(os.environ.get('MRICP_TRACE_BUFFER', 100000)))
+_counters = collections.Counter()
+_lock = threading.Lock()
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter_ns() - self.start
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        _events.append((self.name, self.start, duration, os.getpid(), threading.get_ident(), self.args))
+        return False
+
+
+def span(name, **args):
+    """Time a block (`with span(...)`); `args` are attached to the event."""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def traced(name=None, profile=False):
+    """
+    Decorator recording one span per call (named after the function by default).
+
+    With `profile=True`, calls are also captured by `profiled(name)` when MRICP_PROFILE is set.
+    """
+    def decorator(fn):
+        span_name = name or f'{fn.__module__}.{fn.__qualname__}'
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if profile and PROFILE:
+                with profiled(span_name), span(span_name):
+                    return fn(*args, **kwargs)
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _Span(span_name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    if ENABLED:
+        with _lock:
+            _counters[name] += n
+
+
+def enable(enabled=True):
+    """Switch recording on/off at runtime (e.g. from a notebook)."""
+    global ENABLED
+    ENABLED = enabled
+
+
+def reset():
+    _events.clear()
+    with _lock:
+        _counters.clear()
+
+
+def events():
+    return list(_events)
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+def summary():
+    """Per-span-name count, total / mean / max milliseconds, sorted by total time."""
+    stats = {}
+    for name, _, duration, _, _, _ in list(_events):
+        s = stats.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        s['count'] += 1
+        s['total_ms'] += duration / 1e6
+        s['max_ms'] = max(s['max_ms'], duration / 1e6)
+    for s in stats.values():
+        s['mean_ms'] = s['total_ms'] / s['count']
+    return dict(sorted(stats.items(), key=lambda item: -item[1]['total_ms']))
+
+
+def write_chrome_trace(path):
+    """Write the recorded spans (complete events) and final counter values in Chrome trace JSON format."""
+    recorded = list(_events)
+    trace = [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'ts': start / 1000, 'dur': duration / 1000,
+              'pid': pid, 'tid': tid, 'args': args}
+             for name, start, duration, pid, tid, args in recorded]
+    if recorded:
+        last = max(start + duration for _, start, duration, _, _, _ in recorded)
+        trace += [{'name': name, 'ph': 'C', 'ts': last / 1000, 'pid': os.getpid(), 'args': {name: value}}
+                  for name, value in counters().items()]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+    return path
+
+
+def write_csv(path):
+    """Write the recorded spans as CSV (name, start_us, duration_us, pid, tid, args as JSON)."""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'start_us', 'duration_us', 'pid', 'tid', 'args'])
+        for name, start, duration, pid, tid, args in list(_events):
+            writer.writerow([name, start / 1000, duration / 1000, pid, tid, json.dumps(args, default=str)])
+    return path
+
+
+@contextlib.contextmanager
+def profiled(label):
+    """cProfile and/or tracemalloc capture of a block, as selected by MRICP_PROFILE (no-op otherwise)."""
+    profiler = cProfile.Profile() if 'cprofile' in PROFILE else None
+    trace_memory = 'tracemalloc' in PROFILE and not tracemalloc.is_tracing()
+    if profiler is None and not trace_memory:
+        yield
+        return
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f'{label}.prof'))
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(os.path.join(PROFILE_DIR, f'{label}.tracemalloc.txt'), 'w') as f:
+                f.write(f"peak: {peak / 2**20:.1f} MB\n")
+                f.writelines(f"{stat}\n" for stat in snapshot.statistics('lineno')[:25])
+
+
+def _export_at_exit():
+    if _TRACE.endswith('.json'):
+        write_chrome_trace(_TRACE)
+    elif _TRACE.endswith('.csv'):
+        write_csv(_TRACE)
+
+
+if ENABLED:
+    atexit.register(_export_at_exit)
@@ -0,0 +1,197 @@
+import numpy as np
+
+import analysis
+import instrument
+
+# Embedding-space kNN nonconformity for conformal prediction.
+#
+# Nonconformity of label y for a slice with embedding x (1024-d max-pooled `dropout_conv4`, as written
+# by `util.predict_scans(include_embeddings=True, array_store=prefix)`):
+#   alpha(x, y) = sum of distances to the k nearest calibration embeddings of class y
+#               / sum of distances to the k nearest calibration embeddings of the other class
+# Calibration scores are leave-one-out (a calibration slice is not its own neighbour).
+#
+# `CalibrationIndex` is built once per calibration set: per-class float32 matrices with cached
+# squared norms, searched exactly by blocked matrix products (query block x calibration block, so
+# the working set stays in cache and memory stays bounded), or with an optional faiss IVF / HNSW
+# index (`backend='ivf'` / `'hnsw'`) when the calibration pool grows to hundreds of thousands of slices.
+#
+#   cal_emb = knn.embeddings_for(cal, 'preds/3T')
+#   index = knn.CalibrationIndex(cal_emb, cal['class'], k=10)
+#   res = knn.knn_conformal_prediction(index, knn.embeddings_for(test, 'preds/3T'), test, alpha=0.1)
+
+KEYS = ['dataset', 'scan_id', 'slice_idx']
+CLASSES = [0, 1]
+
+
+def embeddings_for(df, prefix):
+    """Embeddings of the rows of `df` (in row order) from an array store written by `util.predict_scans`."""
+    index, arrays = analysis.load_array_store(prefix, names=('embeddings',))
+    rows = df[KEYS].astype({'scan_id': str}).merge(index, on=KEYS, how='left', validate='many_to_one')['row']
+    if rows.isna().any():
+        raise KeyError(f"{int(rows.isna().sum())} slices have no embedding in {prefix}")
+    rows = rows.to_numpy(dtype=np.int64)
+    # read the memory-mapped rows in file order, then restore the frame's order
+    order = np.argsort(rows, kind='stable')
+    embeddings = np.empty((len(rows), arrays['embeddings'].shape[1]), dtype=np.float32)
+    embeddings[order] = arrays['embeddings'][rows[order]]
+    return embeddings
+
+
+def _faiss_index(embeddings, backend, nlist, nprobe, hnsw_m):
+    try:
+        import faiss
+    except ImportError as e:
+        raise ImportError(f"backend={backend!r} requires faiss (pip install faiss-cpu); use backend='exact'") from e
+    d = embeddings.shape[1]
+    if backend == 'ivf':
+        nlist = nlist or max(1, int(np.sqrt(len(embeddings))))
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        index.train(embeddings)
+        index.nprobe = min(nprobe, nlist)
+    elif backend == 'hnsw':
+        index = faiss.IndexHNSWFlat(d, hnsw_m)
+    else:
+        raise ValueError(f"Unknown backend: {backend!r} (expected 'exact', 'ivf' or 'hnsw').")
+    index.add(embeddings)
+    return index
+
+
+class CalibrationIndex:
+    """
+    Per-class nearest-neighbour index over calibration embeddings, with leave-one-out
+    calibration scores computed once at construction.
+    """
+
+    def __init__(self, embeddings, labels, k=10, backend='exact', query_block=1024, base_block=8192,
+                 nlist=None, nprobe=16, hnsw_m=32):
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        labels = np.asarray(labels)
+        missing = set(CLASSES) - set(np.unique(labels))
+        assert not missing, f"Calibration set is missing class(es): {missing}"
+        self.k = k
+        self.backend = backend
+        self.query_block = query_block
+        self.base_block = base_block
+        self.embeddings = {c: embeddings[labels == c] for c in CLASSES}
+        self.sq_norms = {c: np.einsum('ij,ij->i', e, e) for c, e in self.embeddings.items()}
+        self.faiss = None
+        if backend != 'exact':
+            self.faiss = {c: _faiss_index(e, backend, nlist, nprobe, hnsw_m) for c, e in self.embeddings.items()}
+        self.labels = labels
+        self.calibration_scores = self._leave_one_out_scores(embeddings, labels)
+
+    def __len__(self):
+        return sum(len(e) for e in self.embeddings.values())
+
+    def _exact_search(self, queries, cls, k):
+        base, base_sq = self.embeddings[cls], self.sq_norms[cls]
+        q_sq = np.einsum('ij,ij->i', queries, queries)
+        best_d = np.empty((len(queries), k), dtype=np.float32)
+        best_i = np.empty((len(queries), k), dtype=np.int64)
+        for qs in range(0, len(queries), self.query_block):
+            q = queries[qs:qs + self.query_block]
+            top_d = np.full((len(q), 0), np.inf, dtype=np.float32)
+            top_i = np.empty((len(q), 0), dtype=np.int64)
+            for bs in range(0, len(base), self.base_block):
+                b = base[bs:bs + self.base_block]
+                # squared L2 distances of the block: |q|^2 + |b|^2 - 2 q.b
+                d = q_sq[qs:qs + len(q), None] + base_sq[None, bs:bs + len(b)] - 2 * (q @ b.T)
+                cand_d = np.concatenate([top_d, d], axis=1)
+                cand_i = np.concatenate([top_i, np.broadcast_to(np.arange(bs, bs + len(b)), d.shape)], axis=1)
+                if cand_d.shape[1] > k:
+                    keep = np.argpartition(cand_d, k - 1, axis=1)[:, :k]
+                    cand_d = np.take_along_axis(cand_d, keep, axis=1)
+                    cand_i = np.take_along_axis(cand_i, keep, axis=1)
+                top_d, top_i = cand_d, cand_i
+            order = np.argsort(top_d, axis=1)
+            best_d[qs:qs + len(q)] = np.take_along_axis(top_d, order, axis=1)
+            best_i[qs:qs + len(q)] = np.take_along_axis(top_i, order, axis=1)
+        return np.sqrt(np.maximum(best_d, 0)), best_i
+
+    def search(self, queries, cls, k):
+        """Distances (ascending) and indices of the `k` nearest class-`cls` calibration embeddings."""
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        k = min(k, len(self.embeddings[cls]))
+        with instrument.span('knn.search', queries=len(queries), cls=cls, k=k, backend=self.backend):
+            if self.faiss is not None:
+                d, i = self.faiss[cls].search(queries, k)
+                return np.sqrt(np.maximum(d, 0)), i
+            return self._exact_search(queries, cls, k)
+
+    def _neighbour_distance_sums(self, queries, cls, k, exclude=None):
+        """Sum of the k nearest distances; `exclude` drops one neighbour index per query (leave-one-out)."""
+        if exclude is None:
+            return self.search(queries, cls, k)[0].sum(axis=1)
+        d, i = self.search(queries, cls, k + 1)
+        is_self = i == exclude[:, None]
+        # drop the self match, or the farthest neighbour when the query itself was not returned
+        drop = np.where(is_self.any(axis=1), is_self.argmax(axis=1), d.shape[1] - 1)
+        return d.sum(axis=1) - d[np.arange(len(d)), drop]
+
+    def _leave_one_out_scores(self, embeddings, labels):
+        scores = np.empty(len(labels), dtype=np.float64)
+        for cls in CLASSES:
+            members = np.flatnonzero(labels == cls)
+            own = self._neighbour_distance_sums(embeddings[members], cls, self.k,
+                                                exclude=np.arange(len(members)))
+            other = self._neighbour_distance_sums(embeddings[members], 1 - cls, self.k)
+            scores[members] = own / np.maximum(other, np.finfo(np.float64).tiny)
+        return scores
+
+    def scores(self, embeddings):
+        """(n, 2) nonconformity scores of each test embedding for labels 0 and 1."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        sums = np.stack([self._neighbour_distance_sums(embeddings, cls, self.k) for cls in CLASSES], axis=1)
+        tiny = np.finfo(np.float64).tiny
+        return np.stack([sums[:, 0] / np.maximum(sums[:, 1], tiny), sums[:, 1] / np.maximum(sums[:, 0], tiny)], axis=1)
+
+    def save(self, path):
+        """Save the per-class calibration embeddings and k as `.npz` (`load` rebuilds the index and scores)."""
+        np.savez(path, embeddings_0=self.embeddings[0], embeddings_1=self.embeddings[1], k=self.k)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        data = np.load(path)
+        embeddings = np.concatenate([data['embeddings_0'], data['embeddings_1']])
+        labels = np.repeat(CLASSES, [len(data['embeddings_0']), len(data['embeddings_1'])])
+        return cls(embeddings, labels, k=int(data['k']), **kwargs)
+
+
+def knn_p_values(index, test_scores, class_conditional=False):
+    """
+    Conformal p-values from kNN scores: p(y) = (#{calibration scores >= score(y)} + 1) / (n + 1),
+    with calibration scores pooled or (class_conditional) restricted to calibration class y.
+    """
+    p_values = np.empty(test_scores.shape)
+    for cls in CLASSES:
+        cal = index.calibration_scores[index.labels == cls] if class_conditional else index.calibration_scores
+        cal = np.sort(cal)
+        n_greater_equal = len(cal) - np.searchsorted(cal, test_scores[:, cls], side='left')
+        p_values[:, cls] = (n_greater_equal + 1) / (len(cal) + 1)
+    return p_values
+
+
+def knn_conformal_prediction(index, test_embeddings, test_in, alpha=0.1, class_conditional=False):
+    """
+    Conformal prediction sets from kNN nonconformity, scored in batches.
+
+    Returns a copy of `test_in` with `knn_score_{0,1}`, `p_value_{0,1}`, and the
+    `conformal.conformal_prediction` summary columns (confidence, credibility, margin,
+    classes, verdict, class_conditional), so the existing coverage / set-size analyses apply.
+    """
+    test = test_in.copy()
+    scores = index.scores(test_embeddings)
+    p = knn_p_values(index, scores, class_conditional)
+    p_sorted = np.sort(p, axis=1)
+    test['knn_score_0'], test['knn_score_1'] = scores[:, 0], scores[:, 1]
+    test['p_value_0'], test['p_value_1'] = p[:, 0], p[:, 1]
+    test['confidence'] = 1 - p_sorted[:, 0]
+    test['credibility'] = p_sorted[:, 1]
+    test['margin'] = p_sorted[:, 1] - p_sorted[:, 0]
+    in_set = p > alpha
+    test['classes'] = [[c for c in CLASSES if row[c]] for row in in_set]
+    test['verdict'] = in_set[np.arange(len(test)), test['class'].to_numpy()]
+    test['class_conditional'] = class_conditional
+    return test
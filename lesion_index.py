@@ -0,0 +1,136 @@
+import glob
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+import nifti_slices
+
+# Per-slice lesion-load index for the scans with ground-truth lesion masks (ISBI training,
+# Muslim et al.), computed once from the template-space masks written by step 5 and stored
+# as a compact Parquet table keyed like the prediction tables: (dataset, scan_id, slice_idx),
+# the keys `util.load_slices_from_scan` emits. Only slices present in the slice folders
+# (the selected 43-slice range) are indexed.
+#
+# ISBI has two raters per scan; counts and boxes are for the union of the raters' masks,
+# with `lesion_voxels_agree` the voxels marked by every rater.
+#
+#   index = lesion_index.build_lesion_index('~/dissertation/data/MRI/')
+#   lesion_index.write_lesion_index(index, 'lesion_index.parquet')
+#   preds = lesion_index.join_lesion_load(preds, lesion_index.read_lesion_index('lesion_index.parquet'))
+
+KEYS = ['dataset', 'scan_id', 'slice_idx']
+
+# 8-connectivity for in-plane connected components
+STRUCTURE = np.ones((3, 3), dtype=bool)
+
+
+def warped_masks_for_slice_dir(mri_root, dataset, scan_id):
+    """Template-space lesion masks (one per rater) for a slice folder, [] when the dataset has none."""
+    if dataset == 'ISBI_3T_train':
+        patient = scan_id.split('_')[0]
+        pattern = f'ISBI/training/training{patient}/masks/training{scan_id}_mask[12]_rigid_MIWarped.nii.gz'
+    elif dataset == 'Muslim_et_al_15T':
+        pattern = f'Muslim_et_al/Patient-{scan_id}/{scan_id}-LesionSeg-T2_oriented_z_rigid_MIWarped.nii.gz'
+    else:
+        return []
+    return sorted(glob.glob(os.path.join(mri_root, pattern)))
+
+
+def slice_indices(slice_dir):
+    return sorted(int(os.path.splitext(f)[0].split('_')[-1]) for f in os.listdir(slice_dir) if f.endswith('.png'))
+
+
+def slice_lesion_stats(mask_slices):
+    """Lesion statistics of one axial slice given each rater's boolean mask."""
+    union = np.logical_or.reduce(mask_slices)
+    agree = np.logical_and.reduce(mask_slices)
+    _, n_components = ndimage.label(union, structure=STRUCTURE)
+    stats = {
+        'lesion_voxels': int(union.sum()),
+        'lesion_voxels_agree': int(agree.sum()),
+        'lesion_components': int(n_components),
+        'bbox_x_min': -1, 'bbox_x_max': -1, 'bbox_y_min': -1, 'bbox_y_max': -1,
+    }
+    if stats['lesion_voxels']:
+        xs = np.flatnonzero(union.any(axis=1))
+        ys = np.flatnonzero(union.any(axis=0))
+        stats.update(bbox_x_min=int(xs[0]), bbox_x_max=int(xs[-1]), bbox_y_min=int(ys[0]), bbox_y_max=int(ys[-1]))
+    return stats
+
+
+def index_scan(job):
+    """Rows for one slice folder: job = (slice_dir, dataset, scan_id, mask paths)."""
+    slice_dir, dataset, scan_id, mask_paths = job
+    indices = slice_indices(slice_dir)
+    # only the indexed slices are read from each mask, in their stored dtype
+    per_rater = [nifti_slices.read_slices(path, indices) for path in mask_paths]
+    rows = []
+    for slice_idx in indices:
+        if any(slice_idx not in slices for slices in per_rater):
+            continue
+        stats = slice_lesion_stats([slices[slice_idx] > 0.5 for slices in per_rater])
+        rows.append({'dataset': dataset, 'scan_id': scan_id, 'slice_idx': slice_idx,
+                     'n_raters': len(mask_paths), **stats})
+    return rows
+
+
+def lesion_jobs(mri_root):
+    """(slice_dir, dataset, scan_id, masks) for every slice folder whose scan has warped lesion masks."""
+    mri_root = os.path.expanduser(mri_root)
+    jobs = []
+    for slice_dir in sorted(glob.glob(os.path.join(mri_root, '_[MH]*/*'))):
+        if not os.path.isdir(slice_dir):
+            continue
+        # same dataset / scan_id parsing as util.load_slices_from_scan
+        dataset = os.path.basename(os.path.dirname(slice_dir)).split("__")[-1]
+        scan_id = os.path.basename(slice_dir)
+        if "-" in scan_id:
+            scan_id = scan_id.split("-")[-1]
+        masks = warped_masks_for_slice_dir(mri_root, dataset, scan_id)
+        if masks:
+            jobs.append((slice_dir, dataset, scan_id, masks))
+    return jobs
+
+
+def build_lesion_index(mri_root, processes=None):
+    """Per-slice lesion-load table for every scan with masks, computed with a process pool."""
+    jobs = lesion_jobs(mri_root)
+    with multiprocessing.Pool(processes=processes) as pool:
+        rows = [row for scan_rows in pool.imap_unordered(index_scan, jobs) for row in scan_rows]
+    columns = KEYS + ['n_raters', 'lesion_voxels', 'lesion_voxels_agree', 'lesion_components',
+                      'bbox_x_min', 'bbox_x_max', 'bbox_y_min', 'bbox_y_max']
+    index = pd.DataFrame(rows, columns=columns)
+    return compact_lesion_index(index).sort_values(KEYS).reset_index(drop=True)
+
+
+def compact_lesion_index(index):
+    """Narrow dtypes: categorical keys, int16 slice/box coordinates, int32 voxel counts."""
+    return index.astype({
+        'dataset': 'category', 'scan_id': 'category', 'slice_idx': 'int16', 'n_raters': 'uint8',
+        'lesion_voxels': 'int32', 'lesion_voxels_agree': 'int32', 'lesion_components': 'int16',
+        'bbox_x_min': 'int16', 'bbox_x_max': 'int16', 'bbox_y_min': 'int16', 'bbox_y_max': 'int16',
+    })
+
+
+def write_lesion_index(index, path):
+    index.to_parquet(path, index=False, compression='zstd')
+
+
+def read_lesion_index(path, columns=None):
+    return pd.read_parquet(path, columns=columns)
+
+
+def join_lesion_load(df, index, columns=None):
+    """
+    Left-join lesion statistics onto a prediction/results table by (dataset, scan_id, slice_idx).
+
+    Rows without a ground-truth mask (healthy scans, ISBI test) get NaN.
+    """
+    columns = columns or [c for c in index.columns if c not in KEYS]
+    right = (index[KEYS + columns]
+             .astype({'dataset': str, 'scan_id': str, 'slice_idx': df['slice_idx'].dtype})
+             .set_index(KEYS))
+    return df.join(right, on=KEYS)
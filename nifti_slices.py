@@ -0,0 +1,110 @@
+import multiprocessing
+import os
+
+import nibabel as nib
+import numpy as np
+from PIL import Image
+
+# Axial slice extraction from NIfTI volumes without `get_fdata()`.
+#
+# Slices are read through nibabel's `dataobj` array proxy: uncompressed `.nii` files are
+# memory-mapped and only the requested slices' bytes are touched, `.nii.gz` files are
+# streamed up to the requested z-range instead of being decompressed into a full array.
+# Data stay in the stored dtype (scaled only if the header sets scl_slope/scl_inter), and a
+# slice is promoted to float64 only for its own uint8 min-max conversion, so peak memory is a
+# handful of slices rather than a float64 copy of the volume.
+
+
+def load(path):
+    """nibabel image with its data left on disk (memory-mapped when uncompressed)."""
+    return nib.load(path, mmap='c')
+
+
+def slice_count(path_or_img):
+    """Number of axial (z) slices, from the header only."""
+    img = load(path_or_img) if isinstance(path_or_img, str) else path_or_img
+    return img.shape[2]
+
+
+def read_slices(path_or_img, indices):
+    """
+    Axial slices `indices` of a volume, {index: 2D array in the stored dtype}.
+
+    Contiguous runs of indices are read with a single proxy slice.
+    """
+    img = load(path_or_img) if isinstance(path_or_img, str) else path_or_img
+    indices = sorted(set(int(i) for i in indices))
+    slices = {}
+    run_start = 0
+    for k in range(1, len(indices) + 1):
+        if k == len(indices) or indices[k] != indices[k - 1] + 1:
+            start, stop = indices[run_start], indices[k - 1] + 1
+            block = np.asanyarray(img.dataobj[:, :, start:stop])
+            for offset in range(stop - start):
+                slices[start + offset] = block[:, :, offset]
+            run_start = k
+    return slices
+
+
+def read_slice_range(path_or_img, start, stop):
+    """Axial slices start..stop-1 as one (x, y, n) array in the stored dtype (clipped to the volume)."""
+    img = load(path_or_img) if isinstance(path_or_img, str) else path_or_img
+    stop = min(stop, img.shape[2])
+    return np.asanyarray(img.dataobj[:, :, start:max(start, stop)])
+
+
+def slice_to_uint8(slice_data):
+    """
+    Per-slice min-max scaling to uint8 with truncation, exactly as the step-7 slice export
+    (computed in float64 as on `get_fdata()` output).
+    """
+    slice_data = np.asarray(slice_data, dtype=np.float64)
+    smin, smax = slice_data.min(), slice_data.max()
+    if smax > smin:
+        return ((slice_data - smin) / (smax - smin) * 255).astype(np.uint8)
+    return np.zeros(slice_data.shape, dtype=np.uint8)  # all slice pixels are same
+
+
+def export_slice_range(volume_path, slice_start, slice_end, dest_dir):
+    """
+    Write axial slices slice_start..slice_end (inclusive) as `slice_{i:03d}.png` in `dest_dir`.
+
+    Returns the number of slices written (indices beyond the volume are skipped).
+    """
+    stack = read_slice_range(volume_path, slice_start, slice_end + 1)
+    os.makedirs(dest_dir, exist_ok=True)
+    for offset in range(stack.shape[2]):
+        Image.fromarray(slice_to_uint8(stack[:, :, offset])).save(
+            os.path.join(dest_dir, f"slice_{slice_start + offset:03d}.png"))
+    return stack.shape[2]
+
+
+def _export_job(job):
+    volume_path, slice_start, slice_end, dest_dir = job
+    try:
+        return volume_path, export_slice_range(volume_path, slice_start, slice_end, dest_dir), None
+    except Exception as e:
+        return volume_path, 0, repr(e)
+
+
+def export_slice_ranges(jobs, processes=None):
+    """
+    Export many scans' slice ranges with a process pool.
+
+    Parameters:
+      jobs (iterable): (volume_path, slice_start, slice_end, dest_dir) tuples.
+      processes (int): Pool size (default: os.cpu_count()).
+
+    Returns:
+      list of (volume_path, n_written, error or None), in completion order.
+    """
+    jobs = list(jobs)
+    results = []
+    with multiprocessing.Pool(processes=processes) as pool:
+        for i, result in enumerate(pool.imap_unordered(_export_job, jobs), start=1):
+            if result[2] is not None:
+                print(f"[ERROR] {result[0]}: {result[2]}")
+            if i % 50 == 0 or i == len(jobs):
+                print(f"Exported {i}/{len(jobs)} scans")
+            results.append(result)
+    return results
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from subprocess import run
+
+# Resumable, content-addressed stage cache for the N4 -> rigid registration -> mask transform
+# scripts (4__rigid_registration_MI.py, 5__transform_lesion_masks_to_template_space.py).
+#
+# Each stage is fingerprinted from its full command line and the SHA-256 of every input file
+# (scan, template, upstream outputs, transforms). A per-scan JSON manifest, rewritten
+# atomically after every state change, records status, fingerprint, runtime, output digests
+# and the stderr tail. A stage is skipped when its fingerprint is unchanged, it previously
+# succeeded and its outputs still match the recorded digests, so interrupted or extended
+# runs resume where they stopped.
+
+MANIFEST_VERSION = 1
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cached_digest(path, digests):
+    """
+    SHA-256 of `path`, reusing `digests[path]` when the file's size and mtime are unchanged
+    (so unchanged multi-MB volumes are not re-hashed on every invocation).
+    """
+    stat = os.stat(path)
+    entry = digests.get(path)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+    sha = file_digest(path)
+    digests[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha}
+    return sha
+
+
+def stage_fingerprint(command, input_digests):
+    payload = json.dumps({'command': list(command), 'inputs': input_digests}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def load_manifest(manifest_file):
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    return {'version': MANIFEST_VERSION, 'stages': {}, 'digests': {}}
+
+
+def write_manifest(manifest_file, manifest):
+    """Write the manifest atomically (temporary file in the same directory + os.replace)."""
+    directory = os.path.dirname(os.path.abspath(manifest_file))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.manifest-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, manifest_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+
+def load_selections(selections_file):
+    """
+    Records of an append-only JSONL log (e.g. the step-7 slice range selections). Lines that do
+    not decode, such as a record cut off when a session was killed mid-write, are skipped.
+    """
+    selections = []
+    if selections_file and os.path.exists(selections_file):
+        with open(selections_file) as f:
+            for line in f:
+                try:
+                    selections.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return selections
+
+
+def append_selection(selections_file, record):
+    """Append one record on its own line and flush it to disk, so an interrupted session resumes after it."""
+    with open(selections_file, 'a+b') as f:
+        # start on a fresh line if the previous write was cut off before its newline
+        partial = False
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            partial = f.read(1) != b'\n'
+        f.write((("\n" if partial else "") + json.dumps(record) + "\n").encode())
+        f.flush()
+        os.fsync(f.fileno())
+
+def outputs_match(entry, outputs, digests):
+    recorded = entry.get('outputs', {})
+    return all(
+        os.path.exists(path) and path in recorded and cached_digest(path, digests) == recorded[path]
+        for path in outputs
+    )
+
+
+def run_stage(name, command, inputs, outputs, manifest_file, env=None, stderr_tail_lines=20):
+    """
+    Run one pipeline stage unless an identical, successful run is already recorded.
+
+    Parameters:
+      name (str): Stage name (key in the manifest), e.g. 'n4' or 'rigid_registration'.
+      command (list of str): Full command line (part of the fingerprint).
+      inputs (list of str): Files the stage reads; their contents are part of the fingerprint.
+      outputs (list of str): Files the stage must produce.
+      manifest_file (str): Per-scan manifest path.
+      env (dict, optional): Environment for the subprocess (not part of the fingerprint).
+
+    Returns:
+      dict: The stage's manifest entry; `entry['status']` is 'ok', 'skipped' or 'failed'.
+    """
+    manifest = load_manifest(manifest_file)
+    digests = manifest['digests']
+
+    missing = [path for path in inputs if not os.path.exists(path)]
+    if missing:
+        entry = {'status': 'failed', 'error': f'missing inputs: {missing}',
+                 'finished_at': datetime.now(timezone.utc).isoformat()}
+        manifest['stages'][name] = entry
+        write_manifest(manifest_file, manifest)
+        return entry
+
+    fingerprint = stage_fingerprint(command, {path: cached_digest(path, digests) for path in inputs})
+    previous = manifest['stages'].get(name)
+    if (previous and previous.get('status') == 'ok' and previous.get('fingerprint') == fingerprint
+            and outputs_match(previous, outputs, digests)):
+        write_manifest(manifest_file, manifest)  # persist refreshed digest cache
+        return dict(previous, status='skipped')
+
+    manifest['stages'][name] = {
+        'status': 'running',
+        'fingerprint': fingerprint,
+        'command': list(command),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+    }
+    write_manifest(manifest_file, manifest)
+
+    start = time.perf_counter()
+    result = run(command, capture_output=True, text=True, env=env)
+    runtime = time.perf_counter() - start
+
+    entry = dict(manifest['stages'][name])
+    entry.update({
+        'returncode': result.returncode,
+        'runtime_s': round(runtime, 3),
+        'finished_at': datetime.now(timezone.utc).isoformat(),
+        'stderr_tail': result.stderr.splitlines()[-stderr_tail_lines:],
+    })
+    missing_outputs = [path for path in outputs if not os.path.exists(path)]
+    if result.returncode == 0 and not missing_outputs:
+        entry['status'] = 'ok'
+        entry['outputs'] = {path: cached_digest(path, digests) for path in outputs}
+    else:
+        entry['status'] = 'failed'
+        if missing_outputs:
+            entry['error'] = f'missing outputs: {missing_outputs}'
+    manifest['stages'][name] = entry
+    write_manifest(manifest_file, manifest)
+    return entry
+
+
+def stage_succeeded(entry):
+    return entry['status'] in ('ok', 'skipped')
+
+
+# ---------------------------------------------------------------------------------------------
+# ANTs stage commands shared by 4__rigid_registration_MI.py, 5__transform_lesion_masks_to_template_space.py
+# and 4-1__fused_registration_to_slices.py (identical commands => identical fingerprints, so
+# stages completed by one script are skipped by the others).
+# ---------------------------------------------------------------------------------------------
+
+# Reference image for registration
+TEMPLATE_T2W = os.path.expanduser(
+    '~/.cache/templateflow/tpl-MNI152NLin2009cAsym/tpl-MNI152NLin2009cAsym_res-01_T2w.nii.gz'
+)
+
+
+def strip_nifti_ext(path):
+    return os.path.basename(path).replace(".nii.gz", "").replace(".nii", "")
+
+
+def registration_paths(scan_path):
+    """Output paths of the N4 + rigid registration stages for one scan (next to the scan)."""
+    scan_name = strip_nifti_ext(scan_path)
+    output_dir = os.path.dirname(scan_path)
+    output_prefix = os.path.join(output_dir, f"{scan_name}_rigid_MI")
+    return {
+        'corrected_image': os.path.join(output_dir, f"{scan_name}_N4Corrected.nii.gz"),
+        'output_prefix': output_prefix,
+        'output_warped': f"{output_prefix}Warped.nii.gz",
+        'output_transform': f"{output_prefix}0GenericAffine.mat",
+        'manifest_file': f"{output_prefix}_manifest.json",
+    }
+
+
+def n4_command(scan_path, corrected_image):
+    ## https://github.com/ANTsX/ANTs/wiki/N4BiasFieldCorrection
+    return [
+        "N4BiasFieldCorrection",
+        "-d", "3",  # 3D imagery
+        "-i", scan_path,  # Input image
+        "-o", corrected_image,  # Output corrected image
+        "-s", "2",  # Shrink factor 
+        "-c", "[50x50x50x50,0.0001]",  # Convergence criteria
+        "-b", "[200]",  # spline distance for the B-spline field (defines the coarseness of the bias field estimate)
+        "-v", "1",  # Verbose output
+    ]
+
+
+def rigid_registration_command(corrected_image, output_prefix, output_warped, reference_image=TEMPLATE_T2W):
+    return [
+        "antsRegistration",                                                        # ANTs registration command
+        "--dimensionality", "3",                                                   # 3D imagery
+        "--float", "0",                                                            # Use double precision
+        "--output", f"[{output_prefix},{output_warped}]",                          # Output prefix
+        "--interpolation", "Linear",                                               # Interpolation method
+        "--winsorize-image-intensities", "[0.005,0.995]",                          # Intensity normalization
+        "--use-histogram-matching", "1", # Histogram matching helps align distribution differences caused by non-brain tissue, making similarity metric more effective
+        "--initial-moving-transform", f"[{reference_image},{corrected_image},1]",  # Initial transform
+        "--transform", "Rigid[0.1]",                                               # Rigid transformation
+        # Cross Correlation metric should work better than Mutual Information 
+        #       when same (e.g., T2-w) modality (according to documentation); 
+        #       however, on average across the different 1.5T/3T scans, MI 
+        #       appears to result in more consistent head positioning 
+        "--metric", f"MI[{reference_image},{corrected_image},1,32,Regular,0.25]",  # Mutual information metric
+        "--convergence", "[2000x1000x500x250,1e-6,10]",  # Convergence criteria (increased iterations to help account for non-brain tissue) 
+        "--shrink-factors", "12x8x4x2",      # Multi-resolution levels (increased to handle larger, more complex images due to inclusion of skull/dura)
+        "--smoothing-sigmas", "4x3x2x1vox",  # Smoothing at each level (increased to handle larger, more complex images due to inclusion of skull/dura)
+        "--verbose", "1"
+    ]
+
+
+def mask_transform_paths(lesion_mask):
+    """Output paths of the mask transform stage for one lesion mask (next to the mask)."""
+    output_mask_transformed = os.path.join(
+        os.path.dirname(lesion_mask), strip_nifti_ext(lesion_mask) + '_rigid_MIWarped.nii.gz'
+    )
+    return {
+        'output_mask_transformed': output_mask_transformed,
+        'manifest_file': output_mask_transformed.replace('Warped.nii.gz', '_manifest.json'),
+    }
+
+
+def apply_transform_command(lesion_mask, affine_transform, output_mask_transformed, reference_image=TEMPLATE_T2W):
+    return [
+        "antsApplyTransforms",
+        "-d", "3",                                     # 3D image
+        "-i", lesion_mask,                             # Input image (mask)
+        "-r", reference_image,                         # Reference image (target space)
+        "-t", affine_transform,                        # Rigid/affine transform
+        "-o", output_mask_transformed,                 # Output filename
+        "-n", "NearestNeighbor"                        # Important: use nearest neighbor for masks
+    ]
+
+
+def ants_env(threads):
+    """Environment for ANTs subprocesses with OpenMP/ITK limited to `threads` threads."""
+    env = os.environ.copy()
+    env['OMP_NUM_THREADS'] = str(threads)  # Limits OpenMP threads
+    env['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'] = str(threads)  # Limits ITK threads
+    return env
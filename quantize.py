@@ -0,0 +1,147 @@
+import types
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+import conformal
+import instrument
+import util
+
+# Post-training quantization of the slice classifier for CPU-only scoring.
+#
+#   quantize.export_tflite_model('best_model__baseline__20250503.keras',
+#                                'best_model__baseline__20250503__int8.tflite',
+#                                representative_scan_dirs=train_dirs)
+#   df_q = util.predict_scans(test_dirs, labels, None, tflite_model='best_model__baseline__20250503__int8.tflite')
+#   report = quantize.quantization_report(df_float, df_q)
+
+KEYS = ['dataset', 'scan_id', 'slice_idx']
+
+
+def representative_slices(scan_dirs, num_samples=256, seed=util.SEED):
+    """
+    Sample preprocessed slices (as fed to the model by `util.predict_scans`) for calibrating
+    int8 activation ranges. Scans are visited in a seeded random order until `num_samples` is reached.
+    """
+    rng = np.random.default_rng(seed)
+    samples = []
+    for scan_dir in rng.permutation(scan_dirs):
+        slices, _ = util.load_slices_from_scan_np(scan_dir)
+        for idx in rng.permutation(len(slices)):
+            samples.append(util.resize_image(slices[idx], (192, 192)).astype(np.float32))
+            if len(samples) >= num_samples:
+                return np.stack(samples, axis=0)
+    return np.stack(samples, axis=0)
+
+
+def export_tflite_model(model_path, output_path, representative_scan_dirs=None, mode='int8', num_samples=256):
+    """
+    Convert a `best_model__*.keras` classifier to a quantized TFLite flatbuffer.
+
+    Parameters:
+      model_path (str): Path to the float Keras model.
+      output_path (str): Where to write the `.tflite` file.
+      representative_scan_dirs (list of str): Slice directories used to calibrate int8 ranges
+        (required for mode='int8'; use training/calibration scans, not test scans).
+      mode (str): 'int8' (full integer kernels, float32 input/output) or 'float16' (float16 weights).
+      num_samples (int): Number of representative slices.
+
+    Returns:
+      str: `output_path`.
+    """
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == 'int8':
+        if not representative_scan_dirs:
+            raise ValueError("mode='int8' requires representative_scan_dirs for calibration.")
+        samples = representative_slices(representative_scan_dirs, num_samples=num_samples)
+        input_shape = tuple(model.input.shape[1:])
+
+        def representative_dataset():
+            for sample in samples:
+                yield [sample.reshape((1,) + input_shape)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        raise ValueError(f"Unknown quantization mode: {mode!r} (expected 'int8' or 'float16').")
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    return output_path
+
+
+@instrument.traced('quantize.coverage_comparison', profile=True)
+def coverage_comparison(float_df, quant_df, alpha=0.1, num_select=42, n_runs=20, names=('float', 'quantized')):
+    """
+    Run conformal prediction on identical calibration/test scan splits for both prediction tables
+    and return per-run coverage and mean prediction-set size (overall and per class).
+
+    Both frames must contain the same scans (as returned by `util.predict_scans`); `names` label
+    the two tables in the `model` column.
+    """
+    ids = float_df['scan_id'].unique()
+    setup = types.SimpleNamespace(cal_df=float_df)
+    rows = []
+    for run in range(n_runs):
+        cal_ids, _ = util.select_calibration_ids_with_class_check(ids, setup, num_select, run)
+        for name, df in zip(names, [float_df, quant_df]):
+            with instrument.span('sweep.split', run=run, model=name):
+                cal = df[df['scan_id'].isin(cal_ids)]
+                test = df[~df['scan_id'].isin(cal_ids)]
+            for class_conditional in [False, True]:
+                res = conformal.conformal_prediction(cal, test, alpha=alpha,
+                                                     class_conditional=class_conditional, verbose=False)
+                res['ps_size'] = res['classes'].apply(len)
+                by_class = res.groupby('class')[['verdict', 'ps_size']].mean()
+                row = {
+                    'model': name,
+                    'run': run,
+                    'class_conditional': class_conditional,
+                    'coverage': res['verdict'].mean(),
+                    'ps_size': res['ps_size'].mean(),
+                }
+                for cls, vals in by_class.iterrows():
+                    row[f'coverage_class_{cls}'] = vals['verdict']
+                    row[f'ps_size_class_{cls}'] = vals['ps_size']
+                rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def quantization_report(float_df, quant_df, alpha=0.1, num_select=42, n_runs=20):
+    """
+    Compare quantized against float predictions.
+
+    Returns a one-row-per-metric DataFrame covering softmax deviation (|Δ pred_prob_1|),
+    `predicted_class` agreement, and the median difference in conformal coverage / set size
+    (quantized minus float, marginal and class-conditional) over `n_runs` shared splits.
+    """
+    keys = KEYS + (['variant_test_data'] if 'variant_test_data' in float_df.columns else [])
+    merged = float_df.merge(quant_df, on=keys, suffixes=('_float', '_quant'), validate='one_to_one')
+    if len(merged) != len(float_df):
+        raise ValueError(f"Quantized predictions cover {len(merged)} of {len(float_df)} float slices.")
+
+    abs_diff = (merged['pred_prob_1_float'] - merged['pred_prob_1_quant']).abs()
+    metrics = {
+        'n_slices': len(merged),
+        'softmax_max_abs_diff': abs_diff.max(),
+        'softmax_mean_abs_diff': abs_diff.mean(),
+        'softmax_p99_abs_diff': abs_diff.quantile(0.99),
+        'predicted_class_agreement': (merged['predicted_class_float'] == merged['predicted_class_quant']).mean(),
+    }
+
+    cov = coverage_comparison(float_df, quant_df, alpha=alpha, num_select=num_select, n_runs=n_runs)
+    value_cols = [c for c in cov.columns if c.startswith(('coverage', 'ps_size'))]
+    paired = cov.pivot_table(index=['run', 'class_conditional'], columns='model', values=value_cols)
+    for class_conditional in [False, True]:
+        mode = 'class_conditional' if class_conditional else 'marginal'
+        sub = paired.xs(class_conditional, level='class_conditional')
+        for col in value_cols:
+            metrics[f'{mode}__{col}__float'] = sub[(col, 'float')].median()
+            metrics[f'{mode}__{col}__delta'] = (sub[(col, 'quantized')] - sub[(col, 'float')]).median()
+
+    return pd.DataFrame({'metric': list(metrics), 'value': list(metrics.values())})
@@ -0,0 +1,199 @@
+import json
+import operator
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Results warehouse for the conformal / coverage outputs of 9-2-0 and 9-3.
+#
+# The 16+ CSVs (`conformal_measures__*`, `conformal_coverage_guarantees__*`, `x4_cal-test_combos__*`)
+# are stored as one Parquet dataset per stage, hive-partitioned by
+# (class_conditional, cal_test, variant_test_data), e.g.
+#   results/conformal_coverage_guarantees__runs__slice_level/class_conditional=True/cal_test=dv3T-cal_dv3T-test/variant_test_data=blurred_SD1/...
+# Marginal and class-conditional rows, overall and per-class rows of a stage live side by side;
+# `variant_test_data` is stored without the leading '_' (as the 9-4-x notebooks strip it) and
+# `class` as a string ('all', '0', '1'). Queries prune partitions before reading any file, and
+# `export_csv` writes the original CSV layouts back out byte-for-byte (floats are read with
+# round-trip precision, so pandas writes back the same shortest repr).
+#
+#   store = results.ResultsStore('results')
+#   store.build(glob.glob('conformal_*.csv') + glob.glob('x4_cal-test_combos__*.csv'))
+#   cov = store.query('conformal_coverage_guarantees__runs__slice_level',
+#                     filters={'class_conditional': True, 'variant_test_data': ['baseline', 'blurred_SD1']},
+#                     columns=['cal_test', 'run', 'coverage'],
+#                     groupby=['variant_test_data', 'cal_test'], agg={'coverage': ['mean', 'std']})
+
+PARTITION_KEYS = ['class_conditional', 'cal_test', 'variant_test_data']
+ROW_COL = '__row'   # row position in the source CSV (export order)
+SOURCE_COL = 'source'  # CSV file (stem) a row came from
+LAYOUTS_FILE = '_layouts.json'
+
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+             '>': operator.gt, '>=': operator.ge}
+
+_MEASURES = re.compile(r'(conformal_measures__(?:runs|summary))__(marginal|class_conditional)(__by_class)?')
+_COVERAGE = re.compile(r'(conformal_coverage_guarantees__(?:runs|summary)__(?:slice|scan)_level)(__class_conditional)?')
+
+
+def describe_csv(csv_name, columns):
+    """
+    Stage of a results CSV and what is needed to write it back out.
+
+    Returns a layout dict: stage, columns (original order) and the implied class_conditional
+    value for files split by it rather than carrying the column (None otherwise).
+    """
+    stem = os.path.splitext(os.path.basename(csv_name))[0]
+    layout = {'stage': stem, 'columns': list(columns), 'class_conditional': None}
+    match = _MEASURES.fullmatch(stem)
+    if match:
+        layout['stage'] = match.group(1)
+        return layout
+    match = _COVERAGE.fullmatch(stem)
+    if match:
+        layout.update(stage=match.group(1), class_conditional=bool(match.group(2)))
+    return layout
+
+
+def canonical_variant(values):
+    return values.astype(str).str.strip('_')
+
+
+def prefixed_variant(values):
+    return values.where(values == 'baseline', '_' + values)
+
+
+class ResultsStore:
+    """Partitioned, columnar store of the conformal / coverage result tables (see module comment)."""
+
+    def __init__(self, root):
+        self.root = root
+        layouts_path = os.path.join(root, LAYOUTS_FILE)
+        self.layouts = {}
+        if os.path.exists(layouts_path):
+            with open(layouts_path) as f:
+                self.layouts = json.load(f)
+
+    # ------------------------------------------------------------------ writing
+
+    def build(self, csv_paths):
+        """(Re)build the store from the results CSVs."""
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root)
+        self.layouts = {}
+        for csv_path in sorted(csv_paths):
+            self.ingest_csv(csv_path)
+
+    def ingest_csv(self, csv_path):
+        df = pd.read_csv(csv_path, float_precision='round_trip')   # keep every float digit for export
+        csv_name = os.path.basename(csv_path)
+        layout = describe_csv(csv_name, df.columns)
+        if layout['class_conditional'] is not None:
+            df['class_conditional'] = layout['class_conditional']
+        if 'variant_test_data' in df.columns:
+            layout['variant_prefixed'] = bool(df['variant_test_data'].astype(str).str.startswith('_').any())
+            df['variant_test_data'] = canonical_variant(df['variant_test_data'])
+        if 'class' in df.columns:
+            df['class'] = df['class'].astype(str)
+        df[ROW_COL] = np.arange(len(df), dtype=np.uint32)
+        df[SOURCE_COL] = os.path.splitext(csv_name)[0]
+
+        partitions = [key for key in PARTITION_KEYS if key in df.columns]
+        layout['partitions'] = partitions
+        for key in partitions:
+            df[key] = df[key].astype(str)   # hive partition values are strings
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        ds.write_dataset(
+            table, os.path.join(self.root, layout['stage']), format='parquet',
+            partitioning=ds.partitioning(pa.schema([(key, pa.string()) for key in partitions]), flavor='hive'),
+            basename_template=f"{layout['stage']}__{os.path.splitext(csv_name)[0]}-{{i}}.parquet",
+            existing_data_behavior='overwrite_or_ignore',
+        )
+        self.layouts[csv_name] = layout
+        with open(os.path.join(self.root, LAYOUTS_FILE), 'w') as f:
+            json.dump(self.layouts, f, indent=2)
+        return layout
+
+    # ------------------------------------------------------------------ reading
+
+    def stages(self):
+        return sorted({layout['stage'] for layout in self.layouts.values()})
+
+    def _partitions(self, stage):
+        return next(layout['partitions'] for layout in self.layouts.values() if layout['stage'] == stage)
+
+    def dataset(self, stage):
+        """
+        Dataset over all files of a stage. The schema is unified across files, since sources of one
+        stage can carry different columns (e.g. per-class rows with `class`, overall rows without).
+        """
+        path = os.path.join(self.root, stage)
+        partition_schema = pa.schema([(key, pa.string()) for key in self._partitions(stage)])
+        partitioning = ds.partitioning(partition_schema, flavor='hive')
+        fragments = ds.dataset(path, format='parquet', partitioning=partitioning).get_fragments()
+        schema = pa.unify_schemas([fragment.physical_schema for fragment in fragments] + [partition_schema],
+                                  promote_options='permissive')
+        return ds.dataset(path, schema=schema, format='parquet', partitioning=partitioning)
+
+    @staticmethod
+    def _expression(filters, partitions):
+        """pyarrow filter expression from {col: value or list} and/or [(col, op, value)]."""
+        if isinstance(filters, dict):
+            filters = [(col, 'in' if isinstance(value, (list, tuple, set)) else '==', value)
+                       for col, value in filters.items()]
+        expression = None
+        for col, op, value in filters or []:
+            if col in partitions or col == 'class':   # stored as strings
+                value = [str(v) for v in value] if op == 'in' else str(value)
+            if col == 'variant_test_data':
+                value = [v.strip('_') for v in value] if op == 'in' else value.strip('_')
+            field = ds.field(col)
+            term = field.isin(list(value)) if op == 'in' else OPERATORS[op](field, value)
+            expression = term if expression is None else expression & term
+        return expression
+
+    def query(self, stage, filters=None, columns=None, groupby=None, agg=None):
+        """
+        Rows of one stage.
+
+        Parameters:
+          stage (str): See `stages()`.
+          filters: {col: value | list} or [(col, op, value)] with op in ==, !=, <, <=, >, >=, in.
+            Predicates on class_conditional / cal_test / variant_test_data prune partitions.
+          columns (list of str): Columns to read (group keys are added automatically).
+          groupby (list of str), agg (dict): Optional group-aggregate (pandas `agg` spec).
+        """
+        partitions = self._partitions(stage)
+        read_columns = None
+        if columns is not None:
+            read_columns = list(dict.fromkeys(list(columns) + list(groupby or [])))
+        table = self.dataset(stage).to_table(columns=read_columns,
+                                             filter=self._expression(filters, partitions))
+        df = table.to_pandas()
+        if 'class_conditional' in df.columns:
+            df['class_conditional'] = df['class_conditional'] == 'True'
+        if groupby:
+            return df.groupby(groupby, observed=True).agg(agg).reset_index()
+        return df.drop(columns=[c for c in (ROW_COL, SOURCE_COL) if c in df.columns and c not in (columns or [])])
+
+    # ------------------------------------------------------------------ legacy layouts
+
+    def export_csv(self, csv_name, dest_dir='.'):
+        """Write one of the original CSV files (same columns, row order and variant naming)."""
+        layout = self.layouts[csv_name]
+        df = self.query(layout['stage'], filters={SOURCE_COL: os.path.splitext(csv_name)[0]},
+                        columns=layout['columns'] + [ROW_COL])
+        df = df.sort_values(ROW_COL).reset_index(drop=True)
+        if layout.get('variant_prefixed'):
+            df['variant_test_data'] = prefixed_variant(df['variant_test_data'])
+        path = os.path.join(dest_dir, csv_name)
+        df[layout['columns']].to_csv(path, index=False)
+        return path
+
+    def export_all(self, dest_dir='.'):
+        return [self.export_csv(csv_name, dest_dir) for csv_name in sorted(self.layouts)]
@@ -0,0 +1,176 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+import nibabel as nib
+import numpy as np
+
+# Adaptive scheduler for the ANTs jobs (N4 + registration, mask transforms).
+#
+# Replaces the fixed `multiprocessing.Pool(8)` with OMP/ITK threads hard-coded to 4:
+#   - detects the cores and memory actually available (SLURM allocation, CPU affinity, MemAvailable),
+#   - estimates each job's cost from its voxel count and past timings of the same stage,
+#   - launches jobs longest-first (LPT) and gives each new job the cores that are free,
+#     so per-job ITK threads grow as the queue drains instead of leaving cores idle at the tail,
+#   - records per-job timings so later estimates improve.
+#
+# ANTs runs as a subprocess, so jobs are launched from threads (no extra Python processes).
+
+DEFAULT_BYTES_PER_VOXEL = 200  # rough peak RSS per input voxel for double-precision antsRegistration
+
+
+def available_cores():
+    """Cores allotted to this process (SLURM allocation if set, else CPU affinity)."""
+    slurm = os.environ.get('SLURM_CPUS_ON_NODE')
+    if slurm:
+        return int(slurm)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory_bytes():
+    """Memory available to jobs (SLURM_MEM_PER_NODE if set, else MemAvailable from /proc/meminfo)."""
+    slurm = os.environ.get('SLURM_MEM_PER_NODE')
+    if slurm:
+        return int(slurm) * 1024 * 1024
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def voxel_count(path):
+    """Number of voxels in a NIfTI volume (header only; no voxel data is read)."""
+    return int(np.prod(nib.load(path).header.get_data_shape()[:3]))
+
+
+class TimingHistory:
+    """
+    Persisted per-stage job timings, used to estimate CPU-seconds per voxel.
+
+    File layout: {stage: [{"key", "voxels", "threads", "seconds"}, ...]}.
+    """
+
+    def __init__(self, path, max_records=1000):
+        self.path = path
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self.records = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.records = json.load(f)
+
+    def record(self, stage, key, voxels, threads, seconds):
+        with self._lock:
+            records = self.records.setdefault(stage, [])
+            records.append({'key': key, 'voxels': voxels, 'threads': threads, 'seconds': round(seconds, 3)})
+            del records[:-self.max_records]
+
+    def cpu_seconds_per_voxel(self, stage):
+        records = self.records.get(stage)
+        if not records:
+            return None
+        return float(np.median([r['seconds'] * r['threads'] / max(r['voxels'], 1) for r in records]))
+
+    def estimate(self, stage, voxels):
+        """Estimated CPU-seconds for a job (relative units from voxel count when there is no history)."""
+        rate = self.cpu_seconds_per_voxel(stage)
+        return voxels * (rate if rate is not None else 1.0)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.records, f, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+@dataclass
+class Job:
+    key: str                 # identifies the job in results/history (e.g. the scan path)
+    stage: str               # timing-history bucket (e.g. 'registration')
+    voxels: int              # input voxel count (cost proxy)
+    args: tuple = field(default_factory=tuple)
+
+
+def schedule(jobs, run_job, cores=None, max_concurrent=None, history=None, memory_bytes=None,
+             bytes_per_voxel=DEFAULT_BYTES_PER_VOXEL, min_threads=1, record_if=lambda result: result == 'ok'):
+    """
+    Run `run_job(*job.args, threads=n)` for every job, longest estimated job first.
+
+    Parameters:
+      jobs (list of Job): Jobs to run.
+      run_job (callable): Called as run_job(*job.args, threads=n); should set OMP/ITK thread
+        counts to `n` for its subprocesses.
+      cores (int): Total threads to keep busy (default: `available_cores()`).
+      max_concurrent (int): Maximum simultaneous jobs (default: cores // 4).
+      history (TimingHistory): Past timings for cost estimates; updated and saved at the end.
+      memory_bytes (int): Memory budget (default: `available_memory_bytes()`); a job is not
+        started while the estimated memory of running jobs plus its own would exceed it.
+      bytes_per_voxel (int): Peak memory estimate per input voxel.
+      min_threads (int): Minimum threads per job.
+      record_if (callable): Only results passing this check are recorded in the history
+        (e.g. cached/skipped runs are not representative timings).
+
+    Returns:
+      dict: job.key -> run_job result.
+    """
+    cores = cores or available_cores()
+    max_concurrent = max_concurrent or max(1, cores // 4)
+    memory_bytes = memory_bytes or available_memory_bytes()
+    history = history or TimingHistory(None)
+
+    pending = sorted(jobs, key=lambda job: history.estimate(job.stage, job.voxels), reverse=True)
+    running = {}
+    results = {}
+
+    def timed(job, threads):
+        start = time.perf_counter()
+        result = run_job(*job.args, threads=threads)
+        return result, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        while pending or running:
+            while pending and len(running) < max_concurrent:
+                job = pending[0]
+                threads_in_use = sum(threads for _, threads, _ in running.values())
+                memory_in_use = sum(memory for _, _, memory in running.values())
+                job_memory = job.voxels * bytes_per_voxel
+                free_threads = cores - threads_in_use
+                if running and (free_threads < min_threads or memory_in_use + job_memory > memory_bytes):
+                    break
+                # share the free cores among the jobs that can still start now
+                starters = min(max_concurrent - len(running), len(pending))
+                threads = max(min_threads, free_threads // starters)
+                pending.pop(0)
+                future = executor.submit(timed, job, threads)
+                running[future] = (job, threads, job_memory)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, threads, _ = running.pop(future)
+                try:
+                    result, seconds = future.result()
+                except Exception as e:
+                    print(f"[ERROR] {job.key}: {e!r}")
+                    results[job.key] = 'failed'
+                    continue
+                results[job.key] = result
+                if record_if(result):
+                    history.record(job.stage, job.key, job.voxels, threads, seconds)
+
+    history.save()
+    return results
@@ -0,0 +1,380 @@
+import asyncio
+import base64
+import collections
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+import conformal
+import util
+
+# Local scoring service: MS/healthy slice predictions + conformal prediction sets.
+#
+# Concurrent requests are queued and micro-batched into single model calls (bounded by
+# `max_batch_slices` and `max_latency_ms`); a calibration loaded once at start-up turns the
+# softmax outputs into p-values, prediction sets, credibility and confidence.
+#
+#   calibration = service.Calibration.from_predictions(cal_df, alpha=0.1, class_conditional=True)
+#   svc = service.ScoringService(tf.keras.models.load_model('best_model__baseline__20250503.keras'), calibration)
+#   asyncio.run(svc.serve_forever(port=8765))          # HTTP on localhost
+#
+#   POST /score    {"scan_dir": "..."}  or  {"stack": "<base64 raw bytes>", "shape": [n, h, w], "dtype": "uint8"}
+#   GET  /metrics  latency percentiles, queue depth, batch statistics
+#   GET  /health
+
+
+class Calibration:
+    """
+    Preloaded conformal calibration (sorted nonconformity scores per class).
+
+    Attributes:
+        alphas (dict): {0: sorted alphas, 1: sorted alphas} (see `conformal.calibration_alphas`).
+        eps (float): Significance level used to form prediction sets.
+        class_conditional (bool): Whether the alphas were stratified by class.
+    """
+
+    def __init__(self, alphas, eps=0.1, class_conditional=False):
+        self.alphas = alphas
+        self.eps = eps
+        self.class_conditional = class_conditional
+
+    @classmethod
+    def from_predictions(cls, cal, alpha=0.1, class_conditional=False):
+        """Build from a calibration prediction table (`class`, `actual_class_pred_prob`)."""
+        return cls(conformal.calibration_alphas(cal, class_conditional), alpha, class_conditional)
+
+    def save(self, path):
+        np.savez(path, alphas_0=self.alphas[0], alphas_1=self.alphas[1],
+                 eps=self.eps, class_conditional=self.class_conditional)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls({0: f['alphas_0'], 1: f['alphas_1']}, float(f['eps']), bool(f['class_conditional']))
+
+    def score(self, probs):
+        """
+        Per-slice conformal outputs for an (n, 2) array of softmax probabilities.
+
+        Mirrors `conformal.PredictionClass`: `classes` holds labels with p-value > eps,
+        credibility is the largest p-value and confidence is 1 minus the second largest.
+        """
+        p_values = conformal.conformal_p_values(self.alphas, probs)
+        ordered = np.sort(p_values, axis=1)
+        classes = p_values > self.eps
+        return {
+            'p_values': p_values,
+            'classes': [[cls for cls in (0, 1) if row[cls]] for row in classes],
+            'credibility': ordered[:, -1],
+            'confidence': 1 - ordered[:, -2],
+            'margin': ordered[:, -1] - ordered[:, -2],
+        }
+
+
+def preprocess_stack(stack, target_size=(192, 192)):
+    """
+    Min-max normalize each slice and resize the whole stack in one TF call
+    (same per-slice result as `util.preprocess_slice_np` + `util.resize_image`).
+    """
+    stack = np.asarray(stack, dtype=np.float32)
+    if stack.ndim == 2:
+        stack = stack[None]
+    lo = stack.min(axis=(1, 2), keepdims=True)
+    hi = stack.max(axis=(1, 2), keepdims=True)
+    stack = (stack - lo) / (hi - lo)
+    return tf.image.resize(stack[..., None], target_size).numpy()
+
+
+def summarize_scan(scored):
+    """
+    Scan-level summary of per-slice conformal outputs: the share of slice prediction sets
+    containing each class, a majority prediction set (classes in >= half of slice sets)
+    and median slice credibility/confidence. This is a descriptive aggregate; the coverage
+    guarantee holds at the slice level.
+    """
+    contains = np.array([[cls in classes for cls in (0, 1)] for classes in scored['classes']], dtype=float)
+    class_fraction = contains.mean(axis=0) if len(contains) else np.zeros(2)
+    return {
+        'n_slices': len(scored['classes']),
+        'class_fraction': {str(cls): float(class_fraction[cls]) for cls in (0, 1)},
+        'classes': [cls for cls in (0, 1) if class_fraction[cls] >= 0.5],
+        'credibility': float(np.median(scored['credibility'])),
+        'confidence': float(np.median(scored['confidence'])),
+    }
+
+
+class ScoringService:
+    """
+    Asyncio micro-batching scorer wrapping a slice classifier and a `Calibration`.
+
+    Requests (one scan each) are queued; a single batcher task drains the queue until either
+    `max_batch_slices` slices are collected or the oldest request has waited `max_latency_ms`,
+    then runs one model call for the whole batch in a dedicated inference thread.
+    """
+
+    def __init__(self, model, calibration, max_batch_slices=256, max_latency_ms=10.0,
+                 io_workers=4, latency_window=10000):
+        self.model = model
+        self.calibration = calibration
+        self.max_batch_slices = max_batch_slices
+        self.max_latency = max_latency_ms / 1000
+        self.io_workers = io_workers
+        self._io = ThreadPoolExecutor(max_workers=io_workers)
+        self._inference = ThreadPoolExecutor(max_workers=1)
+        self._queue = None
+        self._batcher = None
+        self._in_flight = []   # requests of the batch being collected / scored
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._counts = collections.Counter()
+
+    def _predict(self, batch):
+        if isinstance(self.model, util.TFLiteClassifier):
+            return self.model.predict(batch)
+        return self.model(batch, training=False).numpy()
+
+    async def start(self):
+        if self._io is None:
+            # restarted after `stop()`, which shuts the executors down
+            self._io = ThreadPoolExecutor(max_workers=self.io_workers)
+            self._inference = ThreadPoolExecutor(max_workers=1)
+        if self._batcher is None:
+            self._queue = asyncio.Queue()
+            self._batcher = asyncio.create_task(self._run_batcher())
+
+    async def stop(self):
+        """Stop the batcher and shut the executors down; `start()` recreates them."""
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+        if self._queue is not None:
+            # requests queued but not yet batched would otherwise wait forever
+            pending = []
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            self._fail(pending, RuntimeError('ScoringService stopped'))
+        if self._io is not None:
+            self._io.shutdown(wait=False)
+            self._inference.shutdown(wait=False)
+            self._io = self._inference = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+
+    @staticmethod
+    def _fail(items, error):
+        for _, future in items:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _run_batcher(self):
+        try:
+            await self._batch_forever()
+        except asyncio.CancelledError:
+            self._fail(self._in_flight, RuntimeError('ScoringService stopped'))
+            raise
+
+    async def _batch_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = self._in_flight = [await self._queue.get()]
+            n_slices = len(items[0][0])
+            deadline = loop.time() + self.max_latency
+            while n_slices < self.max_batch_slices:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    await asyncio.sleep(min(0.001, remaining))
+                    continue
+                items.append(item)
+                n_slices += len(item[0])
+
+            batch = np.concatenate([stack for stack, _ in items], axis=0)
+            self._counts['batches'] += 1
+            self._counts['batched_slices'] += len(batch)
+            try:
+                probs = await loop.run_in_executor(self._inference, self._predict, batch)
+            except Exception as e:
+                self._fail(items, e)
+                continue
+            offset = 0
+            for stack, future in items:
+                if not future.done():
+                    future.set_result(probs[offset:offset + len(stack)])
+                offset += len(stack)
+
+    async def _submit(self, stack):
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((stack, future))
+        return await future
+
+    async def score_stack(self, stack, meta=None):
+        """
+        Score an in-memory stack of raw slices, shape (n, h, w).
+
+        Returns {'slices': [...], 'scan': {...}}, one slice record per input slice
+        (merged with `meta[i]` when given) and a scan-level summary (`summarize_scan`).
+        """
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        batch = await loop.run_in_executor(self._io, preprocess_stack, stack)
+        probs = await self._submit(batch)
+        scored = self.calibration.score(probs)
+
+        slices = []
+        for i in range(len(probs)):
+            record = dict(meta[i]) if meta is not None else {'slice': i}
+            record.update({
+                'pred_prob_0': float(probs[i, 0]),
+                'pred_prob_1': float(probs[i, 1]),
+                'predicted_class': int(probs[i].argmax()),
+                'p_value_0': float(scored['p_values'][i, 0]),
+                'p_value_1': float(scored['p_values'][i, 1]),
+                'classes': scored['classes'][i],
+                'credibility': float(scored['credibility'][i]),
+                'confidence': float(scored['confidence'][i]),
+                'margin': float(scored['margin'][i]),
+            })
+            slices.append(record)
+
+        self._latencies.append(time.perf_counter() - start)
+        self._counts['requests'] += 1
+        self._counts['slices'] += len(probs)
+        return {'slices': slices, 'scan': summarize_scan(scored)}
+
+    async def score_dir(self, scan_dir):
+        """Score a scan directory of `slice_*.png` files (metadata as in `util.load_slices_from_scan_np`)."""
+        slices, meta = await asyncio.get_running_loop().run_in_executor(
+            self._io, util.load_slices_from_scan_np, scan_dir)
+        return await self.score_stack(np.stack(slices, axis=0), meta)
+
+    def metrics(self):
+        """Latency percentiles (ms, over the most recent requests), queue depth and batch counts."""
+        latencies = np.array(self._latencies) * 1000
+        batches = self._counts['batches']
+        return {
+            'requests': self._counts['requests'],
+            'slices': self._counts['slices'],
+            'batches': batches,
+            'mean_batch_slices': self._counts['batched_slices'] / batches if batches else 0.0,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+        }
+
+    # --- HTTP (localhost) ---
+
+    async def _handle_request(self, method, path, body):
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok'}
+        if method == 'GET' and path == '/metrics':
+            return 200, self.metrics()
+        if method == 'POST' and path == '/score':
+            try:
+                request = json.loads(body or b'{}')
+                stack = None
+                if 'stack' in request and 'scan_dir' not in request:
+                    stack = np.frombuffer(base64.b64decode(request['stack']),
+                                          dtype=request.get('dtype', 'uint8')).reshape(request['shape'])
+                    if stack.ndim != 3:
+                        raise ValueError(f"expected a (n, h, w) stack, got shape {stack.shape}")
+            except (ValueError, KeyError, TypeError) as e:   # bad JSON / base64 / dtype / shape
+                return 400, {'error': f'malformed request: {e}'}
+            if 'scan_dir' in request:
+                return 200, await self.score_dir(request['scan_dir'])
+            if stack is not None:
+                return 200, await self.score_stack(stack)
+            return 400, {'error': "expected 'scan_dir' or 'stack'"}
+        return 404, {'error': f'no route for {method} {path}'}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+            try:
+                method, path = request_line[0], request_line[1]
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+            except (IndexError, ValueError):
+                status, payload = 400, {'error': 'malformed request line or Content-Length'}
+            else:
+                try:
+                    status, payload = await self._handle_request(method, path, body)
+                except Exception as e:
+                    status, payload = 500, {'error': repr(e)}
+            data = json.dumps(payload).encode()
+            writer.write(f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+                         f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode() + data)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        """Start the batcher and an HTTP server; returns the `asyncio.Server`."""
+        await self.start()
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def serve_forever(self, host='127.0.0.1', port=8765):
+        server = await self.serve(host, port)
+        async with server:
+            await server.serve_forever()
+
+
+class LocalClient:
+    """Minimal asyncio HTTP client for a `ScoringService` on localhost (no external dependencies)."""
+
+    def __init__(self, host='127.0.0.1', port=8765):
+        self.host = host
+        self.port = port
+
+    async def _request(self, method, path, payload=None):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        writer.write(f'{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n'
+                     f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n'.encode() + body)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        head, _, data = response.partition(b'\r\n\r\n')
+        status = int(head.split()[1])
+        result = json.loads(data)
+        if status != 200:
+            raise RuntimeError(f'{method} {path} failed ({status}): {result}')
+        return result
+
+    async def score_dir(self, scan_dir):
+        return await self._request('POST', '/score', {'scan_dir': scan_dir})
+
+    async def score_stack(self, stack):
+        stack = np.ascontiguousarray(stack)
+        return await self._request('POST', '/score', {
+            'stack': base64.b64encode(stack.tobytes()).decode('ascii'),
+            'shape': list(stack.shape),
+            'dtype': str(stack.dtype),
+        })
+
+    async def metrics(self):
+        return await self._request('GET', '/metrics')
+
+    async def health(self):
+        return await self._request('GET', '/health')
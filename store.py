@@ -0,0 +1,120 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Typed, columnar storage for the prediction tables (`all_unseen_*_variant_scans_preds_for_baseline_model.pkl`).
+#
+# Tables are written as zstd-compressed Parquet datasets partitioned by `variant_test_data`
+# (one directory per variant), with dictionary-encoded categoricals for the string columns
+# and narrow numeric types. Readers project columns and filter variants at the file level,
+# so a notebook that needs one variant and three columns reads only those bytes.
+#
+#   store.convert_pickle('all_unseen_3T_variant_scans_preds_for_baseline_model.pkl',
+#                        'all_unseen_3T_variant_scans_preds_for_baseline_model.parquet')
+#   df3 = store.read_predictions('all_unseen_3T_variant_scans_preds_for_baseline_model.parquet',
+#                                variants=['baseline'], legacy=True)   # same frame as read_pickle
+
+PARTITION_COL = 'variant_test_data'
+ROW_COL = '__row'  # original row position, so reads return rows in the pickled order
+
+# today's DataFrame schema (as written by util.predict_scans in the 9-1-x notebooks), in column order
+LEGACY_DTYPES = {
+    'dataset': object,
+    'scan_id': object,
+    'slice_idx': np.int64,
+    'class': np.int64,
+    'predicted_class': np.int64,
+    'is_correct': bool,
+    'pred_prob_0': np.float64,
+    'pred_prob_1': np.float64,
+    'actual_class_pred_prob': np.float64,
+    'variant_test_data': object,
+    'model': object,
+}
+
+COMPACT_DTYPES = {
+    'dataset': 'category',
+    'scan_id': 'category',
+    'slice_idx': np.int16,
+    'class': np.uint8,
+    'predicted_class': np.uint8,
+    'is_correct': bool,
+    'variant_test_data': 'category',
+    'model': 'category',
+}
+
+FLOAT_COLS = ['pred_prob_0', 'pred_prob_1', 'actual_class_pred_prob']
+
+
+def _float32_is_lossless(values):
+    values = np.asarray(values, dtype=np.float64)
+    return np.array_equal(values.astype(np.float32).astype(np.float64), values, equal_nan=True)
+
+
+def compact_predictions(df):
+    """
+    Narrow a prediction table: categoricals for strings, int16/uint8 integers, and float32
+    probabilities where that is lossless (softmax outputs are float32 to begin with; a column
+    holding values that are not exactly representable stays float64).
+    """
+    dtypes = {col: dtype for col, dtype in COMPACT_DTYPES.items() if col in df.columns}
+    for col in FLOAT_COLS:
+        if col in df.columns and _float32_is_lossless(df[col]):
+            dtypes[col] = np.float32
+    for col in df.columns:
+        if col not in dtypes and df[col].dtype == object:
+            dtypes[col] = 'category'
+    return df.astype(dtypes)
+
+
+def to_legacy(df):
+    """Restore today's DataFrame schema (object strings, int64, float64) and column order."""
+    dtypes = {col: dtype for col, dtype in LEGACY_DTYPES.items() if col in df.columns}
+    df = df.astype(dtypes)
+    ordered = [col for col in LEGACY_DTYPES if col in df.columns]
+    return df[ordered + [col for col in df.columns if col not in LEGACY_DTYPES]]
+
+
+def write_predictions(df, path, partition_cols=(PARTITION_COL,), compression='zstd'):
+    """Write a prediction table as a Parquet dataset partitioned by `partition_cols` (replacing `path`)."""
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path, topdown=False):
+            for name in files:
+                if name.endswith('.parquet'):
+                    os.remove(os.path.join(root, name))
+    df = compact_predictions(df).assign(**{ROW_COL: np.arange(len(df), dtype=np.uint32)})
+    df.to_parquet(path, partition_cols=list(partition_cols), compression=compression, index=False)
+
+
+def read_predictions(path, columns=None, variants=None, filters=None, memory_map=True, legacy=False):
+    """
+    Read a prediction table written by `write_predictions`.
+
+    Parameters:
+      path (str): Dataset directory.
+      columns (list of str): Columns to read (default: all).
+      variants (list of str): `variant_test_data` values to keep; other partitions are not read.
+      filters (list): Additional pyarrow filters, e.g. [('dataset', '==', 'ISBI_3T_train')].
+      memory_map (bool): Memory-map the files instead of reading them into buffers first.
+      legacy (bool): Return today's schema (see `to_legacy`) instead of the compact one.
+    """
+    filters = list(filters or [])
+    if variants is not None:
+        filters.append((PARTITION_COL, 'in', list(variants)))
+    if columns is not None:
+        columns = list(columns) + [ROW_COL]
+    df = pd.read_parquet(path, columns=columns, filters=filters or None, memory_map=memory_map)
+    df = df.sort_values(ROW_COL, kind='stable').drop(columns=ROW_COL).reset_index(drop=True)
+    if PARTITION_COL in df.columns:
+        # partition values come back as categories of every partition; drop unused ones
+        df[PARTITION_COL] = df[PARTITION_COL].astype(str).astype('category')
+    return to_legacy(df) if legacy else df
+
+
+def convert_pickle(pkl_path, path):
+    """Convert one of the pickled prediction tables; returns (rows, pickle bytes, dataset bytes)."""
+    df = pd.read_pickle(pkl_path)
+    write_predictions(df, path)
+    dataset_bytes = sum(os.path.getsize(os.path.join(root, name))
+                        for root, _, files in os.walk(path) for name in files)
+    return len(df), os.path.getsize(pkl_path), dataset_bytes
@@ -0,0 +1,37 @@
+import filecmp
+import glob
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import results  # noqa: E402
+
+CSVS = sorted(glob.glob(os.path.join(REPO, 'conformal_*.csv'))
+              + glob.glob(os.path.join(REPO, 'x4_cal-test_combos__*.csv')))
+
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    store = results.ResultsStore(str(tmp_path_factory.mktemp('results')))
+    store.build(CSVS)
+    return store
+
+
+@pytest.mark.parametrize('csv_path', CSVS, ids=os.path.basename)
+def test_export_round_trip(store, csv_path, tmp_path):
+    exported = store.export_csv(os.path.basename(csv_path), str(tmp_path))
+    assert filecmp.cmp(csv_path, exported, shallow=False)
+
+
+def test_query_across_sources_with_different_columns(store):
+    # overall rows (no `class` column) and per-class rows share one stage
+    stage = 'conformal_coverage_guarantees__runs__slice_level'
+    df = store.query(stage, filters={'class_conditional': True, 'class': '1'})
+    assert len(df) > 0
+    assert (df['class'] == '1').all()
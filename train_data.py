@@ -0,0 +1,203 @@
+import glob
+import math
+import numpy as np
+import tensorflow as tf
+
+import util
+
+# Streaming training input pipeline (step 8).
+#
+# Slices are read and decoded from their PNG files inside the tf.data graph, so the training
+# set no longer has to fit in memory, and augmentation runs as native, stateless TF ops in
+# parallel `map` calls (no tf.py_function / GIL). Every random draw is seeded from
+# (util.SEED, epoch, sample index), so an epoch is reproducible regardless of thread scheduling.
+#
+#   train_files, train_lbls = train_data.list_slice_files(train_scans, train_labels)
+#   val_files, val_lbls = train_data.list_slice_files(val_scans, val_labels)
+#   train_dataset = train_data.create_streaming_dataset(train_files, train_lbls, augment=True,
+#                                                       batch_size=32, epochs=100)
+#   val_dataset = train_data.create_streaming_dataset(val_files, val_lbls, augment=False, batch_size=32)
+#   model.fit(train_dataset, validation_data=val_dataset, epochs=100,
+#             steps_per_epoch=train_data.steps_per_epoch(train_files, 32))
+#
+# The augmentation mirrors `get_mri_augmentation_pipeline` from the training notebook
+# (same probabilities and parameter ranges). Albumentations' CLAHE has no native TF
+# equivalent and is replaced by global histogram equalization within the same OneOf.
+
+TARGET_SIZE = (192, 192)
+
+
+def list_slice_files(scan_folder_list, label_list):
+    """Slice PNG paths and per-slice labels (the file-level counterpart of `util.load_slices_from_dir_and_label_lists`)."""
+    files, labels = [], []
+    for scan_dir, label in zip(scan_folder_list, label_list):
+        slice_files = glob.glob(f'{scan_dir}/*.png')
+        files.extend(slice_files)
+        labels.extend([label] * len(slice_files))
+    return np.array(files), np.array(labels, dtype=np.int32)
+
+
+def steps_per_epoch(files, batch_size):
+    return math.ceil(len(files) / batch_size)
+
+
+def decode_slice(path):
+    """Read a grayscale slice PNG as a float32 (h, w, 1) tensor with values in [0, 255]."""
+    image = tf.io.decode_png(tf.io.read_file(path), channels=1)
+    return tf.cast(image, tf.float32)
+
+
+def _to_uint8_range(image):
+    # Albumentations operates on uint8 images; round and clip after each intensity transform.
+    return tf.round(tf.clip_by_value(image, 0.0, 255.0))
+
+
+def _brightness_contrast(image, seed, limit=0.2):
+    alpha = 1.0 + tf.random.stateless_uniform([], seed[0], -limit, limit)
+    beta = tf.random.stateless_uniform([], seed[1], -limit, limit) * 255.0
+    return _to_uint8_range(image * alpha + beta)
+
+
+def _gamma(image, seed, gamma_limit=(80, 120)):
+    gamma = tf.random.stateless_uniform([], seed[0], gamma_limit[0], gamma_limit[1]) / 100.0
+    return _to_uint8_range(255.0 * tf.pow(image / 255.0, gamma))
+
+
+def _equalize(image, seed):
+    # Stand-in for CLAHE(clip_limit=2.0): global histogram equalization of the uint8 image.
+    values = tf.cast(image, tf.int32)
+    hist = tf.math.bincount(tf.reshape(values, [-1]), minlength=256, maxlength=256, dtype=tf.float32)
+    cdf = tf.cumsum(hist)
+    cdf_min = tf.reduce_min(tf.boolean_mask(cdf, cdf > 0))
+    lut = (cdf - cdf_min) / tf.maximum(cdf[-1] - cdf_min, 1.0) * 255.0
+    return _to_uint8_range(tf.gather(lut, values))
+
+
+def _gaussian_blur(image, seed, blur_limit=(3, 5)):
+    # Odd kernel size in blur_limit; sigma derived from the kernel size as in OpenCV (sigma=0).
+    ksize = 2 * tf.random.stateless_uniform([], seed[0], blur_limit[0] // 2, blur_limit[1] // 2 + 1, dtype=tf.int32) + 1
+    sigma = 0.3 * ((tf.cast(ksize, tf.float32) - 1.0) * 0.5 - 1.0) + 0.8
+    radius = blur_limit[1] // 2
+    x = tf.range(-radius, radius + 1, dtype=tf.float32)
+    kernel = tf.exp(-0.5 * tf.square(x / sigma)) * tf.cast(tf.abs(x) <= tf.cast(ksize // 2, tf.float32), tf.float32)
+    kernel = kernel / tf.reduce_sum(kernel)
+    padded = tf.pad(image[None], [[0, 0], [radius, radius], [radius, radius], [0, 0]], mode='REFLECT')
+    blurred = tf.nn.conv2d(padded, tf.reshape(kernel, [-1, 1, 1, 1]), strides=1, padding='VALID')
+    blurred = tf.nn.conv2d(blurred, tf.reshape(kernel, [1, -1, 1, 1]), strides=1, padding='VALID')
+    return _to_uint8_range(blurred[0])
+
+
+def _jpeg(image, seed, quality=(50, 80)):
+    compressed = tf.image.stateless_random_jpeg_quality(tf.cast(image, tf.uint8), quality[0], quality[1], seed[0])
+    return tf.cast(compressed, tf.float32)
+
+
+def _gauss_noise(image, seed, var_limit=(0.0005, 0.002)):
+    # As in Albumentations for uint8 input, the variance is in pixel units.
+    sigma = tf.sqrt(tf.random.stateless_uniform([], seed[0], var_limit[0], var_limit[1]))
+    noise = tf.random.stateless_normal(tf.shape(image), seed[1], stddev=sigma)
+    return _to_uint8_range(image + noise)
+
+
+def _shift_scale_rotate(image, seed, shift_limit=0.02, scale_limit=0.03, rotate_limit=5):
+    height = tf.cast(tf.shape(image)[0], tf.float32)
+    width = tf.cast(tf.shape(image)[1], tf.float32)
+    angle = tf.random.stateless_uniform([], seed[0], -rotate_limit, rotate_limit) * math.pi / 180.0
+    scale = 1.0 + tf.random.stateless_uniform([], seed[1], -scale_limit, scale_limit)
+    dx = tf.random.stateless_uniform([], seed[2], -shift_limit, shift_limit) * width
+    dy = tf.random.stateless_uniform([], seed[3], -shift_limit, shift_limit) * height
+
+    # cv2.getRotationMatrix2D(center, angle, scale) + shift, inverted to map output -> input pixels.
+    cx, cy = (width - 1.0) / 2.0, (height - 1.0) / 2.0
+    a, b = scale * tf.cos(angle), scale * tf.sin(angle)
+    tx = (1.0 - a) * cx - b * cy + dx
+    ty = b * cx + (1.0 - a) * cy + dy
+    s2 = scale * scale
+    transform = tf.stack([
+        a / s2, -b / s2, -(a * tx - b * ty) / s2,
+        b / s2, a / s2, -(b * tx + a * ty) / s2,
+        0.0, 0.0,
+    ])[None]
+    warped = tf.raw_ops.ImageProjectiveTransformV3(
+        images=image[None], transforms=transform, output_shape=tf.shape(image)[:2],
+        fill_value=0.0, interpolation='BILINEAR', fill_mode='CONSTANT')
+    return warped[0]
+
+
+def _one_of(image, seed, transforms):
+    choice = tf.random.stateless_uniform([], seed, 0, len(transforms), dtype=tf.int32)
+    branches = [lambda t=t: t(image, tf.random.experimental.stateless_split(seed, 4)) for t in transforms]
+    return tf.switch_case(choice, branches)
+
+
+def _maybe(image, seed, p, fn):
+    apply = tf.random.stateless_uniform([], seed[0]) < p
+    return tf.cond(apply, lambda: fn(image, tf.random.experimental.stateless_split(seed[1], 4)), lambda: image)
+
+
+def augment_slice(image, seed, crop_size=TARGET_SIZE):
+    """
+    Native-TF counterpart of the training notebook's Albumentations pipeline
+    (OneOf intensity p=0.5, OneOf blur/JPEG p=0.3, GaussNoise p=0.3, ShiftScaleRotate p=0.3, CenterCrop).
+
+    Parameters:
+      image: float32 (h, w, 1) tensor with values in [0, 255].
+      seed: int (2,) tensor; the same seed always produces the same augmentation.
+    """
+    seeds = tf.random.experimental.stateless_split(seed, 8)
+    image = _maybe(image, seeds[0:2], 0.5,
+                   lambda img, s: _one_of(img, s[0], [_brightness_contrast, _gamma, _equalize]))
+    image = _maybe(image, seeds[2:4], 0.3,
+                   lambda img, s: _one_of(img, s[0], [_gaussian_blur, _jpeg]))
+    image = _maybe(image, seeds[4:6], 0.3, _gauss_noise)
+    image = _maybe(image, seeds[6:8], 0.3, _shift_scale_rotate)
+    return tf.image.resize_with_crop_or_pad(image, crop_size[0], crop_size[1])
+
+
+def finalize_slice(image):
+    """Resize to 192x192 (as in deployment) and min-max normalize, as in the notebook's `preprocess`."""
+    image = tf.image.resize(image, TARGET_SIZE, method=tf.image.ResizeMethod.BILINEAR)
+    image = util.min_max_normalize(image)
+    return tf.ensure_shape(image, [TARGET_SIZE[0], TARGET_SIZE[1], 1])
+
+
+def create_streaming_dataset(files, labels, augment, batch_size, epochs=1, seed=util.SEED, cache=''):
+    """
+    Build a tf.data pipeline that streams slices from disk.
+
+    Parameters:
+      files, labels: Slice PNG paths and int labels (see `list_slice_files`).
+      augment (bool): Training mode. Each epoch is reshuffled and augmented with seeds derived
+        from (seed, epoch, sample index); `epochs` epochs are emitted back to back, each as
+        `steps_per_epoch(files, batch_size)` batches, so pass `steps_per_epoch` to `model.fit`.
+        When False (validation), decoded and preprocessed slices are cached
+        (in memory, or in the file given by `cache`) and re-served every epoch.
+      batch_size (int): Batch size.
+      epochs (int): Number of training epochs to generate (ignored when augment=False).
+      seed (int): Base seed.
+      cache (str): tf.data cache filename for the validation set ('' = memory).
+    """
+    files = tf.constant(files)
+    labels = tf.constant(labels, dtype=tf.int32)
+    n = int(files.shape[0])
+
+    if not augment:
+        dataset = tf.data.Dataset.from_tensor_slices((files, labels))
+        dataset = dataset.map(lambda path, label: (finalize_slice(decode_slice(path)), label),
+                              num_parallel_calls=tf.data.AUTOTUNE)
+        return dataset.cache(cache).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    def load(index, epoch):
+        image = decode_slice(files[index])
+        sample_seed = tf.stack([tf.cast(seed, tf.int64) + epoch, tf.cast(index, tf.int64)])
+        image = augment_slice(image, sample_seed)
+        return finalize_slice(image), labels[index]
+
+    def epoch_dataset(epoch):
+        order = tf.argsort(tf.random.stateless_uniform([n], tf.stack([tf.cast(seed, tf.int64), epoch])))
+        return (tf.data.Dataset.from_tensor_slices(order)
+                .map(lambda index: load(index, epoch), num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+                .batch(batch_size))
+
+    dataset = tf.data.Dataset.range(epochs).flat_map(epoch_dataset)
+    return dataset.prefetch(tf.data.AUTOTUNE)
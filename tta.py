@@ -0,0 +1,205 @@
+import argparse
+import math
+import re
+import time
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+import instrument
+import quantize
+import util
+
+# Test-time augmentation (TTA) for conformal scoring.
+#
+# `util.predict_scans(..., tta_views=tta.DEFAULT_VIEWS)` builds K augmented views of every decoded,
+# resized slice of a scan as one batched tensor (view-major: K x slices), runs them through the model
+# in a single fused batch and reduces them to mean probabilities (`pred_prob_*` and everything derived
+# from them, so the frame feeds `conformal.conformal_prediction` unchanged) plus `tta_var`, the
+# across-view variance of the class-1 probability.
+#
+# Views use the variant names of `augment.parse_variant` and mirror the deployment shifts with native
+# TF ops on the normalized [0, 1] slices: 'baseline', 'blurred_SD<sigma>' (separable Gaussian,
+# kernel size 2*ceil(2*sigma)+1, replicate padding as MATLAB `imgaussfilt`), 'contrast_imadjust'
+# (1%/99% linear stretch), 'contrast_histeq' (64-level equalization through the empirical CDF) and
+# 'gamma_<g>'. CLAHE ('contrast_adapthisteq') has no batched TF equivalent and is not available as a view.
+#
+#   df_tta = util.predict_scans(test_dirs, labels, model, tta_views=tta.DEFAULT_VIEWS)
+#   report = tta.tta_report(df_single, df_tta)
+#
+#   python tta.py --model best_model__baseline__20250503.keras --scans test_dirs.txt --ks 1,2,4,7
+
+DEFAULT_VIEWS = ('baseline', 'blurred_SD1', 'blurred_SD2', 'contrast_imadjust', 'contrast_histeq',
+                 'gamma_0.8', 'gamma_1.25')
+HISTEQ_LEVELS = 64   # MATLAB `histeq` default
+
+_VIEW_FUNCTIONS = {}
+
+
+def _replicate_pad(x, radius):
+    """Pad (N, H, W, C) by repeating the border rows / columns (MATLAB 'replicate', as `augment.imgaussfilt`)."""
+    x = tf.concat([tf.repeat(x[:, :1], radius, axis=1), x, tf.repeat(x[:, -1:], radius, axis=1)], axis=1)
+    return tf.concat([tf.repeat(x[:, :, :1], radius, axis=2), x, tf.repeat(x[:, :, -1:], radius, axis=2)], axis=2)
+
+
+def _gaussian_blur(sigma):
+    radius = int(math.ceil(2 * sigma))
+    taps = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    taps = (taps / taps.sum()).astype(np.float32)
+    kernel_y = tf.constant(taps.reshape(-1, 1, 1, 1))
+    kernel_x = tf.constant(taps.reshape(1, -1, 1, 1))
+
+    def blur(x):
+        x = _replicate_pad(x, radius)
+        x = tf.nn.conv2d(x, kernel_y, strides=1, padding='VALID')
+        return tf.nn.conv2d(x, kernel_x, strides=1, padding='VALID')
+    return blur
+
+
+def _imadjust(x):
+    flat = tf.sort(tf.reshape(x, [tf.shape(x)[0], -1]), axis=1)
+    n = tf.shape(flat)[1]
+    low = flat[:, tf.cast(0.01 * tf.cast(n, tf.float32), tf.int32)]
+    high = flat[:, tf.cast(0.99 * tf.cast(n, tf.float32), tf.int32) - 1]
+    low, high = low[:, None, None, None], high[:, None, None, None]
+    stretched = tf.clip_by_value((x - low) / tf.maximum(high - low, 1e-6), 0.0, 1.0)
+    return tf.where(high > low, stretched, x)   # flat slice: unchanged, as stretchlim falls back to [0, 1]
+
+
+def _histeq(x):
+    shape = tf.shape(x)
+    flat = tf.reshape(x, [shape[0], -1])
+    cdf = tf.cast(tf.searchsorted(tf.sort(flat, axis=1), flat, side='right'), tf.float32) / tf.cast(tf.shape(flat)[1], tf.float32)
+    levels = HISTEQ_LEVELS - 1
+    return tf.reshape(tf.round(cdf * levels) / levels, shape)
+
+
+def _gamma(g):
+    return lambda x: tf.pow(tf.maximum(x, 0.0), g)
+
+
+def view_op(spec):
+    """Batched TF operation (N, H, W, 1) -> (N, H, W, 1) for one view spec (see module comment)."""
+    name = spec.lstrip('_')
+    if name == 'baseline':
+        return tf.identity
+    match = re.fullmatch(r'blurred_SD(\d+(?:\.\d+)?)', name)
+    if match:
+        return _gaussian_blur(float(match.group(1)))
+    if name == 'contrast_imadjust':
+        return _imadjust
+    if name == 'contrast_histeq':
+        return _histeq
+    match = re.fullmatch(r'gamma_(\d+(?:\.\d+)?)', name)
+    if match:
+        return _gamma(float(match.group(1)))
+    raise ValueError(f"Unsupported TTA view: {spec!r} (expected 'baseline', 'blurred_SD<sigma>', "
+                     f"'contrast_imadjust', 'contrast_histeq' or 'gamma_<g>').")
+
+
+def view_function(views=DEFAULT_VIEWS):
+    """
+    Compiled function mapping a batch of slices (N, H, W) to all views, (K * N, H, W, 1) view-major.
+
+    Cached per view tuple, so every scan reuses the same traced graph.
+    """
+    views = tuple(v.lstrip('_') for v in views)
+    if views not in _VIEW_FUNCTIONS:
+        ops = [view_op(v) for v in views]
+
+        @tf.function(reduce_retracing=True)
+        def make_views(batch):
+            x = tf.expand_dims(tf.convert_to_tensor(batch, dtype=tf.float32), -1)
+            return tf.concat([op(x) for op in ops], axis=0)
+        _VIEW_FUNCTIONS[views] = make_views
+    return _VIEW_FUNCTIONS[views]
+
+
+def make_views(slices, views=DEFAULT_VIEWS):
+    """All views of `slices` (N, H, W) as one (K * N, H, W, 1) tensor, view-major."""
+    with instrument.span('tta.make_views', slices=len(slices), views=len(views)):
+        return view_function(views)(np.asarray(slices, dtype=np.float32))
+
+
+def reduce_views(outputs, n_views):
+    """
+    Average view-major model outputs ({name: (K * N, ...)}) over the K views.
+
+    Returns the averaged outputs and the across-view variance of the class-1 probability (N,).
+    """
+    stacked = {name: np.asarray(array).reshape((n_views, -1) + np.shape(array)[1:]) for name, array in outputs.items()}
+    reduced = {name: array.mean(axis=0) for name, array in stacked.items()}
+    return reduced, stacked['probs'][..., 1].var(axis=0)
+
+
+def tta_report(single_df, tta_df, alpha=0.1, num_select=42, n_runs=20):
+    """
+    Coverage / set-size trade-off of TTA against single-view predictions of the same scans.
+
+    Returns the medians over `n_runs` shared calibration/test splits per model and mode
+    (marginal / class-conditional; overall and per class), plus a 'tta - single' row per mode.
+    """
+    cov = quantize.coverage_comparison(single_df, tta_df, alpha=alpha, num_select=num_select, n_runs=n_runs,
+                                       names=('single', 'tta'))
+    value_cols = [c for c in cov.columns if c.startswith(('coverage', 'ps_size'))]
+    medians = cov.groupby(['class_conditional', 'model'])[value_cols].median()
+    deltas = (medians.xs('tta', level='model') - medians.xs('single', level='model')).assign(model='tta - single')
+    report = pd.concat([medians.reset_index(), deltas.reset_index()], ignore_index=True)
+    return report.sort_values(['class_conditional', 'model'], ignore_index=True)
+
+
+def time_views(scan_dirs, class_labels, model, ks=(1, 2, 4, 7), views=DEFAULT_VIEWS):
+    """
+    Wall time of `util.predict_scans` with the first k of `views` for each k in `ks`
+    (k = 0: single-view inference without TTA), after a warm-up call per setting.
+    """
+    rows = []
+    for k in ks:
+        tta_views = views[:k] if k else None
+        with util.NoOutput():
+            util.predict_scans(scan_dirs[:1], class_labels[:1], model, tta_views=tta_views)   # graph tracing
+            start = time.perf_counter()
+            util.predict_scans(scan_dirs, class_labels, model, tta_views=tta_views)
+            seconds = time.perf_counter() - start
+        rows.append({'k': k, 'views': ','.join(tta_views or ()), 'seconds': seconds})
+    timing = pd.DataFrame(rows)
+    base = timing.loc[timing['k'] == timing['k'].min(), 'seconds'].iloc[0]
+    timing['relative_time'] = timing['seconds'] / base
+    timing['time_per_view'] = timing['seconds'] / timing['k'].clip(lower=1)
+    return timing
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--scans', required=True, help='text file with one scan directory per line')
+    parser.add_argument('--views', default=','.join(DEFAULT_VIEWS), help='comma-separated view specs')
+    parser.add_argument('--ks', default='0,1,2,4,7', help='view counts to time (0 = no TTA)')
+    parser.add_argument('--alpha', type=float, default=0.1)
+    parser.add_argument('--n-runs', type=int, default=20)
+    parser.add_argument('--output', default='tta', help='output prefix for <prefix>__coverage.csv / __timing.csv')
+    args = parser.parse_args()
+
+    util.set_seeds()
+    model = tf.keras.models.load_model(args.model)
+    scan_dirs = util.read_paths_from_file(args.scans)
+    class_labels = [1 if 'MS' in x else 0 for x in scan_dirs]   # as in the 9-1 notebooks
+    views = tuple(v.strip() for v in args.views.split(','))
+
+    with util.NoOutput():
+        single_df = util.predict_scans(scan_dirs, class_labels, model)
+        tta_df = util.predict_scans(scan_dirs, class_labels, model, tta_views=views)
+    report = tta_report(single_df, tta_df, alpha=args.alpha, n_runs=args.n_runs)
+    report.to_csv(f'{args.output}__coverage.csv', index=False)
+
+    ks = [k for k in (int(k) for k in args.ks.split(',')) if k <= len(views)]
+    timing = time_views(scan_dirs, class_labels, model, ks=ks, views=views)
+    timing.to_csv(f'{args.output}__timing.csv', index=False)
+
+    print(report.to_string(index=False))
+    print(timing.to_string(index=False))
+
+
+if __name__ == '__main__': # best practice to prevent execution on import
+    main()
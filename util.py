@@ -1,59 +1,93 @@
 import os
 import glob
-import random
-import re
 import numpy as np
 import pandas as pd
-from PIL import Image
-import tensorflow as tf
-import sys
-
-
-SEED = 42
-def set_seeds():
-    # Seed for reproducibility
-    # Set the seed for the Python random module
-    random.seed(SEED)
-    # Set the seed for NumPy
-    np.random.seed(SEED)
-    # Ensure reproducibility with certain environment variables
-    os.environ['PYTHONHASHSEED'] = str(SEED)
-    # sets the TensorFlow seed
-    tf.keras.utils.set_random_seed(SEED)
-    # determinism in TensorFlow OPS for reproducibility
-    tf.config.experimental.enable_op_determinism()
-
-# Redirect sys.stdout to suppress progress bars
-class NoOutput:
-    def __enter__(self):
-        self._original_stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
-    def __exit__(self, exc_type, exc_value, traceback):
-        sys.stdout.close()
-        sys.stdout = self._original_stdout
+
+import analysis
+import instrument
+# the NumPy/pandas-only helpers live in `analysis`; re-exported so `util.<name>` keeps working
+from analysis import (
+    SEED, NoOutput, min_max_normalize_np, preprocess_slice_np, array_store_path, open_array_store,
+    load_array_store, prediction_frame, write_paths_to_file, read_paths_from_file,
+    add_relative_slice_idx_col, extract_data_variant, parse_model_and_add_data_variant_col,
+    select_calibration_ids_with_class_check,
+)
+
+# Model / IO layer. TensorFlow, Pillow and `augment` (SciPy, scikit-image) are imported inside the
+# functions that use them, so importing `util` (or `conformal`) stays cheap for sweep workers.
+
+
+def set_seeds(tensorflow=True, deterministic=True):
+    """
+    Seed Python, NumPy and (unless `tensorflow=False`) TensorFlow.
+
+    `deterministic=False` keeps TF's fast (possibly non-deterministic) kernels; see `fast_inference`.
+    Once enabled, TF op determinism stays on for the rest of the process.
+    """
+    analysis.set_seeds()
+    if tensorflow:
+        import tensorflow as tf
+        # sets the TensorFlow seed
+        tf.keras.utils.set_random_seed(SEED)
+        if deterministic:
+            # determinism in TensorFlow OPS for reproducibility
+            tf.config.experimental.enable_op_determinism()
+
+def configure_inference_threads(intra_op_threads=0, inter_op_threads=0):
+    """
+    Size TF's intra-op (within a conv) and inter-op (independent ops) thread pools; 0 = TF's default
+    (all cores). Only takes effect before TF runs its first op; returns whether it was applied.
+    """
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        print(f"TF thread settings not applied (runtime already initialized): {e}")
+        return False
+    return True
+
+def fast_inference(intra_op_threads=0, inter_op_threads=0):
+    """
+    Inference mode for throughput: seeded, multi-threaded, without forcing deterministic kernels.
+
+    Call once at the start of the process, instead of `set_seeds()`, before any model is loaded.
+    Outputs can differ from a deterministic run in the last float32 bits; `inference_check`
+    verifies that they agree within tolerance at the level of predictions and conformal coverage.
+    """
+    applied = configure_inference_threads(intra_op_threads, inter_op_threads)
+    set_seeds(deterministic=False)
+    return applied
 
 def load_2d_array_from_slice_png(png_path):
+    from PIL import Image
     return np.array(Image.open(png_path).convert('L'))
 
-def load_slices_from_dir(scan_dir):
+def load_slices_from_dir(scan_dir, variant=None, cache=None):
     slice_files = glob.glob(f'{scan_dir}/*.png')
+    if variant is not None:
+        import augment
+        # generate the variant on the fly from the baseline pixels (see augment.parse_variant)
+        return [augment.load_variant_slice(file, variant, cache) for file in slice_files]
     return [load_2d_array_from_slice_png(file) for file in slice_files]
 
-def load_slices_from_dir_and_label_lists(scan_folder_list, label_list):
+def load_slices_from_dir_and_label_lists(scan_folder_list, label_list, variant=None, cache=None):
     all_slices = []
     all_labels = []
     for scan_dir, label in zip(scan_folder_list, label_list):
-        slices = load_slices_from_dir(scan_dir)
+        slices = load_slices_from_dir(scan_dir, variant, cache)
         all_slices.extend(slices)
         all_labels.extend([label] * len(slices))
     return np.array(all_slices), np.array(all_labels)
 
 # resize a 2D image to the target size (using TF)
+@instrument.traced('util.resize_image')
 def resize_image(image, target_size=(192, 192)):
     """
     Resizes a 2D image to the target_size.
     Converts the image to a tensor, resizes it, and converts it back to a numpy array.
     """
+    import tensorflow as tf
     image_tensor = tf.convert_to_tensor(image, dtype=tf.float32)
     # If image is grayscale without channel dimension, add one temporarily
     if len(image_tensor.shape) == 2:
@@ -66,32 +100,26 @@ def resize_image(image, target_size=(192, 192)):
 
 def min_max_normalize(tensor):
     """Min-max normalizes a tensor."""
+    import tensorflow as tf
     min_val = tf.reduce_min(tensor)
     max_val = tf.reduce_max(tensor)
     return (tensor - min_val) / (max_val - min_val)  
 
-def min_max_normalize_np(image):
-    return (image - image.min()) / (image.max() - image.min())
-
 def preprocess_slice(image):
     image = image.astype(np.float32)
     return min_max_normalize(image)
 
-def preprocess_slice_np(image):
-    image = image.astype(np.float32)
-    return min_max_normalize_np(image)
-
-# --- load slices from one scan and record metadata ---
-def load_slices_from_scan(scan_dir, resize=False):
+# --- slice files of one scan and their metadata ---
+def slice_files_with_metadata(scan_dir):
     """
-    For a given scan directory, load all .png slices and extract metadata.
+    The .png slice files of a scan directory and their metadata ({dataset, scan_id, slice_idx}).
     Assumes that the directory structure is like:
       .../MRI/<prefix>__<dataset>/<scan_id>
     and that each slice image is named like "slice_066.png" (slice index).
     """
     # Get all png files in the scan directory
     slice_files = glob.glob(os.path.join(scan_dir, '*.png'))
-    
+
     # Extract dataset and scan_id from the path.
     # For example: ./MRI/_MS__ISBI_3T_test/01_01
     # we split the path and take the last two parts.
@@ -100,63 +128,79 @@ def load_slices_from_scan(scan_dir, resize=False):
     dataset_dir = parts[-2]
     # last folder (e.g., "01_01")
     scan_id = parts[-1]
-    
+
     # Clean the dataset name by taking the part after "__"
     dataset = dataset_dir.split("__")[-1]
-    
+
     # For some datasets (e.g., healthy scans) the scan_id might have a prefix like "Guys-"
     # Remove any non-numeric prefix if desired.
     if "-" in scan_id:
         scan_id = scan_id.split("-")[-1]
-    
-    slices = []
+
     metadata = []
     for slice_file in slice_files:
         # Get the slice index from the filename (e.g., 66 from "slice_066.png")
         slice_idx = int(os.path.splitext(os.path.basename(slice_file))[0].split('_')[-1])
+        metadata.append({
+            'dataset': dataset,
+            'scan_id': scan_id,
+            'slice_idx': slice_idx
+        })
+    return slice_files, metadata
+
+# --- load slices from one scan and record metadata ---
+def load_slices_from_scan(scan_dir, resize=False):
+    """
+    For a given scan directory, load all .png slices and extract metadata
+    (see `slice_files_with_metadata`).
+    """
+    slice_files, metadata = slice_files_with_metadata(scan_dir)
+    slices = []
+    for slice_file in slice_files:
         # Load and preprocess the image
         image = load_2d_array_from_slice_png(slice_file)
         image = preprocess_slice(image)
         if resize:
             image = resize_image(image, target_size=(192, 192))
         slices.append(image)
-        metadata.append({
-            'dataset': dataset,
-            'scan_id': scan_id,
-            'slice_idx': slice_idx
-        })
     return slices, metadata
 
-def load_slices_from_scan_np(scan_dir, resize=False):
+@instrument.traced('util.load_slices_from_scan_np')
+def load_slices_from_scan_np(scan_dir, resize=False, variant=None, cache=None):
     """
     Loads slices and metadata from a scan directory.
+
+    If `variant` is given (e.g. '_blurred_SD2', '_contrast_histeq', '_gamma_0.8'; see
+    `augment.parse_variant`), `scan_dir` is a baseline scan and the variant is generated
+    on load from its pixels, optionally reusing an `augment.VariantCache`.
     """
-    slice_files = glob.glob(os.path.join(scan_dir, '*.png'))
-    parts = scan_dir.split(os.sep)
-    dataset_dir = parts[-2]
-    scan_id = parts[-1]
-    dataset = dataset_dir.split("__")[-1]
-    if "-" in scan_id:
-        scan_id = scan_id.split("-")[-1]
-    
+    slice_files, metadata = slice_files_with_metadata(scan_dir)
     slices = []
-    metadata = []
     for slice_file in slice_files:
-        slice_idx = int(os.path.splitext(os.path.basename(slice_file))[0].split('_')[-1])
         # Load slice image
-        image = load_2d_array_from_slice_png(slice_file)
+        with instrument.span('util.load_slice.decode'):
+            if variant is not None:
+                import augment
+                image = augment.load_variant_slice(slice_file, variant, cache)
+            else:
+                image = load_2d_array_from_slice_png(slice_file)
         # Use NumPy-based preprocessing
-        image = preprocess_slice_np(image)
+        with instrument.span('util.load_slice.normalize'):
+            image = preprocess_slice_np(image)
         if resize:
             image = resize_image(image, target_size=(192, 192))
         slices.append(image)
-        metadata.append({
-            'dataset': dataset,
-            'scan_id': scan_id,
-            'slice_idx': slice_idx
-        })
+    instrument.count('util.slices_loaded', len(slices))
     return slices, metadata
 
+def load_raw_slices_from_scan(scan_dir):
+    """
+    Loads the raw uint8 slices and metadata from a scan directory
+    (as `load_slices_from_scan_np`, without normalization).
+    """
+    slice_files, metadata = slice_files_with_metadata(scan_dir)
+    return [load_2d_array_from_slice_png(slice_file) for slice_file in slice_files], metadata
+
 # def predict_scans(scan_dirs, class_labels, model):
 #     """
 #     For each scan directory, load slices, resize slices to (192, 192), perform batch predictions 
@@ -199,7 +243,94 @@ def load_slices_from_scan_np(scan_dir, resize=False):
     
 #     df = pd.DataFrame(results)
 #     return df
-def predict_scans(scan_dirs, class_labels, model, include_logits=False, include_embeddings=False):
+def create_model(input_shape=(192, 192, 1), width=1.0):
+    """
+    The slice classifier architecture of the training notebook (step 8), randomly initialized.
+
+    `width` scales the number of filters of every conv block (1.0 = the trained models);
+    layer names are unchanged, so `build_prediction_model` works on any width.
+    """
+    import tensorflow as tf
+    layers = tf.keras.layers
+    filters = lambda n: max(1, int(round(n * width)))
+    inputs = layers.Input(shape=input_shape)
+
+    x = layers.Conv2D(filters=filters(50), kernel_size=(11, 11), strides=4, activation=None, name='conv1')(inputs)
+    x = layers.BatchNormalization(name='bn1')(x)
+    x = layers.Activation('relu', name='relu1')(x)
+    x = layers.MaxPooling2D(pool_size=(3, 3), strides=2, name='pool1')(x)
+
+    x = layers.Conv2D(filters=filters(256), kernel_size=(5, 5), strides=1, activation=None, name='conv2')(x)
+    x = layers.BatchNormalization(name='bn2')(x)
+    x = layers.Activation('relu', name='relu2')(x)
+    x = layers.MaxPooling2D(pool_size=(3, 3), strides=2, name='pool2')(x)
+
+    x = layers.Conv2D(filters=filters(512), kernel_size=(3, 3), strides=1, activation=None, name='conv3')(x)
+    x = layers.BatchNormalization(name='bn3')(x)
+    x = layers.Activation('relu', name='relu3')(x)
+
+    x = layers.Conv2D(filters=filters(1024), kernel_size=(2, 2), strides=1, activation=None, name='conv4')(x)
+    x = layers.BatchNormalization(name='bn4')(x)
+    x_dropout = layers.Dropout(0.5, name='dropout_conv4')(x)
+
+    x_logits = layers.Conv2D(filters=2, kernel_size=(1, 1), strides=1, activation=None, name='conv_logits')(x_dropout)
+    x_logits = layers.BatchNormalization(name='bn_logits')(x_logits)
+    logits = layers.GlobalMaxPooling2D(name='logits')(x_logits)
+    predictions = layers.Activation('softmax', name='softmax')(logits)
+    return tf.keras.Model(inputs=inputs, outputs=predictions, name='cnn_model')
+
+def build_prediction_model(model, include_logits=False, include_embeddings=False):
+    """
+    Wrap `model` so one forward pass returns every requested output.
+
+    Returns the wrapped model and the names of its outputs (in output order):
+    'embeddings' (1024-d max-pooled `dropout_conv4`), 'logits' and 'probs' (softmax, always last).
+    """
+    import tensorflow as tf
+    outputs = {}
+    if include_embeddings:
+        outputs['embeddings'] = tf.keras.layers.GlobalMaxPooling2D(name='embeddings')(model.get_layer('dropout_conv4').output)
+    if include_logits:
+        outputs['logits'] = model.get_layer('logits').output
+    outputs['probs'] = model.output  # Softmax predictions always included
+
+    intermediate_model = tf.keras.Model(inputs=model.input, outputs=list(outputs.values()))
+    return intermediate_model, list(outputs)
+
+def predict_named_outputs(intermediate_model, output_names, batch, batch_size=None):
+    """Run `batch` through a model from `build_prediction_model` and return {output name: array}."""
+    kwargs = {} if batch_size is None else {'batch_size': batch_size}
+    predictions = intermediate_model.predict(batch, **kwargs)
+    if len(output_names) == 1:
+        predictions = [predictions]
+    return dict(zip(output_names, predictions))
+
+class TFLiteClassifier:
+    """
+    `model.predict`-compatible wrapper around a (quantized) TFLite slice classifier.
+
+    Only the softmax output is available, so logits/embeddings cannot be requested.
+    """
+    def __init__(self, model_path, num_threads=None):
+        import tensorflow as tf
+        self.model_path = model_path
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.input_shape = tuple(self.interpreter.get_input_details()[0]['shape'][1:])
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+
+    def predict(self, batch, batch_size=None):
+        # the interpreter always runs the whole batch in one invocation (`batch_size` is ignored)
+        batch = np.asarray(batch, dtype=np.float32).reshape((len(batch),) + self.input_shape)
+        self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+        self.interpreter.allocate_tensors()
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index).copy()
+
+@instrument.traced('util.predict_scans', profile=True)
+def predict_scans(scan_dirs, class_labels, model, include_logits=False, include_embeddings=False, array_store=None,
+                  tflite_model=None, variant=None, variant_cache=None, tta_views=None):
     """
     Predict scan slices and return a DataFrame with optional logits and embeddings.
 
@@ -209,45 +340,65 @@ def predict_scans(scan_dirs, class_labels, model, include_logits=False, include_
       model: A TensorFlow model for making predictions.
       include_logits (bool): Whether to include logits in output.
       include_embeddings (bool): Whether to include embeddings in output.
+      array_store (str, optional): Path prefix for a columnar float32 store. When given, embeddings
+        and logits are written to `<prefix>__embeddings.npy` / `<prefix>__logits.npy` (see
+        `load_array_store`) instead of per-row Python lists, and the DataFrame gains a `row`
+        column indexing into those matrices.
+      tflite_model (str or TFLiteClassifier, optional): Run inference through a TFLite interpreter
+        (e.g. an int8/float16 export from `quantize.export_tflite_model`) instead of `model`.
+        Only softmax outputs are available in this mode.
+      variant (str, optional): Variant spec generated on load from the baseline `scan_dirs`
+        (see `load_slices_from_scan_np`) instead of reading a materialized variant tree.
+      variant_cache (augment.VariantCache, optional): Bounded cache for generated variants.
+      tta_views (sequence of str, optional): Test-time augmentation views (e.g. `tta.DEFAULT_VIEWS`).
+        All views of a scan's slices run through the model as one batch; outputs are averaged
+        over the views and the DataFrame gains `tta_var` (variance of the class-1 probability).
 
     Returns:
       pd.DataFrame: DataFrame with prediction results.
     """
     all_results = []
-
-    # Build intermediate outputs explicitly
-    intermediate_outputs = []
-
-    if include_embeddings:
-        embedding_output = tf.keras.layers.GlobalMaxPooling2D(name='embeddings')(model.get_layer('dropout_conv4').output)
-        intermediate_outputs = [embedding_output]
-
-    if include_logits:
-        intermediate_outputs.append(model.get_layer('logits').output)
-
-    intermediate_outputs.append(model.output)  # Softmax predictions always included
-
-    intermediate_model = tf.keras.Model(inputs=model.input, outputs=intermediate_outputs)
+    if tta_views is not None:
+        import tta
+
+    if tflite_model is not None:
+        if include_logits or include_embeddings:
+            raise ValueError("TFLite inference only provides softmax outputs (no logits/embeddings).")
+        if isinstance(tflite_model, str):
+            tflite_model = TFLiteClassifier(tflite_model)
+        intermediate_model, output_names = tflite_model, ['probs']
+    else:
+        intermediate_model, output_names = build_prediction_model(model, include_logits, include_embeddings)
+
+    store = None
+    if array_store is not None:
+        widths = {name: int(intermediate_model.get_layer(name).output.shape[-1])
+                  for name in output_names if name != 'probs'}
+        n_rows = sum(len(glob.glob(os.path.join(scan_dir, '*.png'))) for scan_dir in scan_dirs)
+        if n_rows == 0:
+            raise ValueError(f"No slices (*.png) found in the {len(scan_dirs)} scan directories; nothing to write to {array_store}.")
+        store = open_array_store(array_store, n_rows, widths)
+    row = 0
 
     for scan_dir, actual_class in zip(scan_dirs, class_labels):
-        slices, meta = load_slices_from_scan_np(scan_dir)
-        slices_resized = np.array([resize_image(slice_img, (192, 192)) for slice_img in slices])
+        slices, meta = load_slices_from_scan_np(scan_dir, variant=variant, cache=variant_cache)
+        with instrument.span('predict_scans.resize', slices=len(slices)):
+            slices_resized = np.array([resize_image(slice_img, (192, 192)) for slice_img in slices])
 
-        predictions = intermediate_model.predict(slices_resized)
-
-        idx = 0
-        if include_embeddings:
-            embeddings_pred = predictions[idx]
-            idx += 1
-
-        if include_logits:
-            logits_pred = predictions[idx]
-            idx += 1
-
-        if include_embeddings or include_logits:
-            pred_probs = predictions[idx]
+        if tta_views is None:
+            with instrument.span('predict_scans.predict', slices=len(slices)):
+                outputs = predict_named_outputs(intermediate_model, output_names, slices_resized)
         else:
-            pred_probs = predictions
+            views = tta.make_views(slices_resized, tta_views)
+            with instrument.span('predict_scans.predict', slices=len(slices), views=len(tta_views)):
+                outputs = predict_named_outputs(intermediate_model, output_names, views, batch_size=len(views))
+            outputs, tta_var = tta.reduce_views(outputs, len(tta_views))
+        pred_probs = outputs['probs']
+        instrument.count('predict_scans.slices', len(pred_probs))
+
+        if store is not None:
+            for name, array in store.items():
+                array[row:row + len(pred_probs)] = outputs[name]
 
         for i, probs in enumerate(pred_probs):
             result = meta[i].copy()
@@ -262,61 +413,108 @@ def predict_scans(scan_dirs, class_labels, model, include_logits=False, include_
                 'actual_class_pred_prob': float(probs[actual_class]),
             })
 
+            if tta_views is not None:
+                result['tta_var'] = float(tta_var[i])
+
             if include_logits:
                 result.update({
-                    'logit_0': float(predictions[idx - (2 if include_embeddings else 1)][i][0]),
-                    'logit_1': float(predictions[idx - 1][i][1]),
+                    'logit_0': float(outputs['logits'][i][0]),
+                    'logit_1': float(outputs['logits'][i][1]),
                 })
 
-            if include_embeddings:
-                result['embedding'] = embeddings_pred[i].tolist()
+            if store is not None:
+                result['row'] = row + i
+            elif include_embeddings:
+                result['embedding'] = outputs['embeddings'][i].tolist()
 
             all_results.append(result)
+        row += len(pred_probs)
 
-    return pd.DataFrame(all_results)
+    df = pd.DataFrame(all_results)
 
-def write_paths_to_file(file_path, paths):
-    with open(file_path, "w") as f:
-        f.writelines(f"{path}\n" for path in paths)
+    if store is not None:
+        for array in store.values():
+            array.flush()
+        df[['dataset', 'scan_id', 'slice_idx', 'row']].to_csv(f'{array_store}__index.csv', index=False)
 
-def read_paths_from_file(file_path):
-    with open(file_path, "r") as f:
-        paths_read = [line.strip() for line in f]
-    return paths_read
+    return df
 
-def add_relative_slice_idx_col(df):
-    df['relative_slice_idx'] = df.groupby('scan_id')['slice_idx'].transform(lambda x: x - x.min())
+def corresponding_variant_scan_dirs(baseline_scan_dirs, variant_root):
+    """
+    Map baseline scan directories (`.../<dataset_dir>/<scan>`) onto the same scans inside a
+    variant tree (`<variant_root>/<dataset_dir>/<scan>`), e.g. variant_root='_blurred_SD1'.
+    Raises if a baseline scan has no counterpart in the variant tree.
+    """
+    variant_dirs = []
+    for path in baseline_scan_dirs:
+        parts = os.path.normpath(path).split(os.sep)
+        variant_dir = os.path.join(variant_root, parts[-2], parts[-1])
+        if not os.path.isdir(variant_dir):
+            raise FileNotFoundError(f"No variant scan {variant_dir} for baseline scan {path}")
+        variant_dirs.append(variant_dir)
+    return variant_dirs
+
+def predict_scans_multi(scan_dirs, class_labels, models, variants=('baseline',), variant_root='.', batch_scans=4,
+                        lazy_variants=False):
+    """
+    Predict every (model, variant) pair while reading each scan variant from disk only once.
 
-def extract_data_variant(model_str):
-    patterns = ['baseline', 'blurred_SD[1-4]', 'contrast_(?:imadjust|histeq|adapthisteq)']
-    match = re.search('|'.join(patterns), model_str)
-    return match.group(0) if match else None
+    Scans are processed in batches of `batch_scans`; for each batch, the slices of every
+    requested variant are loaded and resized once into one in-memory tensor, which every
+    model then scores in a single `predict` call. Seeds are set once for the whole run.
 
-def parse_model_and_add_data_variant_col(df, model):
-    df = df.copy()
-    df['model'] = model
-    df['data_variant'] = df['model'].apply(extract_data_variant)
-    return df #.drop('model', axis=1)
+    Parameters:
+      scan_dirs (list of str): Baseline scan directories.
+      class_labels (list of int): The true class label for each scan (0 or 1).
+      models (dict): Model name -> TF model (or path to a `.keras` file, or `TFLiteClassifier`).
+      variants (list of str): 'baseline' and/or variant tree names (e.g. '_blurred_SD1'),
+        resolved with `corresponding_variant_scan_dirs` under `variant_root`.
+      variant_root (str): Directory that contains the variant trees.
+      batch_scans (int): Number of scans whose variants are held in memory at once.
+      lazy_variants (bool): Generate each variant from the baseline pixels on load
+        (`augment.parse_variant` specs, so new shifts such as '_gamma_0.8' need no variant tree)
+        instead of reading the materialized variant trees.
 
-def select_calibration_ids_with_class_check(ids_cal, st, NUM_SELECT, run, max_attempts=1000):
-    """
-    Try up to `max_attempts` times to sample calibration IDs that include both classes.
-    Increments the seed by 1000 on each retry attempt.
+    Returns:
+      pd.DataFrame: Long-format table with the `predict_scans` columns plus
+        `variant_test_data` and `model`.
     """
-    for attempt in range(max_attempts):
-        current_seed = run + attempt * 1000
-        rng = np.random.default_rng(current_seed)
-        cal_ids = rng.choice(ids_cal, NUM_SELECT, replace=False)
-
-        # Check if both classes are present in the selected calibration set
-        cal_slice = st.cal_df.query("scan_id in @cal_ids")
-        classes_present = cal_slice['class'].unique()
-
-        if set(classes_present) >= {0, 1}:
-            return cal_ids, current_seed  # Successful sample with both classes
-
-    # If no valid sample found after all attempts, raise an error
-    raise ValueError(
-        f"Unable to select calibration IDs with both classes present after {max_attempts} attempts for run {run}."
-    )
+    import tensorflow as tf
+    import augment
+    set_seeds()
+    models = {name: tf.keras.models.load_model(m) if isinstance(m, str) else m for name, m in models.items()}
+
+    variant_dirs = {
+        variant: list(scan_dirs) if variant == 'baseline' or lazy_variants
+        else corresponding_variant_scan_dirs(scan_dirs, os.path.join(variant_root, variant))
+        for variant in variants
+    }
+
+    frames = []
+    for start in range(0, len(scan_dirs), batch_scans):
+        batch, meta, classes = [], [], []
+        for i in range(start, min(start + batch_scans, len(scan_dirs))):
+            if lazy_variants:
+                # decode the baseline slices once and derive every variant from them
+                raw_slices, raw_meta = load_raw_slices_from_scan(scan_dirs[i])
+            for variant in variants:
+                if lazy_variants:
+                    op = augment.parse_variant(variant)
+                    slices = [preprocess_slice_np(img if op is None else op(img)) for img in raw_slices]
+                    scan_meta = raw_meta
+                else:
+                    slices, scan_meta = load_slices_from_scan_np(variant_dirs[variant][i])
+                batch.extend(resize_image(slice_img, (192, 192)) for slice_img in slices)
+                meta.extend(dict(m, variant_test_data=variant) for m in scan_meta)
+                classes.extend([class_labels[i]] * len(slices))
+        batch = np.array(batch)
+
+        for name, model in models.items():
+            df = prediction_frame(meta, model.predict(batch), classes)
+            df['model'] = name
+            frames.append(df)
+
+    columns = ['dataset', 'scan_id', 'slice_idx', 'class', 'predicted_class', 'is_correct',
+               'pred_prob_0', 'pred_prob_1', 'actual_class_pred_prob', 'variant_test_data', 'model']
+    return pd.concat(frames, ignore_index=True)[columns]
 